@@ -1,89 +1,165 @@
-from typing import List
+import asyncio
+import json
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import delete, select, update
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, delete, func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 
-from app.database import get_db
+from app.database import AsyncSessionLocal, get_async_db
 from app.models.chat import ChatMessage, ChatSession
+from app.models.report import Report, ReportJob
 from app.models.user import User
 from app.schemas.chat import (
     ChatMessageCreate,
     ChatMessageResponse,
     ChatSessionCreate,
     ChatSessionResponse,
+    ChatSessionSummary,
     ChatSessionUpdate,
 )
+from app.services.context_builder import build_context, update_session_summary
 from app.services.multi_ai_service import ai_service
 from app.utils.auth import get_current_active_user
 
 router = APIRouter()
 
+# 分页配置
+SESSION_PAGE_MAX = 100
+MESSAGE_PAGE_DEFAULT = 100
+MESSAGE_PAGE_MAX = 500
+MESSAGE_PREVIEW_LENGTH = 100
+
+
+async def get_user_session(db: AsyncSession, session_id: int, user_id: int, with_messages: bool = False):
+    """获取属于当前用户的会话（可选同时加载消息）"""
+    stmt = select(ChatSession).where(
+        ChatSession.id == session_id,
+        ChatSession.user_id == user_id
+    )
+    if with_messages:
+        # 异步会话中不能隐式懒加载，需要显式加载消息
+        stmt = stmt.options(selectinload(ChatSession.messages)).execution_options(populate_existing=True)
+    result = await db.execute(stmt)
+    return result.scalars().first()
+
 
 @router.post("/sessions", response_model=ChatSessionResponse)
-def create_chat_session(
+async def create_chat_session(
     session: ChatSessionCreate,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     db_session = ChatSession(
         user_id=current_user.id,
         title=session.title
     )
     db.add(db_session)
-    db.commit()
-    db.refresh(db_session)
-    return db_session
+    await db.commit()
+    return await get_user_session(db, db_session.id, current_user.id, with_messages=True)
 
 
-@router.get("/sessions", response_model=List[ChatSessionResponse])
-def get_chat_sessions(
+@router.get("/sessions", response_model=List[ChatSessionSummary])
+async def get_chat_sessions(
+    response: Response,
+    limit: int = Query(50, ge=1, le=SESSION_PAGE_MAX),
+    before: Optional[int] = Query(None, description="上一页最后一个会话的ID"),
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-
-    sessions = db.query(ChatSession).filter(ChatSession.user_id == current_user.id).all()
-    return sessions
+    """按 updated_at 倒序分页获取会话摘要（不加载消息内容）
+
+    下一页的游标通过 X-Next-Cursor 响应头返回，作为 before 参数传入。
+    """
+    stmt = select(
+        ChatSession.id, ChatSession.title, ChatSession.created_at, ChatSession.updated_at
+    ).where(ChatSession.user_id == current_user.id)
+
+    if before is not None:
+        # 键集分页：在数据库中比较游标会话的 updated_at，避免时间格式和精度差异
+        cursor_updated_at = select(ChatSession.updated_at).where(
+            ChatSession.id == before,
+            ChatSession.user_id == current_user.id
+        ).scalar_subquery()
+        stmt = stmt.where(or_(
+            ChatSession.updated_at < cursor_updated_at,
+            and_(ChatSession.updated_at == cursor_updated_at, ChatSession.id < before)
+        ))
+
+    stmt = stmt.order_by(ChatSession.updated_at.desc(), ChatSession.id.desc()).limit(limit + 1)
+    rows = (await db.execute(stmt)).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if has_more:
+        response.headers["X-Next-Cursor"] = str(rows[-1].id)
+
+    # 一次分组查询取本页所有会话的消息数和最后一条消息，避免 N+1
+    session_ids = [row.id for row in rows]
+    stats = {}
+    previews = {}
+    if session_ids:
+        result = await db.execute(
+            select(ChatMessage.session_id, func.count(ChatMessage.id), func.max(ChatMessage.id))
+            .where(ChatMessage.session_id.in_(session_ids))
+            .group_by(ChatMessage.session_id)
+        )
+        stats = {session_id: (count, last_id) for session_id, count, last_id in result.all()}
+
+        last_ids = [last_id for _, last_id in stats.values()]
+        if last_ids:
+            result = await db.execute(
+                select(ChatMessage.session_id, func.substr(ChatMessage.content, 1, MESSAGE_PREVIEW_LENGTH))
+                .where(ChatMessage.id.in_(last_ids))
+            )
+            previews = dict(result.all())
+
+    return [
+        ChatSessionSummary(
+            id=row.id,
+            title=row.title,
+            created_at=row.created_at,
+            updated_at=row.updated_at,
+            message_count=stats.get(row.id, (0, None))[0],
+            last_message_preview=previews.get(row.id)
+        )
+        for row in rows
+    ]
 
 
 @router.get("/sessions/{session_id}", response_model=ChatSessionResponse)
-def get_chat_session(
+async def get_chat_session(
     session_id: int,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     from datetime import datetime
 
-    session = db.query(ChatSession).filter(
-        ChatSession.id == session_id,
-        ChatSession.user_id == current_user.id
-    ).first()
+    session = await get_user_session(db, session_id, current_user.id, with_messages=True)
     if not session:
         raise HTTPException(status_code=404, detail="会话不存在")
 
     # 修复updated_at为None的情况
     if session.updated_at is None:
         session.updated_at = session.created_at or datetime.now()
-        db.commit()
+        await db.commit()
 
     return session
 
 
 @router.delete("/sessions/{session_id}")
-def delete_chat_session(
+async def delete_chat_session(
     session_id: int,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     try:
         print(f"开始删除会话 {session_id}")
 
         # 验证会话所有权
-        stmt = select(ChatSession).where(
-            ChatSession.id == session_id,
-            ChatSession.user_id == current_user.id
-        )
-        session = db.execute(stmt).scalars().first()
+        session = await get_user_session(db, session_id, current_user.id)
 
         if not session:
             print(f"会话 {session_id} 不存在或不属于当前用户")
@@ -91,67 +167,74 @@ def delete_chat_session(
 
         print(f"找到会话: {session.title}")
 
-        # 先删除会话相关的所有消息
+        # 先删除会话相关的报告任务、报告记录和所有消息（SQLite 不会执行外键级联删除）
+        # 任务记录删除后，执行中的工作者无法再完成该任务，会放弃本次结果
+        result = await db.execute(select(Report.id).where(Report.session_id == session_id))
+        report_ids = list(result.scalars().all())
+        await db.execute(delete(ReportJob).where(ReportJob.session_id == session_id))
+        await db.execute(delete(Report).where(Report.session_id == session_id))
         stmt = delete(ChatMessage).where(ChatMessage.session_id == session_id)
-        db.execute(stmt)
+        await db.execute(stmt)
 
         # 删除会话
-        db.delete(session)
-        db.commit()
+        await db.delete(session)
+        await db.commit()
+
+        # 已删除报告的文本块不再参与检索
+        if report_ids and ai_service.vector_store:
+            await ai_service.vector_store.delete_reports(current_user.id, report_ids)
 
         return {"message": "会话删除成功"}
 
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"删除会话失败: {e}")
         raise HTTPException(status_code=500, detail=f"删除会话失败: {e!s}")
 
 
 @router.put("/sessions/{session_id}", response_model=ChatSessionResponse)
-def update_chat_session(
+async def update_chat_session(
     session_id: int,
     session_update: ChatSessionUpdate,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     # 验证会话所有权
-    session = db.query(ChatSession).filter(
-        ChatSession.id == session_id,
-        ChatSession.user_id == current_user.id
-    ).first()
+    session = await get_user_session(db, session_id, current_user.id)
 
     if not session:
         raise HTTPException(status_code=404, detail="会话不存在")
 
     # 更新会话标题
     session.title = session_update.title
-    db.commit()
-    db.refresh(session)
+    await db.commit()
 
-    return session
+    return await get_user_session(db, session_id, current_user.id, with_messages=True)
 
 
 @router.post("/messages", response_model=ChatMessageResponse)
 async def create_chat_message(
     message: ChatMessageCreate,
+    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     from datetime import datetime
 
-    # 获取会话历史
-    context = []
-    if message.session_id:
-        history = db.query(ChatMessage).filter(
-            ChatMessage.session_id == message.session_id
-        ).order_by(ChatMessage.created_at).all()
-        context = [{"role": msg.role, "content": msg.content} for msg in history]
+    # 根据用户设置创建AI服务实例
+    user_ai_service = ai_service.create_user_ai_service(current_user.settings)
 
+    # 按模型 token 预算获取会话上下文（最近消息原文 + 早期对话摘要）
+    context = await build_context(db, message.session_id, user_ai_service.model_name)
+    if context["needs_summary"]:
+        background_tasks.add_task(update_session_summary, message.session_id, user_ai_service)
+
+    if message.session_id:
         # 更新会话的 updated_at 字段
         stmt = update(ChatSession).where(ChatSession.id == message.session_id).values(updated_at=datetime.now())
-        db.execute(stmt)
+        await db.execute(stmt)
 
     # 保存用户消息
     user_message = ChatMessage(
@@ -160,12 +243,13 @@ async def create_chat_message(
         content=message.content
     )
     db.add(user_message)
-    db.commit()
+    await db.commit()
 
-    # 根据用户设置创建AI服务实例
-    ai_service.create_user_ai_service(current_user.settings)
     # 获取AI回复
-    ai_response = await ai_service.chat(message.content, context)
+    ai_response = await ai_service.chat(
+        message.content, context["messages"], service=user_ai_service, summary=context["summary"],
+        user_id=current_user.id
+    )
 
     # 保存AI回复
     ai_message = ChatMessage(
@@ -174,29 +258,131 @@ async def create_chat_message(
         content=ai_response
     )
     db.add(ai_message)
-    db.commit()
-    db.refresh(ai_message)
+    await db.commit()
+    await db.refresh(ai_message)
 
     return ai_message
 
 
+async def save_assistant_message(session_id: Optional[int], content: str) -> dict:
+    """保存AI回复并返回序列化后的消息（流式接口在生成结束或取消后调用）"""
+    async with AsyncSessionLocal() as db:
+        ai_message = ChatMessage(session_id=session_id, role="assistant", content=content)
+        db.add(ai_message)
+        await db.commit()
+        await db.refresh(ai_message)
+        return ChatMessageResponse.model_validate(ai_message).model_dump(mode="json")
+
+
+def format_sse(data: dict, event: str = "message") -> str:
+    """格式化为 Server-Sent Events 数据帧"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.post("/messages/stream")
+async def create_chat_message_stream(
+    message: ChatMessageCreate,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """流式聊天接口（SSE），逐个推送生成的文本片段，生成结束后保存AI回复"""
+    from datetime import datetime
+
+    # 根据用户设置创建AI服务实例
+    user_ai_service = ai_service.create_user_ai_service(current_user.settings)
+
+    # 按模型 token 预算获取会话上下文（最近消息原文 + 早期对话摘要）
+    context = await build_context(db, message.session_id, user_ai_service.model_name)
+    if context["needs_summary"]:
+        background_tasks.add_task(update_session_summary, message.session_id, user_ai_service)
+
+    if message.session_id:
+        # 更新会话的 updated_at 字段
+        stmt = update(ChatSession).where(ChatSession.id == message.session_id).values(updated_at=datetime.now())
+        await db.execute(stmt)
+
+    # 保存用户消息
+    user_message = ChatMessage(
+        session_id=message.session_id,
+        role="user",
+        content=message.content
+    )
+    db.add(user_message)
+    await db.commit()
+    await db.refresh(user_message)
+    user_message_data = ChatMessageResponse.model_validate(user_message).model_dump(mode="json")
+
+    async def event_stream():
+        yield format_sse(user_message_data, event="user_message")
+
+        tokens = []
+        error = None
+        try:
+            async for token in ai_service.astream(
+                message.content, context["messages"], service=user_ai_service, summary=context["summary"],
+                user_id=current_user.id
+            ):
+                tokens.append(token)
+                yield format_sse({"content": token}, event="token")
+        except Exception as e:
+            print(f"流式生成失败: {e!s}")
+            error = f"生成回复失败: {e!s}"
+        finally:
+            # 流结束（包括客户端断开）后保存已生成的AI回复；断开时生成器会被取消，保存过程不随之中断
+            ai_message_data = None
+            if tokens:
+                ai_message_data = await asyncio.shield(save_assistant_message(message.session_id, "".join(tokens)))
+
+        if error:
+            yield format_sse({"detail": error}, event="error")
+        yield format_sse(ai_message_data or {}, event="done")
+
+    return StreamingResponse(
+        event_stream(),
+        background=background_tasks,
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # 禁止 nginx 缓冲，保证首个 token 尽快到达
+        },
+    )
+
+
 @router.get("/sessions/{session_id}/messages", response_model=List[ChatMessageResponse])
-def get_chat_messages(
+async def get_chat_messages(
     session_id: int,
+    response: Response,
+    limit: int = Query(MESSAGE_PAGE_DEFAULT, ge=1, le=MESSAGE_PAGE_MAX),
+    before_id: Optional[int] = Query(None, description="向前翻页：返回此ID之前的消息"),
+    after_id: Optional[int] = Query(None, description="轮询新消息：返回此ID之后的消息"),
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
+    """按消息ID游标分页获取会话消息（结果按时间正序）
+
+    默认返回最新的 limit 条；还有更早的消息时，X-Next-Cursor 响应头给出下一页的 before_id。
+    """
     # 验证会话所有权
-    session = db.query(ChatSession).filter(
-        ChatSession.id == session_id,
-        ChatSession.user_id == current_user.id
-    ).first()
+    session = await get_user_session(db, session_id, current_user.id)
     if not session:
         raise HTTPException(status_code=404, detail="会话不存在")
 
-    messages = db.query(ChatMessage).filter(
-        ChatMessage.session_id == session_id
-    ).order_by(ChatMessage.created_at).all()
+    stmt = select(ChatMessage).where(ChatMessage.session_id == session_id)
+    if after_id is not None:
+        # 轮询只取新增消息
+        stmt = stmt.where(ChatMessage.id > after_id).order_by(ChatMessage.id).limit(limit)
+        return (await db.execute(stmt)).scalars().all()
+
+    if before_id is not None:
+        stmt = stmt.where(ChatMessage.id < before_id)
+    stmt = stmt.order_by(ChatMessage.id.desc()).limit(limit + 1)
+    messages = list((await db.execute(stmt)).scalars().all())
+
+    if len(messages) > limit:
+        messages = messages[:limit]
+        response.headers["X-Next-Cursor"] = str(messages[-1].id)
+    messages.reverse()
     return messages
 
 
@@ -204,41 +390,41 @@ def get_chat_messages(
 async def regenerate_chat_message(
     message_id: int,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     from datetime import datetime
 
     # 获取要重新生成的消息
-    ai_message = db.query(ChatMessage).filter(
-        ChatMessage.id == message_id,
-        ChatMessage.role == "assistant"
-    ).first()
+    result = await db.execute(
+        select(ChatMessage).where(
+            ChatMessage.id == message_id,
+            ChatMessage.role == "assistant"
+        )
+    )
+    ai_message = result.scalars().first()
 
     if not ai_message:
         raise HTTPException(status_code=404, detail="消息不存在或不是AI消息")
 
     # 验证会话所有权
-    session = db.query(ChatSession).filter(
-        ChatSession.id == ai_message.session_id,
-        ChatSession.user_id == current_user.id
-    ).first()
+    session = await get_user_session(db, ai_message.session_id, current_user.id)
 
     if not session:
         raise HTTPException(status_code=404, detail="会话不存在")
 
-    # 获取会话历史（不包括要重新生成的消息）
-    history = db.query(ChatMessage).filter(
-        ChatMessage.session_id == ai_message.session_id,
-        ChatMessage.created_at < ai_message.created_at
-    ).order_by(ChatMessage.created_at).all()
-
-    context = [{"role": msg.role, "content": msg.content} for msg in history]
-
     # 根据用户设置创建AI服务实例
-    ai_service.create_user_ai_service(current_user.settings)
+    user_ai_service = ai_service.create_user_ai_service(current_user.settings)
 
-    # 获取AI回复
-    ai_response = await ai_service.chat(ai_message.content, context)
+    # 获取会话上下文（不包括要重新生成的消息及之后的消息）
+    context = await build_context(
+        db, ai_message.session_id, user_ai_service.model_name, before_message_id=ai_message.id
+    )
+
+    # 获取AI回复（重新生成需要新的回答，不使用回复缓存）
+    ai_response = await ai_service.chat(
+        ai_message.content, context["messages"], service=user_ai_service, summary=context["summary"],
+        use_cache=False, user_id=current_user.id
+    )
 
     # 更新AI消息内容
     ai_message.content = ai_response
@@ -247,7 +433,7 @@ async def regenerate_chat_message(
     # 更新会话的 updated_at 字段
     session.updated_at = datetime.now()
 
-    db.commit()
-    db.refresh(ai_message)
+    await db.commit()
+    await db.refresh(ai_message)
 
     return ai_message
@@ -0,0 +1,459 @@
+"""
+聊天 WebSocket 通道
+一个连接只在建立时认证一次，之后在同一连接上发送消息、接收流式回复、重新生成回复和接收会话更新。
+
+客户端帧（JSON 文本）：
+    {"type": "auth", "token": "..."}                                   建连后的第一帧；令牌即将过期时可再次发送以续期
+    {"type": "send", "request_id": "...", "session_id": 1, "content": "..."}
+    {"type": "regenerate", "request_id": "...", "message_id": 2}
+    {"type": "cancel", "request_id": "..."}
+    {"type": "ping"} / {"type": "pong"}
+
+服务端帧：
+    ready、user_message、token、done、session_updated、error、ping、pong，生成相关的帧带上请求的 request_id。
+
+背压：所有下行帧由单独的发送任务按顺序写出。生成输出（token、done 等）最多积压 WS_SEND_QUEUE_SIZE 帧，
+积压满时生成任务暂停读取模型输出；控制帧（pong、error 等）不受限制，接收循环因此不会被阻塞，取消请求总能及时处理。
+单帧发送超过 WS_SEND_TIMEOUT 说明客户端长期不读，直接断开连接。
+心跳：服务端定时发送 ping，超过 WS_HEARTBEAT_TIMEOUT 未收到客户端任何帧则断开。
+"""
+
+import asyncio
+import json
+import os
+import time
+from datetime import datetime
+from typing import Dict, Optional, Set
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from pydantic import ValidationError
+from sqlalchemy import func, select, update
+from starlette.websockets import WebSocketState
+
+from app.api.chat import MESSAGE_PREVIEW_LENGTH, get_user_session, save_assistant_message
+from app.database import AsyncSessionLocal
+from app.models.chat import ChatMessage, ChatSession
+from app.schemas.chat import ChatMessageCreate, ChatMessageResponse, ChatSessionSummary
+from app.services.context_builder import build_context, update_session_summary
+from app.services.multi_ai_service import ai_service
+from app.utils.auth import decode_access_token, load_user
+from app.utils.metrics import registry
+
+router = APIRouter()
+
+# WebSocket 配置
+WS_AUTH_TIMEOUT = float(os.getenv("WS_AUTH_TIMEOUT", "10"))  # 建连后等待认证帧的秒数
+WS_HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", "20"))  # 服务端发送 ping 的间隔（秒）
+WS_HEARTBEAT_TIMEOUT = float(os.getenv("WS_HEARTBEAT_TIMEOUT", "60"))  # 超过该秒数未收到客户端任何帧则断开
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "64"))  # 生成输出最多积压的帧数，超过时生成任务等待
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "30"))  # 单帧发送超时（秒），超时视为客户端不再读取
+WS_MAX_INFLIGHT = int(os.getenv("WS_MAX_INFLIGHT", "2"))  # 单个连接同时进行的生成数
+
+# 关闭码（4000-4999 为应用自定义）
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_HEARTBEAT_TIMEOUT = 4408
+CLOSE_SLOW_CONSUMER = 4008
+
+ws_connections = registry.gauge("chat_ws_connections", "Open chat WebSocket connections")
+ws_frames = registry.counter(
+    "chat_ws_frames_total", "Chat WebSocket frames by direction (in, out) and type", ["direction", "type"]
+)
+
+# 计入帧指标的类型，其余记为 unknown，避免客户端随意构造标签值
+CLIENT_FRAME_TYPES = {"auth", "send", "regenerate", "cancel", "ping", "pong"}
+
+# 连接断开后仍在执行的会话摘要任务，保留引用防止被垃圾回收
+_background_tasks: Set[asyncio.Task] = set()
+
+
+class ConnectionClosed(Exception):
+    """连接需要以指定关闭码结束"""
+
+    def __init__(self, code: int, reason: str = ""):
+        super().__init__(reason)
+        self.code = code
+        self.reason = reason
+
+
+class RequestError(Exception):
+    """单个请求失败，以 error 帧返回给客户端，连接保持"""
+
+    def __init__(self, code: str, detail: str, request_id: Optional[str] = None):
+        super().__init__(detail)
+        self.code = code
+        self.detail = detail
+        self.request_id = request_id
+
+
+class ChatConnection:
+    """一个已认证的聊天 WebSocket 连接"""
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.outbox: asyncio.Queue = asyncio.Queue()
+        # 生成输出的发送额度，发送任务每写出一帧归还一个
+        self.send_credits = asyncio.Semaphore(WS_SEND_QUEUE_SIZE)
+        self.generations: Dict[str, asyncio.Task] = {}
+        self.username: Optional[str] = None
+        self.user_id: Optional[int] = None
+        self.token_expires_at: Optional[float] = None
+        self.last_received = time.monotonic()
+        self.closing = False
+        # 生成任务中发现需要断开连接（如令牌过期）时，通过它通知连接主循环
+        self.close_request: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    async def emit(self, frame_type: str, **data):
+        """发送生成输出；积压达到上限时等待，形成背压"""
+        if self.closing:
+            return
+        await self.send_credits.acquire()
+        self.outbox.put_nowait(({"type": frame_type, **data}, True))
+
+    def emit_control(self, frame_type: str, **data):
+        """发送控制帧，不等待"""
+        if not self.closing:
+            self.outbox.put_nowait(({"type": frame_type, **data}, False))
+
+    async def receive_frame(self) -> Dict:
+        text = await self.websocket.receive_text()
+        self.last_received = time.monotonic()
+        try:
+            frame = json.loads(text)
+        except ValueError:
+            frame = None
+        if not isinstance(frame, dict) or not isinstance(frame.get("type"), str):
+            ws_frames.inc(direction="in", type="invalid")
+            raise RequestError("invalid_frame", "帧必须是带 type 字段的 JSON 对象")
+        ws_frames.inc(direction="in", type=frame["type"] if frame["type"] in CLIENT_FRAME_TYPES else "unknown")
+        return frame
+
+    async def authenticate(self, frame: Dict):
+        """校验认证帧；连接已认证时只允许同一用户续期令牌"""
+        token = frame.get("token")
+        payload = decode_access_token(token) if isinstance(token, str) else None
+        if payload is None:
+            raise ConnectionClosed(CLOSE_UNAUTHORIZED, "令牌无效或已过期")
+        if self.username is not None and payload["sub"] != self.username:
+            raise ConnectionClosed(CLOSE_UNAUTHORIZED, "不能在同一连接上切换用户")
+
+        async with AsyncSessionLocal() as db:
+            user = await load_user(db, payload["sub"])
+        if user is None or not user.is_active:
+            raise ConnectionClosed(CLOSE_UNAUTHORIZED, "用户不存在或已停用")
+
+        self.username = user.username
+        self.user_id = user.id
+        self.token_expires_at = payload.get("exp")
+
+    async def current_user(self, db):
+        """每次生成前重新取用户（走用户缓存），以便使用最新的模型设置并及时发现令牌过期"""
+        if self.token_expires_at is not None and time.time() >= self.token_expires_at:
+            raise ConnectionClosed(CLOSE_UNAUTHORIZED, "令牌已过期")
+        user = await load_user(db, self.username)
+        if user is None or not user.is_active:
+            raise ConnectionClosed(CLOSE_UNAUTHORIZED, "用户不存在或已停用")
+        return user
+
+    async def sender(self):
+        """按顺序写出下行帧"""
+        while True:
+            frame, credited = await self.outbox.get()
+            try:
+                await asyncio.wait_for(
+                    self.websocket.send_text(json.dumps(frame, ensure_ascii=False, default=str)),
+                    WS_SEND_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                raise ConnectionClosed(CLOSE_SLOW_CONSUMER, "客户端读取过慢")
+            if credited:
+                self.send_credits.release()
+            ws_frames.inc(direction="out", type=frame["type"])
+
+    async def heartbeat(self):
+        """定时发送 ping，客户端长时间无任何上行帧时断开"""
+        while True:
+            await asyncio.sleep(WS_HEARTBEAT_INTERVAL)
+            if time.monotonic() - self.last_received > WS_HEARTBEAT_TIMEOUT:
+                raise ConnectionClosed(CLOSE_HEARTBEAT_TIMEOUT, "心跳超时")
+            self.emit_control("ping")
+
+    async def receiver(self):
+        while True:
+            try:
+                frame = await self.receive_frame()
+                await self.dispatch(frame)
+            except RequestError as e:
+                self.emit_control("error", request_id=e.request_id, code=e.code, detail=e.detail)
+
+    async def dispatch(self, frame: Dict):
+        frame_type = frame["type"]
+        if frame_type == "ping":
+            self.emit_control("pong")
+        elif frame_type == "pong":
+            pass
+        elif frame_type == "auth":
+            await self.authenticate(frame)
+            self.emit_control("ready", user_id=self.user_id, username=self.username)
+        elif frame_type in ("send", "regenerate"):
+            self.start_generation(frame)
+        elif frame_type == "cancel":
+            task = self.generations.get(str(frame.get("request_id")))
+            if task is not None:
+                task.cancel()
+        else:
+            raise RequestError("unknown_type", f"不支持的帧类型：{frame_type}")
+
+    def start_generation(self, frame: Dict):
+        request_id = frame.get("request_id")
+        if not isinstance(request_id, (str, int)) or str(request_id) == "":
+            raise RequestError("invalid_frame", "缺少 request_id")
+        request_id = str(request_id)
+        if request_id in self.generations:
+            raise RequestError("duplicate_request", f"请求 {request_id} 正在进行", request_id)
+        if len(self.generations) >= WS_MAX_INFLIGHT:
+            raise RequestError("busy", "同时进行的生成过多，请等待当前回复完成", request_id)
+
+        handler = self.send_message if frame["type"] == "send" else self.regenerate_message
+        task = asyncio.create_task(self.run_generation(request_id, handler, frame))
+        self.generations[request_id] = task
+        task.add_done_callback(lambda _: self.generations.pop(request_id, None))
+
+    async def run_generation(self, request_id: str, handler, frame: Dict):
+        try:
+            await handler(request_id, frame)
+        except RequestError as e:
+            await self.emit("error", request_id=request_id, code=e.code, detail=e.detail)
+        except ConnectionClosed as e:
+            await self.emit("error", request_id=request_id, code="unauthorized", detail=e.reason)
+            # 交给连接主循环关闭
+            if not self.close_request.done():
+                self.close_request.set_exception(e)
+        except asyncio.CancelledError:
+            # 开始生成前就被取消，客户端仍需要 done 帧结束这个请求（连接关闭时 emit 不发送）
+            await self.emit("done", request_id=request_id, message=None, cancelled=True)
+        except Exception as e:
+            print(f"WebSocket 生成失败: {e!s}")
+            await self.emit("error", request_id=request_id, code="internal_error", detail=f"生成回复失败: {e!s}")
+
+    async def stream_reply(self, request_id: str, prompt: str, context: Dict, service, use_cache: bool):
+        """逐个推送生成的文本片段，返回 (完整文本, 是否被取消)"""
+        tokens = []
+        try:
+            async for token in ai_service.astream(
+                prompt, context["messages"], service=service, summary=context["summary"],
+                use_cache=use_cache, user_id=self.user_id
+            ):
+                tokens.append(token)
+                await self.emit("token", request_id=request_id, content=token)
+        except asyncio.CancelledError:
+            # 客户端取消或连接断开，保留已生成的部分
+            return "".join(tokens), True
+        return "".join(tokens), False
+
+    async def send_message(self, request_id: str, frame: Dict):
+        try:
+            message = ChatMessageCreate(content=frame.get("content"), session_id=frame.get("session_id"))
+        except ValidationError:
+            raise RequestError("invalid_frame", "content 或 session_id 格式错误")
+        if not message.content.strip():
+            raise RequestError("invalid_frame", "消息内容不能为空")
+        if message.session_id is None:
+            raise RequestError("invalid_frame", "缺少 session_id")
+
+        async with AsyncSessionLocal() as db:
+            user = await self.current_user(db)
+            if not await get_user_session(db, message.session_id, user.id):
+                raise RequestError("not_found", "会话不存在")
+
+            # 根据用户设置创建AI服务实例
+            user_ai_service = ai_service.create_user_ai_service(user.settings)
+
+            # 按模型 token 预算获取会话上下文（最近消息原文 + 早期对话摘要）
+            context = await build_context(db, message.session_id, user_ai_service.model_name)
+
+            # 更新会话的 updated_at 字段并保存用户消息
+            await db.execute(
+                update(ChatSession).where(ChatSession.id == message.session_id).values(updated_at=datetime.now())
+            )
+            user_message = ChatMessage(session_id=message.session_id, role="user", content=message.content)
+            db.add(user_message)
+            await db.commit()
+            await db.refresh(user_message)
+
+        await self.emit(
+            "user_message", request_id=request_id,
+            message=ChatMessageResponse.model_validate(user_message).model_dump(mode="json")
+        )
+
+        content, cancelled = await self.stream_reply(
+            request_id, message.content, context, user_ai_service, use_cache=True
+        )
+
+        # 生成结束（包括取消）后保存已生成的AI回复；连接关闭时任务可能被再次取消，保存过程不随之中断
+        ai_message_data = None
+        if content:
+            ai_message_data = await asyncio.shield(save_assistant_message(message.session_id, content))
+
+        await self.emit("done", request_id=request_id, message=ai_message_data, cancelled=cancelled)
+        await self.emit_session_updated(message.session_id)
+
+        if context["needs_summary"]:
+            run_in_background(update_session_summary(message.session_id, user_ai_service))
+
+    async def regenerate_message(self, request_id: str, frame: Dict):
+        message_id = frame.get("message_id")
+        if not isinstance(message_id, int):
+            raise RequestError("invalid_frame", "message_id 必须是整数")
+
+        async with AsyncSessionLocal() as db:
+            user = await self.current_user(db)
+            ai_message = (await db.execute(
+                select(ChatMessage).where(ChatMessage.id == message_id, ChatMessage.role == "assistant")
+            )).scalars().first()
+            if not ai_message or not await get_user_session(db, ai_message.session_id, user.id):
+                raise RequestError("not_found", "消息不存在或不是AI消息")
+            session_id = ai_message.session_id
+
+            # 用这条回复之前最近的用户消息作为问题重新提问；找不到时退回到以原回复为提示
+            question = (await db.execute(
+                select(ChatMessage)
+                .where(
+                    ChatMessage.session_id == session_id,
+                    ChatMessage.role == "user",
+                    ChatMessage.id < ai_message.id
+                )
+                .order_by(ChatMessage.id.desc())
+                .limit(1)
+            )).scalars().first()
+            prompt = question.content if question else ai_message.content
+
+            user_ai_service = ai_service.create_user_ai_service(user.settings)
+
+            # 获取会话上下文（不包括问题本身、要重新生成的消息及之后的消息）
+            context = await build_context(
+                db, session_id, user_ai_service.model_name,
+                before_message_id=question.id if question else ai_message.id
+            )
+
+        # 重新生成需要新的回答，不使用回复缓存
+        content, cancelled = await self.stream_reply(request_id, prompt, context, user_ai_service, use_cache=False)
+
+        # 取消时保留原回复，只有完整生成的内容才替换
+        async with AsyncSessionLocal() as db:
+            ai_message = await db.get(ChatMessage, message_id)
+            if ai_message is not None and content and not cancelled:
+                now = datetime.now()
+                ai_message.content = content
+                ai_message.updated_at = now
+                await db.execute(update(ChatSession).where(ChatSession.id == session_id).values(updated_at=now))
+                await db.commit()
+                await db.refresh(ai_message)
+            ai_message_data = (
+                ChatMessageResponse.model_validate(ai_message).model_dump(mode="json") if ai_message else None
+            )
+
+        await self.emit("done", request_id=request_id, message=ai_message_data, cancelled=cancelled)
+        await self.emit_session_updated(session_id)
+
+    async def emit_session_updated(self, session_id: int):
+        """推送会话摘要（字段与会话列表接口一致），客户端据此刷新侧边栏"""
+        if self.closing:
+            return
+        async with AsyncSessionLocal() as db:
+            session = (await db.execute(
+                select(ChatSession.id, ChatSession.title, ChatSession.created_at, ChatSession.updated_at)
+                .where(ChatSession.id == session_id)
+            )).first()
+            if session is None:
+                return
+            count, last_id = (await db.execute(
+                select(func.count(ChatMessage.id), func.max(ChatMessage.id)).where(ChatMessage.session_id == session_id)
+            )).one()
+            preview = None
+            if last_id is not None:
+                preview = (await db.execute(
+                    select(func.substr(ChatMessage.content, 1, MESSAGE_PREVIEW_LENGTH)).where(ChatMessage.id == last_id)
+                )).scalar()
+
+        summary = ChatSessionSummary(
+            id=session.id,
+            title=session.title,
+            created_at=session.created_at,
+            updated_at=session.updated_at,
+            message_count=count,
+            last_message_preview=preview
+        )
+        await self.emit("session_updated", session=summary.model_dump(mode="json"))
+
+    async def close(self, code: int, reason: str = ""):
+        if self.websocket.application_state == WebSocketState.CONNECTED:
+            try:
+                await self.websocket.close(code=code, reason=reason)
+            except RuntimeError:
+                # 客户端已先断开
+                pass
+
+    async def serve(self):
+        """运行接收、发送和心跳三个循环，任一结束即关闭连接"""
+        tasks = [
+            asyncio.create_task(self.receiver()),
+            asyncio.create_task(self.sender()),
+            asyncio.create_task(self.heartbeat()),
+        ]
+        close_code, close_reason = 1000, ""
+        try:
+            done, _ = await asyncio.wait([*tasks, self.close_request], return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                error = task.exception()
+                if isinstance(error, ConnectionClosed):
+                    close_code, close_reason = error.code, error.reason
+                elif error is not None and not isinstance(error, WebSocketDisconnect):
+                    print(f"WebSocket 连接异常: {error!s}")
+                    close_code, close_reason = 1011, "服务器内部错误"
+        finally:
+            self.closing = True
+            for task in tasks:
+                task.cancel()
+            self.close_request.cancel()
+            # 取消进行中的生成，已生成的部分照常保存
+            generations = list(self.generations.values())
+            for task in generations:
+                task.cancel()
+            await asyncio.gather(*tasks, *generations, return_exceptions=True)
+            await self.close(close_code, close_reason)
+
+
+def run_in_background(coro):
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+@router.websocket("/ws")
+async def chat_websocket(websocket: WebSocket):
+    """聊天 WebSocket：第一帧必须是认证帧，之后复用同一连接收发聊天消息"""
+    await websocket.accept()
+    connection = ChatConnection(websocket)
+    try:
+        frame = await asyncio.wait_for(connection.receive_frame(), WS_AUTH_TIMEOUT)
+        if frame["type"] != "auth":
+            raise ConnectionClosed(CLOSE_UNAUTHORIZED, "第一帧必须是认证帧")
+        await connection.authenticate(frame)
+    except (asyncio.TimeoutError, RequestError):
+        await connection.close(CLOSE_UNAUTHORIZED, "认证超时或认证帧无效")
+        return
+    except ConnectionClosed as e:
+        await connection.close(e.code, e.reason)
+        return
+    except WebSocketDisconnect:
+        return
+
+    ws_connections.inc()
+    try:
+        connection.emit_control(
+            "ready", user_id=connection.user_id, username=connection.username,
+            heartbeat_interval=WS_HEARTBEAT_INTERVAL
+        )
+        await connection.serve()
+    finally:
+        ws_connections.dec()
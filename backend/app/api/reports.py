@@ -1,88 +1,83 @@
+import asyncio
 import os
+import uuid
 from datetime import datetime
 from typing import List, Optional
 
-import aiofiles
-from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Response, UploadFile
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database import get_db
+from app.api.chat import format_sse
+from app.database import AsyncSessionLocal, get_async_db
 from app.models.chat import ChatMessage, ChatSession
+from app.models.report import Report, ReportJob
 from app.models.user import User
 from app.schemas.chat import ChatMessageResponse
-from app.services.multi_ai_service import ai_service
+from app.schemas.report import ReportDetailResponse, ReportJobResponse, ReportResponse
+from app.services.report_jobs import FINISHED_STATUSES, enqueue_report_job, report_job_worker
 from app.utils.auth import get_current_active_user
+from app.utils.uploads import REPORT_MAX_UPLOAD_SIZE, save_upload_file
 
 router = APIRouter()
 
+# 分页配置
+REPORT_PAGE_MAX = 100
+# 任务进度 SSE 查询数据库的间隔（秒）
+REPORT_JOB_EVENTS_INTERVAL = float(os.getenv("REPORT_JOB_EVENTS_INTERVAL", "1"))
+
 
 class ReportAnalysisRequest(BaseModel):
     session_id: Optional[int] = None
 
 
-@router.post("/upload", response_model=ChatMessageResponse)
+@router.post("/upload", response_model=ReportJobResponse, status_code=202)
 async def upload_report(
     file: UploadFile = File(...),
     session_id: Optional[int] = None,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
+    """保存报告并创建分析任务，立即返回 202 和任务信息
+
+    提取和分析由报告任务工作者在后台完成，进度通过 /jobs/{job_id} 或 /jobs/{job_id}/events（SSE）获取。
+    """
     # 检查文件类型
     allowed_types = ["application/pdf", "application/vnd.openxmlformats-officedocument.wordprocessingml.document"]
     if file.content_type not in allowed_types:
         raise HTTPException(status_code=400, detail="只支持 PDF 和 DOCX 文件")
 
+    # 验证会话所有权
+    session = None
+    if session_id is not None:
+        result = await db.execute(
+            select(ChatSession).where(
+                ChatSession.id == session_id,
+                ChatSession.user_id == current_user.id
+            )
+        )
+        session = result.scalars().first()
+        if not session:
+            raise HTTPException(status_code=404, detail="会话不存在")
+
+    # 分块保存文件（大小超限时中途拒绝，不会整体读入内存）
+    # 文件名带随机前缀：任务排队期间再次上传同名文件不会覆盖待处理的文件
+    upload_dir = "uploads"
+    filename = os.path.basename(file.filename or "report")
+    file_path = os.path.join(upload_dir, f"{current_user.id}_{uuid.uuid4().hex[:8]}_{filename}")
+    saved = await save_upload_file(file, file_path, max_size=REPORT_MAX_UPLOAD_SIZE)
+
     # 如果没有提供session_id，创建一个新的会话
-    if session_id is None:
+    if session is None:
         session = ChatSession(
             user_id=current_user.id,
             title=f"报告分析 - {file.filename}"
         )
         db.add(session)
-        db.commit()
-        db.refresh(session)
+        await db.flush()
         session_id = session.id
-    else:
-        # 验证会话所有权
-        session = db.query(ChatSession).filter(
-            ChatSession.id == session_id,
-            ChatSession.user_id == current_user.id
-        ).first()
-        if not session:
-            raise HTTPException(status_code=404, detail="会话不存在")
-
-    # 保存文件
-    upload_dir = "uploads"
-    os.makedirs(upload_dir, exist_ok=True)
-
-    file_path = os.path.join(upload_dir, f"{current_user.id}_{file.filename}")
-
-    async with aiofiles.open(file_path, "wb") as f:
-        content = await file.read()
-        await f.write(content)
-
-    # 处理文档内容
-    file_type = "pdf" if file.content_type == "application/pdf" else "docx"
-    try:
-        # 根据用户设置创建AI服务实例
-        ai_service.create_user_ai_service(current_user.settings)
-        # 获取文档内容
-        document_content = ai_service.process_document(file_path, file_type)
-        if not document_content or document_content.startswith("文档处理失败"):
-            raise Exception("文档处理失败")
-    except Exception as e:
-        print(f"文档处理错误: {e}")
-        document_content = "文档内容提取失败，请检查文件格式是否正确。"
-
-    # 分析报告
-    try:
-        analysis = await ai_service.analyze_report(document_content)
-        if not analysis or analysis.startswith("报告分析失败"):
-            raise Exception("AI分析失败")
-    except Exception as e:
-        print(f"AI分析错误: {e}")
-        analysis = "抱歉，AI分析服务暂时不可用，请稍后重试。"
 
     # 创建用户上传消息
     user_message = ChatMessage(
@@ -94,50 +89,145 @@ async def upload_report(
         file_path=file_path
     )
     db.add(user_message)
+    await db.flush()
 
-    # 创建AI分析消息
-    content_summary = document_content[:300] + "..." if len(document_content) > 300 else document_content
-    ai_message = ChatMessage(
+    job = await enqueue_report_job(
+        db,
+        user_id=current_user.id,
         session_id=session_id,
-        role="assistant",
-        content=f"📋 **报告分析完成**\n\n📄 **报告内容摘要：**\n{content_summary}\n\n🤖 **AI 分析结果：**\n{analysis}",
-        message_type="report_analysis",
+        upload_message_id=user_message.id,
         filename=file.filename,
-        file_path=file_path
+        file_path=file_path,
+        file_type="pdf" if file.content_type == "application/pdf" else "docx",
+        digest=saved["sha256"]
     )
-    db.add(ai_message)
 
     # 更新会话时间
     session.updated_at = datetime.now()
 
-    db.commit()
-    db.refresh(ai_message)
+    await db.commit()
+    await db.refresh(job)
+    report_job_worker.notify()
+    return job
+
 
-    return ai_message
+async def get_user_job(db: AsyncSession, job_id: int, user_id: int) -> ReportJob:
+    result = await db.execute(select(ReportJob).where(ReportJob.id == job_id, ReportJob.user_id == user_id))
+    job = result.scalars().first()
+    if not job:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
 
 
-@router.get("/", response_model=List[ChatMessageResponse])
-def get_reports(current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
-    # 获取所有报告相关的消息
-    reports = db.query(ChatMessage).filter(
-        ChatMessage.session_id.in_(
-            db.query(ChatSession.id).filter(ChatSession.user_id == current_user.id)
-        ),
-        ChatMessage.message_type.in_(["report_upload", "report_analysis"])
-    ).order_by(ChatMessage.created_at.desc()).all()
+@router.get("/jobs/{job_id}", response_model=ReportJobResponse)
+async def get_report_job(
+    job_id: int,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """查询报告分析任务的状态和进度"""
+    return await get_user_job(db, job_id, current_user.id)
+
+
+@router.get("/jobs/{job_id}/events")
+async def stream_report_job(
+    job_id: int,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """以 SSE 推送任务进度：状态或阶段变化时发送 progress 事件，结束时发送 done 事件（附带分析消息）"""
+    await get_user_job(db, job_id, current_user.id)
+    user_id = current_user.id
+
+    async def event_stream():
+        last = None
+        while True:
+            # 任务可能由其它进程执行，按间隔从数据库读取最新状态
+            async with AsyncSessionLocal() as stream_db:
+                job = await get_user_job(stream_db, job_id, user_id)
+                data = ReportJobResponse.model_validate(job).model_dump(mode="json")
+                message = None
+                if job.status in FINISHED_STATUSES and job.analysis_message_id is not None:
+                    message = await stream_db.get(ChatMessage, job.analysis_message_id)
+            state = (data["status"], data["stage"], data["progress"], data["attempts"])
+            if state != last:
+                last = state
+                yield format_sse(data, event="progress")
+            if data["status"] in FINISHED_STATUSES:
+                data["analysis_message"] = (
+                    ChatMessageResponse.model_validate(message).model_dump(mode="json") if message else None
+                )
+                yield format_sse(data, event="done")
+                return
+            await asyncio.sleep(REPORT_JOB_EVENTS_INTERVAL)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
+@router.get("/", response_model=List[ReportResponse])
+async def get_reports(
+    response: Response,
+    limit: int = Query(50, ge=1, le=REPORT_PAGE_MAX),
+    before: Optional[int] = Query(None, description="上一页最后一个报告的ID"),
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """按上传时间倒序分页获取报告列表，只查询 reports 表
+
+    下一页的游标通过 X-Next-Cursor 响应头返回，作为 before 参数传入。
+    """
+    stmt = select(Report).where(Report.user_id == current_user.id)
+
+    if before is not None:
+        cursor_created_at = select(Report.created_at).where(
+            Report.id == before,
+            Report.user_id == current_user.id
+        ).scalar_subquery()
+        stmt = stmt.where(or_(
+            Report.created_at < cursor_created_at,
+            and_(Report.created_at == cursor_created_at, Report.id < before)
+        ))
+
+    stmt = stmt.order_by(Report.created_at.desc(), Report.id.desc()).limit(limit + 1)
+    reports = (await db.execute(stmt)).scalars().all()
+
+    if len(reports) > limit:
+        reports = reports[:limit]
+        response.headers["X-Next-Cursor"] = str(reports[-1].id)
     return reports
 
 
-@router.get("/{message_id}", response_model=ChatMessageResponse)
-def get_report(message_id: int, current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
-    report = db.query(ChatMessage).filter(
-        ChatMessage.id == message_id,
-        ChatMessage.message_type.in_(["report_upload", "report_analysis"]),
-        ChatMessage.session_id.in_(
-            db.query(ChatSession.id).filter(ChatSession.user_id == current_user.id)
+@router.get("/{report_id}", response_model=ReportDetailResponse)
+async def get_report(
+    report_id: int,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    result = await db.execute(
+        select(Report).where(
+            Report.id == report_id,
+            Report.user_id == current_user.id
         )
-    ).first()
+    )
+    report = result.scalars().first()
 
     if not report:
         raise HTTPException(status_code=404, detail="报告不存在")
-    return report
+
+    analysis = None
+    if report.analysis_message_id is not None:
+        result = await db.execute(
+            select(ChatMessage.content).where(ChatMessage.id == report.analysis_message_id)
+        )
+        analysis = result.scalar()
+
+    detail = ReportDetailResponse.model_validate(report)
+    detail.analysis = analysis
+    return detail
@@ -1,9 +1,58 @@
-from fastapi import APIRouter
+import hmac
+import os
+
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import get_async_db
+from app.services.client_registry import client_registry
+from app.services.llm_scheduler import llm_scheduler
+from app.services.multi_ai_service import ai_service
+from app.services.provider_health import provider_health
+from app.services.report_jobs import report_job_worker
+from app.services.request_coalescer import request_coalescer
+from app.services.response_cache import response_cache
+from app.utils.auth import get_current_active_user, get_current_user, oauth2_scheme
+from app.utils.metrics import registry, render_prometheus
+from app.utils.user_cache import user_cache
+
+# 监控接口访问令牌：设置后 Prometheus 等采集端可用 Authorization: Bearer <METRICS_TOKEN> 访问，未设置时只允许已登录用户访问
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
 
 router = APIRouter()
 
 
+async def require_metrics_access(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
+    """监控与统计接口的访问控制：令牌与 METRICS_TOKEN 一致，或为有效用户的访问令牌"""
+    if METRICS_TOKEN and hmac.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+        return
+    await get_current_active_user(await get_current_user(token, db))
+
+
 @router.get("/health")
 def health_check():
     """健康检查"""
     return {"status": "healthy", "message": "医疗AI助手服务运行正常"}
+
+
+@router.get("/cache-stats", dependencies=[Depends(require_metrics_access)])
+def get_cache_stats():
+    """模型回复缓存、请求合并、模型服务健康状态与调度、客户端注册表、用户缓存、嵌入服务、向量索引和报告任务的统计"""
+    return {
+        "llm_response_cache": response_cache.stats(),
+        "llm_request_coalescing": request_coalescer.stats(),
+        "llm_providers": provider_health.stats(),
+        "llm_scheduler": llm_scheduler.stats(),
+        "ai_client_registry": client_registry.stats(),
+        "user_cache": user_cache.stats(),
+        "embedding_service": ai_service.embedding_service.stats() if ai_service.embedding_service else None,
+        "vector_store": ai_service.vector_store.stats() if ai_service.vector_store else None,
+        "report_jobs": report_job_worker.stats(),
+    }
+
+
+@router.get("/metrics", response_class=PlainTextResponse, dependencies=[Depends(require_metrics_access)])
+def get_metrics():
+    """Prometheus 文本格式的指标（HTTP 请求、数据库连接池、模型调用等全部进程内指标）"""
+    return PlainTextResponse(render_prometheus(registry), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -1,31 +1,34 @@
-import shutil
 from datetime import datetime
 from pathlib import Path
 
 from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
 from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database import get_db
+from app.database import get_async_db
 from app.models.user import User
 from app.schemas.user import UserResponse, UserSettingsUpdate
 from app.utils.auth import get_current_active_user
+from app.utils.uploads import AVATAR_MAX_UPLOAD_SIZE, save_upload_file
+from app.utils.user_cache import attach_user, user_cache
 
 router = APIRouter()
 
 
 @router.get("/me", response_model=UserResponse)
-def read_users_me(current_user: User = Depends(get_current_active_user)):
+async def read_users_me(current_user: User = Depends(get_current_active_user)):
     return current_user
 
 
 @router.get("/settings")
-def get_user_settings(
+async def get_user_settings(
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取用户设置"""
     if not current_user.settings:
+        current_user = await attach_user(db, current_user)
         # 如果用户没有设置，返回默认设置
         default_settings = {
             "preferred_model": "openai",
@@ -40,32 +43,37 @@ def get_user_settings(
                 "deepseek": "https://api.deepseek.com/v1",
                 "anthropic": "",
                 "kimi": "https://api.moonshot.cn/v1"
-            }
+            },
+            "fallback_models": []
         }
         current_user.settings = default_settings
-        db.commit()
-        db.refresh(current_user)
+        await db.commit()
+        await db.refresh(current_user)
+        user_cache.invalidate(current_user.username)
 
     return current_user.settings
 
 
 @router.put("/settings")
-def update_user_settings(
+async def update_user_settings(
     settings: UserSettingsUpdate,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """更新用户设置"""
+    current_user = await attach_user(db, current_user)
     # 直接替换整个设置对象
     current_user.settings = {
         "preferred_model": settings.preferred_model,
         "api_keys": settings.api_keys,
-        "base_urls": settings.base_urls
+        "base_urls": settings.base_urls,
+        "fallback_models": [model for model in settings.fallback_models if model != settings.preferred_model]
     }
 
     current_user.updated_at = datetime.now()
-    db.commit()
-    db.refresh(current_user)
+    await db.commit()
+    await db.refresh(current_user)
+    user_cache.invalidate(current_user.username)
 
     return {"message": "设置更新成功", "settings": current_user.settings}
 
@@ -112,31 +120,30 @@ AVATAR_DIR.mkdir(exist_ok=True)
 async def upload_avatar(
     file: UploadFile = File(...),
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     # 检查文件类型
     if not file.content_type.startswith('image/'):
         raise HTTPException(status_code=400, detail="只能上传图片文件")
 
-    # 检查文件大小 (限制为5MB)
-    if file.size > 5 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="文件大小不能超过5MB")
-
     # 生成文件名
     file_extension = Path(file.filename).suffix
     filename = f"avatar_{current_user.id}{file_extension}"
     file_path = AVATAR_DIR / filename
 
-    # 保存文件
+    # 分块保存文件（限制为5MB）
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        await save_upload_file(file, str(file_path), max_size=AVATAR_MAX_UPLOAD_SIZE)
+    except HTTPException:
+        raise
     except Exception:
         raise HTTPException(status_code=500, detail="文件保存失败")
 
     # 更新用户头像路径
+    current_user = await attach_user(db, current_user)
     current_user.avatar = str(file_path)
-    db.commit()
+    await db.commit()
+    user_cache.invalidate(current_user.username)
 
     return {"message": "头像上传成功", "avatar_path": str(file_path)}
 
@@ -150,8 +157,9 @@ async def get_avatar(filename: str):
 
 
 @router.get("/{user_id}", response_model=UserResponse)
-def read_user(user_id: int, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
+async def read_user(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    result = await db.execute(select(User).where(User.id == user_id))
+    user = result.scalars().first()
     if user is None:
         raise HTTPException(status_code=404, detail="用户不存在")
     return user
@@ -1,10 +1,13 @@
 import os
 
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
+from app.utils.db_metrics import instrument_engine
+
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./medical_ai.db")
@@ -27,13 +30,89 @@ else:
     )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# 连接池指标（借出数、溢出数、获取连接的等待时间）
+instrument_engine(engine, "sync")
+
+
+def to_async_database_url(url: str) -> str:
+    """将同步数据库 URL 转换为对应的异步驱动 URL（asyncpg / aiosqlite）"""
+    if url.startswith("postgresql+asyncpg://") or url.startswith("sqlite+aiosqlite://"):
+        return url
+    if url.startswith("postgresql"):
+        # postgresql:// 或 postgresql+psycopg2://
+        return "postgresql+asyncpg://" + url.split("://", 1)[1]
+    if url.startswith("sqlite"):
+        return "sqlite+aiosqlite://" + url.split("://", 1)[1]
+    return url
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or to_async_database_url(DATABASE_URL)
+
+# 异步引擎，供 API 路由使用，避免数据库操作阻塞事件循环
+if ASYNC_DATABASE_URL.startswith("postgresql"):
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        pool_pre_ping=True,
+        pool_recycle=300,
+        pool_size=10,
+        max_overflow=20
+    )
+else:
+    async_engine = create_async_engine(ASYNC_DATABASE_URL)
+instrument_engine(async_engine.sync_engine, "async")
+
+# expire_on_commit=False：提交后仍可直接读取对象属性，不会在事件循环中触发隐式查询
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False
+)
 
 Base = declarative_base()
 
 
+def upgrade_schema(bind=engine) -> int:
+    """为已有数据库补齐新增的列和索引，返回新增的列数
+
+    create_all 只创建不存在的表，已有表上新增的列和索引需要在这里补上。
+    可重复执行，SQLite 和 PostgreSQL 通用；只补可为空的列，其它变更需要手动迁移。
+    """
+    inspector = inspect(bind)
+    preparer = bind.dialect.identifier_preparer
+    added = 0
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                if not column.nullable:
+                    print(f"无法自动添加非空列 {table.name}.{column.name}，请手动迁移")
+                    continue
+                conn.execute(text(
+                    f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.format_column(column)} "
+                    f"{column.type.compile(dialect=bind.dialect)}"
+                ))
+                print(f"数据库迁移：添加列 {table.name}.{column.name}")
+                added += 1
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+    return added
+
+
 def get_db():
+    """同步数据库会话（用于脚本和初始化）"""
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    """异步数据库会话（用于 API 路由）"""
+    async with AsyncSessionLocal() as db:
+        yield db
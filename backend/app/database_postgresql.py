@@ -10,6 +10,8 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import QueuePool
 
+from app.utils.db_metrics import instrument_engine
+
 # 数据库连接配置
 DATABASE_URL = os.getenv("DATABASE_URL")
 
@@ -39,6 +41,9 @@ engine = create_engine(
     }
 )
 
+# 连接池指标（借出数、溢出数、获取连接的等待时间）
+instrument_engine(engine, "postgresql")
+
 # 会话工厂
 SessionLocal = sessionmaker(
     autocommit=False,
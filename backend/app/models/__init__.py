@@ -1,5 +1,17 @@
 from ..database import Base
+from .cache import LLMResponseCache
 from .chat import ChatMessage, ChatSession
+from .report import Report, ReportAnalysisCache, ReportContent, ReportJob
 from .user import User
 
-__all__ = ["Base", "ChatMessage", "ChatSession", "User"]
+__all__ = [
+    "Base",
+    "ChatMessage",
+    "ChatSession",
+    "LLMResponseCache",
+    "Report",
+    "ReportAnalysisCache",
+    "ReportContent",
+    "ReportJob",
+    "User"
+]
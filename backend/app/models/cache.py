@@ -0,0 +1,15 @@
+from sqlalchemy import Column, DateTime, String, Text
+from sqlalchemy.sql import func
+
+from app.database import Base
+
+
+class LLMResponseCache(Base):
+    """模型回复持久化缓存（按请求内容哈希精确匹配）"""
+    __tablename__ = "llm_response_cache"
+
+    key = Column(String(64), primary_key=True)  # 请求内容 SHA-256
+    provider = Column(String)
+    model = Column(String)
+    response = Column(Text)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
@@ -0,0 +1,85 @@
+from sqlalchemy import JSON, Column, DateTime, ForeignKey, Index, Integer, String, Text, UniqueConstraint
+from sqlalchemy.sql import func
+
+from app.database import Base
+
+
+class ReportContent(Base):
+    """按文件内容 SHA-256 缓存的报告提取结果"""
+    __tablename__ = "report_contents"
+
+    digest = Column(String(64), primary_key=True)  # 文件内容 SHA-256
+    text = Column(Text)  # 提取的全文
+    chunks = Column(JSON, nullable=True)  # 切分后的文本块
+    page_count = Column(Integer, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class ReportAnalysisCache(Base):
+    """按 (文件内容 SHA-256, 模型) 缓存的报告分析结果"""
+    __tablename__ = "report_analysis_cache"
+    __table_args__ = (UniqueConstraint("digest", "model", name="uq_report_analysis_cache_digest_model"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    digest = Column(String(64), nullable=False)
+    model = Column(String, nullable=False)  # provider:model_name
+    analysis = Column(Text)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class Report(Base):
+    """用户上传的报告及其元数据，关联上传/分析产生的聊天消息"""
+    __tablename__ = "reports"
+    __table_args__ = (
+        # 报告列表：按 user_id 过滤并按 created_at 倒序分页，不随聊天消息数量增长
+        Index("ix_reports_user_created", "user_id", "created_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    session_id = Column(Integer, ForeignKey("chat_sessions.id", ondelete="CASCADE"), index=True)
+    upload_message_id = Column(Integer, ForeignKey("chat_messages.id", ondelete="SET NULL"), nullable=True, unique=True)
+    analysis_message_id = Column(Integer, ForeignKey("chat_messages.id", ondelete="SET NULL"), nullable=True)
+    filename = Column(String)
+    file_path = Column(String, nullable=True)
+    digest = Column(String(64), nullable=True)  # 文件内容 SHA-256
+    page_count = Column(Integer, nullable=True)
+    extraction_status = Column(String, default="success")  # success, failed, unknown
+    model_used = Column(String, nullable=True)  # provider:model_name
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class ReportJob(Base):
+    """报告提取与分析任务（数据库队列）
+
+    上传接口只保存文件并写入任务，由应用内的工作协程或独立的工作进程领取执行；
+    执行中的任务通过租约（locked_until）续期，进程退出后租约过期即可被重新领取。
+    """
+    __tablename__ = "report_jobs"
+    __table_args__ = (
+        # 工作进程按 (status, next_run_at) 查找可执行的任务
+        Index("ix_report_jobs_status_next_run", "status", "next_run_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    session_id = Column(Integer, ForeignKey("chat_sessions.id", ondelete="CASCADE"), index=True)
+    upload_message_id = Column(Integer, ForeignKey("chat_messages.id", ondelete="SET NULL"), nullable=True)
+    analysis_message_id = Column(Integer, ForeignKey("chat_messages.id", ondelete="SET NULL"), nullable=True)
+    report_id = Column(Integer, ForeignKey("reports.id", ondelete="SET NULL"), nullable=True)
+    filename = Column(String)
+    file_path = Column(String)
+    file_type = Column(String)  # pdf, docx
+    digest = Column(String(64))  # 文件内容 SHA-256
+    status = Column(String, default="queued")  # queued, running, completed, failed
+    stage = Column(String, default="queued")  # queued, extracting, analyzing, saving, done
+    progress = Column(Integer, default=0)  # 0~100
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    error = Column(Text, nullable=True)  # 最近一次失败的原因
+    next_run_at = Column(DateTime)  # 最早可执行时间（重试退避）
+    worker_id = Column(String, nullable=True)  # 当前持有任务的工作进程及本次领取的租约标识
+    locked_until = Column(DateTime, nullable=True)  # 租约到期时间
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
@@ -29,5 +29,6 @@ class User(Base):
             "openai": "https://api.openai.com/v1",
             "deepseek": "https://api.deepseek.com/v1",
             "kimi": "https://api.moonshot.cn/v1"
-        }
+        },
+        "fallback_models": []
     })
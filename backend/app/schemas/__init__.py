@@ -1,4 +1,5 @@
-from .chat import ChatMessageCreate, ChatMessageResponse, ChatSessionCreate, ChatSessionResponse
+from .chat import ChatMessageCreate, ChatMessageResponse, ChatSessionCreate, ChatSessionResponse, ChatSessionSummary
+from .report import ReportDetailResponse, ReportResponse
 from .user import UserCreate, UserLogin, UserResponse
 
 __all__ = [
@@ -6,6 +7,9 @@ __all__ = [
     "ChatMessageResponse",
     "ChatSessionCreate",
     "ChatSessionResponse",
+    "ChatSessionSummary",
+    "ReportDetailResponse",
+    "ReportResponse",
     "UserCreate",
     "UserLogin",
     "UserResponse"
@@ -43,3 +43,16 @@ class ChatSessionResponse(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+class ChatSessionSummary(BaseModel):
+    """会话列表项，不包含消息内容"""
+    id: int
+    title: str
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+    message_count: int = 0
+    last_message_preview: Optional[str] = None
+
+    class Config:
+        from_attributes = True
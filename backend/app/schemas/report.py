@@ -0,0 +1,50 @@
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class ReportResponse(BaseModel):
+    """报告列表项，只包含元数据"""
+    id: int
+    session_id: Optional[int] = None
+    upload_message_id: Optional[int] = None
+    analysis_message_id: Optional[int] = None
+    filename: Optional[str] = None
+    file_path: Optional[str] = None
+    digest: Optional[str] = None
+    page_count: Optional[int] = None
+    extraction_status: Optional[str] = None
+    model_used: Optional[str] = None
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+class ReportDetailResponse(ReportResponse):
+    """报告详情，附带分析结果"""
+    analysis: Optional[str] = None
+
+
+class ReportJobResponse(BaseModel):
+    """报告分析任务的状态和进度"""
+    id: int
+    status: str
+    stage: Optional[str] = None
+    progress: int = 0
+    attempts: int = 0
+    max_attempts: int = 0
+    error: Optional[str] = None
+    session_id: Optional[int] = None
+    upload_message_id: Optional[int] = None
+    analysis_message_id: Optional[int] = None
+    report_id: Optional[int] = None
+    filename: Optional[str] = None
+    next_run_at: Optional[datetime] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
 from pydantic import BaseModel, EmailStr
 
@@ -35,6 +35,8 @@ class UserSettings(BaseModel):
         "anthropic": "",
         "kimi": "https://api.moonshot.cn/v1"
     }
+    # 首选模型不可用或响应过慢时，按顺序切换的备用模型
+    fallback_models: List[str] = []
 
 
 class UserSettingsUpdate(BaseModel):
@@ -42,6 +44,7 @@ class UserSettingsUpdate(BaseModel):
     preferred_model: str
     api_keys: Dict[str, str]
     base_urls: Dict[str, str]
+    fallback_models: List[str] = []
 
 
 class User(UserBase):
@@ -0,0 +1,124 @@
+"""
+AI 客户端注册表
+按 (provider, api_key 哈希, base_url, model) 缓存模型客户端，避免每次请求都重新
+创建 ChatOpenAI/ChatAnthropic（以及它们各自的连接池和 TLS 握手）
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+import httpx
+
+# 注册表配置
+CLIENT_CACHE_MAX_SIZE = int(os.getenv("AI_CLIENT_CACHE_MAX_SIZE", "128"))  # 最多缓存的客户端数量
+CLIENT_CACHE_TTL = int(os.getenv("AI_CLIENT_CACHE_TTL", "1800"))  # 客户端最长存活时间（秒）
+HTTP_MAX_CONNECTIONS = int(os.getenv("AI_HTTP_MAX_CONNECTIONS", "100"))  # 共享连接池最大连接数
+HTTP_MAX_KEEPALIVE = int(os.getenv("AI_HTTP_MAX_KEEPALIVE", "20"))  # 共享连接池保持的空闲连接数
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("AI_HTTP_KEEPALIVE_EXPIRY", "60"))  # 空闲连接保活时间（秒）
+HTTP_TIMEOUT = float(os.getenv("AI_HTTP_TIMEOUT", "120"))  # 单次请求超时（秒）
+
+ClientKey = Tuple[str, str, str, str]
+
+
+def hash_api_key(api_key: Optional[str]) -> str:
+    """API Key 只以哈希形式出现在缓存键中"""
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+
+
+class AIClientRegistry:
+    """带 LRU/TTL 淘汰的模型客户端注册表，所有客户端共享同一个 keep-alive 连接池"""
+
+    def __init__(self, max_size: int = CLIENT_CACHE_MAX_SIZE, ttl: int = CLIENT_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clients: "OrderedDict[ClientKey, Tuple[object, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._http_client: Optional[httpx.AsyncClient] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        """共享的异步 HTTP 客户端（按主机复用 keep-alive 连接）"""
+        if self._http_client is None or self._http_client.is_closed:
+            self._http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+                ),
+                timeout=HTTP_TIMEOUT,
+            )
+        return self._http_client
+
+    def make_key(self, provider: str, api_key: Optional[str], base_url: Optional[str], model: str) -> ClientKey:
+        return (provider, hash_api_key(api_key), base_url or "", model)
+
+    def get_or_create(
+        self,
+        provider: str,
+        api_key: Optional[str],
+        base_url: Optional[str],
+        model: str,
+        factory: Callable[[], object],
+    ):
+        """获取缓存的客户端，不存在或已过期时调用 factory 创建"""
+        key = self.make_key(provider, api_key, base_url, model)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry is not None:
+                client, created_at = entry
+                if now - created_at < self.ttl:
+                    self._clients.move_to_end(key)
+                    self.hits += 1
+                    return client
+                # 已过期
+                del self._clients[key]
+                self.evictions += 1
+
+        client = factory()
+
+        with self._lock:
+            self.misses += 1
+            self._clients[key] = (client, now)
+            self._clients.move_to_end(key)
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+                self.evictions += 1
+        return client
+
+    def invalidate(self, provider: Optional[str] = None):
+        """清除缓存的客户端（可只清除某个 provider）"""
+        with self._lock:
+            if provider is None:
+                self._clients.clear()
+            else:
+                for key in [k for k in self._clients if k[0] == provider]:
+                    del self._clients[key]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._clients),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    async def aclose(self):
+        """关闭共享连接池（应用关闭时调用）"""
+        self.invalidate()
+        if self._http_client is not None and not self._http_client.is_closed:
+            await self._http_client.aclose()
+        self._http_client = None
+
+
+# 全局客户端注册表
+client_registry = AIClientRegistry()
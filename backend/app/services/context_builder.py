@@ -0,0 +1,195 @@
+"""
+对话上下文构建
+按模型的 token 预算组装发送给模型的历史消息：最近的若干轮原文保留，
+更早的对话由会话上保存的滚动摘要代替，不会读取永远不会被发送的旧消息。
+"""
+
+import os
+from typing import Dict, Optional, Set
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import AsyncSessionLocal
+from app.models.chat import ChatMessage, ChatSession
+from app.services.multi_ai_service import BaseAIService, ai_service, is_error_response
+from app.utils.tokens import estimate_message_tokens, estimate_tokens
+from app.utils.tracing import span
+
+# 各模型用于历史消息（摘要 + 最近对话）的 token 预算，需为系统提示和回复预留空间
+CONTEXT_TOKEN_BUDGETS = {
+    "gpt-4": 4000,
+    "deepseek-chat": 8000,
+    "claude-3-sonnet-20240229": 16000,
+    "moonshot-v1-8k": 4000,
+    "mock": 2000,
+}
+DEFAULT_CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "4000"))
+
+# 每次从数据库读取的历史消息条数
+HISTORY_PAGE_SIZE = int(os.getenv("CONTEXT_HISTORY_PAGE_SIZE", "20"))
+# 生成摘要后保留的原文比例（其余部分并入摘要），留出余量避免每轮都重新摘要
+SUMMARY_KEEP_RATIO = float(os.getenv("CONTEXT_SUMMARY_KEEP_RATIO", "0.5"))
+# 单次摘要调用最多输入的对话 token 数
+SUMMARY_INPUT_TOKENS = int(os.getenv("CONTEXT_SUMMARY_INPUT_TOKENS", "3000"))
+
+# 正在生成摘要的会话，避免同一会话并发重复摘要
+_summarizing_sessions: Set[int] = set()
+
+
+def get_context_budget(model_name: Optional[str]) -> int:
+    """获取模型的历史消息 token 预算"""
+    return CONTEXT_TOKEN_BUDGETS.get(model_name, DEFAULT_CONTEXT_TOKEN_BUDGET)
+
+
+async def load_recent_messages(
+    db: AsyncSession,
+    session_id: int,
+    budget: int,
+    after_message_id: int = 0,
+    before_message_id: Optional[int] = None
+) -> Dict:
+    """从最新消息开始倒序分页读取，直到 token 预算用完
+
+    返回 {"messages": 按时间正序的消息, "overflow": 是否有未放入预算且未被摘要覆盖的更早消息}
+    """
+    recent = []
+    remaining = budget
+    cursor = before_message_id
+    overflow = False
+
+    while True:
+        stmt = select(ChatMessage.id, ChatMessage.role, ChatMessage.content).where(
+            ChatMessage.session_id == session_id,
+            ChatMessage.id > after_message_id
+        )
+        if cursor is not None:
+            stmt = stmt.where(ChatMessage.id < cursor)
+        stmt = stmt.order_by(ChatMessage.id.desc()).limit(HISTORY_PAGE_SIZE)
+        rows = (await db.execute(stmt)).all()
+
+        for row in rows:
+            cost = estimate_message_tokens(row.content)
+            if cost > remaining:
+                overflow = True
+                break
+            recent.append({"id": row.id, "role": row.role, "content": row.content})
+            remaining -= cost
+
+        if overflow or len(rows) < HISTORY_PAGE_SIZE:
+            break
+        cursor = rows[-1].id
+
+    recent.reverse()
+    return {"messages": recent, "overflow": overflow}
+
+
+async def build_context(
+    db: AsyncSession,
+    session_id: Optional[int],
+    model_name: Optional[str],
+    before_message_id: Optional[int] = None
+) -> Dict:
+    """构建会话上下文
+
+    返回 {"summary": 早期对话摘要, "messages": [{"role", "content"}], "needs_summary": 是否需要更新摘要}
+    """
+    if not session_id:
+        return {"summary": None, "messages": [], "needs_summary": False}
+
+    with span("context"):
+        result = await db.execute(
+            select(ChatSession.summary, ChatSession.summary_message_id).where(ChatSession.id == session_id)
+        )
+        row = result.first()
+        summary = row.summary if row else None
+        summary_message_id = (row.summary_message_id if row else None) or 0
+
+        # 重新生成时，摘要可能覆盖了目标消息之后的内容，此时不使用摘要
+        if before_message_id is not None and summary_message_id >= before_message_id:
+            summary, summary_message_id = None, 0
+
+        budget = get_context_budget(model_name) - estimate_tokens(summary)
+        recent = await load_recent_messages(
+            db, session_id, max(budget, 0),
+            after_message_id=summary_message_id,
+            before_message_id=before_message_id
+        )
+        return {
+            "summary": summary,
+            "messages": [{"role": msg["role"], "content": msg["content"]} for msg in recent["messages"]],
+            "needs_summary": recent["overflow"],
+        }
+
+
+async def update_session_summary(session_id: int, service: Optional[BaseAIService] = None):
+    """把超出预算的早期消息增量并入会话摘要（在响应返回后后台执行）"""
+    if session_id in _summarizing_sessions:
+        return
+    _summarizing_sessions.add(session_id)
+    try:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(ChatSession.summary, ChatSession.summary_message_id).where(ChatSession.id == session_id)
+            )
+            session = result.first()
+            if not session:
+                return
+
+            model_name = getattr(service, "model_name", None)
+            summary_message_id = session.summary_message_id or 0
+            # 只保留预算的一部分作为原文，其余并入摘要，避免每轮都触发摘要
+            keep_budget = int(get_context_budget(model_name) * SUMMARY_KEEP_RATIO)
+            keep = await load_recent_messages(db, session_id, keep_budget, after_message_id=summary_message_id)
+            if not keep["overflow"]:
+                return
+            boundary_id = keep["messages"][0]["id"] if keep["messages"] else None
+
+            summary = session.summary
+            while True:
+                # 按摘要输入上限分批读取待合并的消息
+                stmt = select(ChatMessage.id, ChatMessage.role, ChatMessage.content).where(
+                    ChatMessage.session_id == session_id,
+                    ChatMessage.id > summary_message_id
+                )
+                if boundary_id is not None:
+                    stmt = stmt.where(ChatMessage.id < boundary_id)
+                stmt = stmt.order_by(ChatMessage.id).limit(HISTORY_PAGE_SIZE)
+                rows = (await db.execute(stmt)).all()
+                if not rows:
+                    break
+
+                batch, tokens = [], 0
+                for row in rows:
+                    cost = estimate_message_tokens(row.content)
+                    if batch and tokens + cost > SUMMARY_INPUT_TOKENS:
+                        break
+                    batch.append(row)
+                    tokens += cost
+
+                new_summary = await ai_service.summarize_conversation(
+                    summary,
+                    [{"role": row.role, "content": row.content} for row in batch],
+                    service=service
+                )
+                if is_error_response(new_summary):
+                    print(f"会话 {session_id} 摘要生成失败: {new_summary}")
+                    break
+
+                summary = new_summary
+                summary_message_id = batch[-1].id
+                # 保持 updated_at 不变，摘要不算会话活动
+                await db.execute(
+                    update(ChatSession)
+                    .where(ChatSession.id == session_id)
+                    .values(
+                        summary=summary,
+                        summary_message_id=summary_message_id,
+                        updated_at=ChatSession.updated_at
+                    )
+                )
+                await db.commit()
+    except Exception as e:
+        print(f"会话 {session_id} 摘要更新失败: {e}")
+    finally:
+        _summarizing_sessions.discard(session_id)
@@ -0,0 +1,260 @@
+"""
+文档文本提取
+PDF/DOCX 解析和文本切分是 CPU 密集操作，放到独立的工作进程中执行，
+避免在事件循环中阻塞整个 worker
+"""
+
+import asyncio
+import multiprocessing
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set
+
+from app.utils.metrics import registry
+from app.utils.tracing import record_span
+
+# 提取配置
+DOC_EXTRACT_WORKERS = int(os.getenv("DOC_EXTRACT_WORKERS", "2"))  # 工作进程数，0 表示在线程池中执行
+DOC_EXTRACT_TIMEOUT = float(os.getenv("DOC_EXTRACT_TIMEOUT", "60"))  # 单个文档提取超时（秒），不含排队等待时间
+DOC_EXTRACT_MAX_PAGES = int(os.getenv("DOC_EXTRACT_MAX_PAGES", "200"))  # 允许的最大页数
+DOC_CHUNK_SIZE = int(os.getenv("DOC_CHUNK_SIZE", "1000"))
+DOC_CHUNK_OVERLAP = int(os.getenv("DOC_CHUNK_OVERLAP", "200"))
+
+# 指标
+extract_queue_depth = registry.gauge(
+    "document_extract_queue_depth", "Documents waiting for or running in the extraction workers"
+)
+extract_seconds = registry.histogram(
+    "document_extract_seconds", "Document text extraction time", ["file_type", "status"]
+)
+
+
+class DocumentExtractionError(Exception):
+    """文档提取失败（格式不支持、页数超限、超时等）
+
+    retryable 为 True 表示失败与文档本身无关（超时、工作进程异常退出），稍后重试可能成功
+    """
+
+    def __init__(self, message: str, retryable: bool = False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def extract_document(file_path: str, file_type: str, max_pages: int = DOC_EXTRACT_MAX_PAGES) -> Dict:
+    """提取文档文本并切分（在工作进程中执行）
+
+    返回 {"text": 全文, "chunks": 切分后的文本块, "page_count": 页数（DOCX 为 None）}
+    """
+    # 在工作进程中才导入解析依赖，保持主进程和进程启动轻量
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    page_count = None
+    if file_type == "pdf":
+        from langchain_community.document_loaders import PyPDFLoader
+        from pypdf import PdfReader
+
+        # 先读页数，超限时不做完整解析
+        page_count = len(PdfReader(file_path).pages)
+        if page_count > max_pages:
+            raise DocumentExtractionError(f"文档页数 {page_count} 超过上限 {max_pages}")
+        loader = PyPDFLoader(file_path)
+    elif file_type == "docx":
+        from langchain_community.document_loaders import Docx2txtLoader
+        loader = Docx2txtLoader(file_path)
+    else:
+        raise DocumentExtractionError("不支持的文件格式")
+
+    documents = loader.load()
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=DOC_CHUNK_SIZE,
+        chunk_overlap=DOC_CHUNK_OVERLAP
+    )
+    chunks = [doc.page_content for doc in text_splitter.split_documents(documents)]
+    # 全文直接按页拼接，避免重叠切块带来的重复内容
+    text = "\n".join(doc.page_content for doc in documents)
+    return {"text": text, "chunks": chunks, "page_count": page_count}
+
+
+def _worker_main(conn):
+    """工作进程主循环：逐个接收提取任务并回传结果，父进程关闭管道时退出"""
+    while True:
+        try:
+            file_path, file_type, max_pages = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        try:
+            result = ("ok", extract_document(file_path, file_type, max_pages))
+        except DocumentExtractionError as e:
+            result = ("invalid", str(e))
+        except Exception as e:
+            result = ("error", f"{type(e).__name__}: {e}")
+        conn.send(result)
+
+
+class _ExtractWorker:
+    """一个常驻的提取进程，通过管道收发任务；超时时可以单独终止而不影响其它进程"""
+
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def run(self, task, timeout: float):
+        """发送任务并等待结果（阻塞，在线程中调用），超时返回 None；进程异常退出时抛出 EOFError"""
+        self.conn.send(task)
+        if not self.conn.poll(timeout):
+            return None
+        return self.conn.recv()
+
+    def kill(self):
+        self.process.terminate()
+        self.process.join(timeout=5)
+        self.conn.close()
+
+
+class DocumentExtractor:
+    """基于常驻工作进程的异步文档提取器
+
+    不使用 ProcessPoolExecutor：它无法单独终止某个工作进程，任何一个进程被终止都会让整个池失效，
+    其它正在提取的文档随之失败。这里每个文档独占一个工作进程，只对执行时间计超时（排队等待空闲进程的时间不计），
+    超时时只终止并替换处理该文档的进程。
+    """
+
+    def __init__(
+        self,
+        max_workers: int = DOC_EXTRACT_WORKERS,
+        timeout: float = DOC_EXTRACT_TIMEOUT,
+        max_pages: int = DOC_EXTRACT_MAX_PAGES
+    ):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_pages = max_pages
+        # spawn：不继承主进程的事件循环、线程和数据库连接
+        self._context = multiprocessing.get_context("spawn")
+        self._idle: List[_ExtractWorker] = []
+        self._workers: Set[_ExtractWorker] = set()
+        self._slots = 0  # 已占用的进程名额（含空闲进程和正在启动的进程）
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    async def _acquire(self) -> Optional[_ExtractWorker]:
+        """等待空闲进程；返回 None 表示获得了一个名额，由调用方启动新进程"""
+        if self._idle:
+            return self._idle.pop()
+        if self._slots < self.max_workers:
+            self._slots += 1
+            return None
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            return await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已分配到进程但调用方在恢复前被取消，归还给下一个等待者
+                self._release(future.result())
+            raise
+
+    def _release(self, worker: Optional[_ExtractWorker]):
+        """归还进程；worker 为 None 表示进程已终止，名额交给下一个等待者或释放"""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(worker)
+                return
+        if worker is None:
+            self._slots -= 1
+        else:
+            self._idle.append(worker)
+
+    def _run_task(self, worker: Optional[_ExtractWorker], task):
+        """在线程中执行一个任务，返回 (可复用的进程或 None, 结果)"""
+        try:
+            if worker is None or not worker.process.is_alive():
+                if worker is not None:
+                    self._discard(worker)
+                worker = _ExtractWorker(self._context)
+                self._workers.add(worker)
+            result = worker.run(task, self.timeout)
+        except (EOFError, OSError):
+            result = ("crashed", "文档提取进程异常退出")
+        except Exception as e:
+            result = ("crashed", str(e))
+        else:
+            if result is None:
+                # 只终止处理这个文档的进程
+                self._discard(worker)
+                return None, ("timeout", None)
+            return worker, result
+        if worker is not None:
+            self._discard(worker)
+        return None, result
+
+    def _discard(self, worker: _ExtractWorker):
+        self._workers.discard(worker)
+        worker.kill()
+
+    async def _extract_in_worker(self, task) -> tuple:
+        wait_start = time.perf_counter()
+        worker = await self._acquire()
+        record_span("extract_queue", wait_start)
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(None, self._run_task, worker, task)
+        try:
+            worker, result = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # 调用方被取消时提取仍在线程中进行，结束后再归还进程
+            future.add_done_callback(
+                lambda f: self._release(None if f.cancelled() or f.exception() else f.result()[0])
+            )
+            raise
+        self._release(worker)
+        return result
+
+    async def extract(self, file_path: str, file_type: str) -> Dict:
+        """异步提取文档内容，超时或失败时抛出 DocumentExtractionError"""
+        start = time.perf_counter()
+        status = "error"
+        extract_queue_depth.inc()
+        try:
+            if self.max_workers <= 0:
+                loop = asyncio.get_running_loop()
+                future = loop.run_in_executor(None, extract_document, file_path, file_type, self.max_pages)
+                result = await asyncio.wait_for(future, timeout=self.timeout)
+                status = "ok"
+                return result
+
+            kind, value = await self._extract_in_worker((file_path, file_type, self.max_pages))
+            if kind == "ok":
+                status = "ok"
+                return value
+            if kind == "timeout":
+                raise asyncio.TimeoutError()
+            # invalid/error：文档无法解析；crashed：工作进程异常，与文档无关
+            raise DocumentExtractionError(value, retryable=kind == "crashed")
+        except asyncio.TimeoutError:
+            status = "timeout"
+            raise DocumentExtractionError(f"文档处理超时（{self.timeout:.0f} 秒）", retryable=True)
+        except DocumentExtractionError:
+            raise
+        except Exception as e:
+            if self.max_workers <= 0:
+                # 线程中执行时异常来自文档解析本身
+                raise DocumentExtractionError(str(e)) from e
+            raise DocumentExtractionError(str(e), retryable=True) from e
+        finally:
+            extract_queue_depth.dec()
+            extract_seconds.observe(time.perf_counter() - start, file_type=file_type, status=status)
+            record_span("extract", start, file_type=file_type, status=status)
+
+    def shutdown(self):
+        for worker in list(self._workers):
+            self._discard(worker)
+        self._idle.clear()
+        self._slots = 0
+
+
+# 全局文档提取器
+document_extractor = DocumentExtractor()
@@ -0,0 +1,310 @@
+"""
+批量嵌入服务
+位于具体嵌入后端之前：按文本哈希去重（同一请求内、并发请求之间），命中持久化缓存的文本不再计算，
+其余文本按 EMBED_BATCH_SIZE 分批、以 EMBED_CONCURRENCY 的并发调用后端。
+缓存以 float16 追加写入内存映射文件，化验单表头、免责声明等在大量报告中重复出现的文本块只计算一次。
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from app.services.embeddings import normalize_rows
+from app.utils.metrics import registry
+
+try:
+    import fcntl
+except ImportError:  # Windows 上没有 fcntl，只在进程内加锁
+    fcntl = None
+
+# 嵌入服务配置
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))  # 每次调用后端的最大文本数
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "2"))  # 同时进行的后端调用数
+EMBED_CACHE_ENABLED = os.getenv("EMBED_CACHE_ENABLED", "true").lower() == "true"
+EMBED_CACHE_DIR = os.getenv("EMBED_CACHE_DIR", "embedding_cache")
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "200000"))  # 缓存写满后不再新增
+
+KEY_SIZE = 16  # 缓存键为 SHA-256 的前 16 字节
+
+embedding_chunks = registry.counter(
+    "embedding_chunks_total", "Chunks passed to the embedding service", ["source"]
+)
+embedding_batch_seconds = registry.histogram(
+    "embedding_batch_seconds", "Embedding backend call time per batch",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+embedding_throughput = registry.gauge(
+    "embedding_throughput_chunks_per_second", "Chunks embedded per second in the most recent request"
+)
+
+
+def chunk_key(text: str) -> bytes:
+    """文本块哈希：合并空白后计算，格式差异不影响命中"""
+    normalized = re.sub(r"\s+", " ", text).strip()
+    return hashlib.sha256(normalized.encode("utf-8")).digest()[:KEY_SIZE]
+
+
+class EmbeddingCache:
+    """持久化的嵌入缓存
+
+    keys.bin 和 vectors.f16 按相同顺序追加写入，index.json 记录已提交的条数（最后写入，作为提交点）；
+    其它进程写入后，按 index.json 的变化增量加载新增的键。
+    """
+
+    def __init__(self, path: str, dim: int, max_entries: int = EMBED_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.dim = dim
+        self.max_entries = max_entries
+        self.keys_file = os.path.join(path, "keys.bin")
+        self.vectors_file = os.path.join(path, "vectors.f16")
+        self.info_file = os.path.join(path, "index.json")
+        self.lock_file = os.path.join(path, ".lock")
+        self._lock = threading.Lock()
+        self._rows: Dict[bytes, int] = {}
+        self._vectors: Optional[np.ndarray] = None
+        self._info_stat = None
+        self.count = 0
+        os.makedirs(path, exist_ok=True)
+        with self._lock:
+            self._refresh()
+
+    def _stat_info(self):
+        try:
+            stat = os.stat(self.info_file)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _refresh(self):
+        info_stat = self._stat_info()
+        if info_stat == self._info_stat:
+            return
+        self._info_stat = info_stat
+        if info_stat is None:
+            return
+        with open(self.info_file, encoding="utf-8") as f:
+            info = json.load(f)
+        if info["dim"] != self.dim:
+            raise ValueError(f"嵌入缓存 {self.path} 的维度 {info['dim']} 与当前后端维度 {self.dim} 不一致")
+        count = info["count"]
+        if count > self.count:
+            with open(self.keys_file, "rb") as f:
+                f.seek(self.count * KEY_SIZE)
+                data = f.read((count - self.count) * KEY_SIZE)
+            for i in range(count - self.count):
+                self._rows[data[i * KEY_SIZE:(i + 1) * KEY_SIZE]] = self.count + i
+            self.count = count
+            self._vectors = np.memmap(self.vectors_file, dtype=np.float16, mode="r", shape=(count, self.dim))
+
+    def get_many(self, keys: List[bytes]) -> Dict[bytes, np.ndarray]:
+        with self._lock:
+            self._refresh()
+            rows = {key: self._rows[key] for key in keys if key in self._rows}
+            vectors = self._vectors
+        if not rows:
+            return {}
+        order = list(rows)
+        values = np.asarray(vectors[[rows[key] for key in order]], dtype=np.float32)
+        return dict(zip(order, values))
+
+    @contextmanager
+    def _write_lock(self):
+        with self._lock:
+            with open(self.lock_file, "a") as lock_fd:
+                if fcntl is not None:
+                    fcntl.flock(lock_fd, fcntl.LOCK_EX)
+                self._refresh()
+                yield
+
+    def put_many(self, items: Dict[bytes, np.ndarray]):
+        with self._write_lock():
+            new_keys = [key for key in items if key not in self._rows]
+            new_keys = new_keys[:max(self.max_entries - self.count, 0)]
+            if not new_keys:
+                return
+            vectors = np.stack([items[key] for key in new_keys]).astype(np.float16)
+
+            # 先截掉上次写入失败时残留的未提交数据，再追加
+            with open(self.keys_file, "ab") as f:
+                f.truncate(self.count * KEY_SIZE)
+                f.write(b"".join(new_keys))
+            with open(self.vectors_file, "ab") as f:
+                f.truncate(self.count * self.dim * 2)
+                f.write(vectors.tobytes())
+
+            count = self.count + len(new_keys)
+            tmp_file = f"{self.info_file}.tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump({"dim": self.dim, "count": count}, f)
+            os.replace(tmp_file, self.info_file)
+            self._info_stat = self._stat_info()
+
+            for i, key in enumerate(new_keys):
+                self._rows[key] = self.count + i
+            self.count = count
+            self._vectors = np.memmap(self.vectors_file, dtype=np.float16, mode="r", shape=(count, self.dim))
+
+
+class EmbeddingService:
+    """带去重、缓存和批处理的嵌入服务，接口与嵌入后端一致，可直接替代后端使用"""
+
+    def __init__(
+        self,
+        embedder,
+        batch_size: int = EMBED_BATCH_SIZE,
+        concurrency: int = EMBED_CONCURRENCY,
+        cache_enabled: bool = EMBED_CACHE_ENABLED,
+        cache_dir: str = EMBED_CACHE_DIR
+    ):
+        self.embedder = embedder
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.cache_enabled = cache_enabled
+        self.cache_dir = cache_dir
+        self._cache: Optional[EmbeddingCache] = None
+        self._cache_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embedding")
+        # 正在计算中的文本块，并发请求中相同的块等待同一次计算
+        self._inflight: Dict[bytes, Future] = {}
+        self._inflight_lock = threading.Lock()
+        self.chunks = {"cache": 0, "computed": 0, "deduplicated": 0}
+        self.compute_seconds = 0.0
+        self._stats_lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return self.embedder.name
+
+    @property
+    def dim(self) -> Optional[int]:
+        return self.embedder.dim
+
+    def _get_cache(self) -> Optional[EmbeddingCache]:
+        # 维度可能在首次调用后端后才知道（如 OpenAI），因此缓存延迟创建
+        if not self.cache_enabled or self.embedder.dim is None:
+            return None
+        with self._cache_lock:
+            if self._cache is None:
+                safe_name = re.sub(r"[^A-Za-z0-9_.-]+", "_", self.embedder.name)
+                try:
+                    self._cache = EmbeddingCache(os.path.join(self.cache_dir, safe_name), self.embedder.dim)
+                except Exception as e:
+                    print(f"嵌入缓存不可用，已禁用：{e!s}")
+                    self.cache_enabled = False
+            return self._cache
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        start = time.perf_counter()
+        vectors = normalize_rows(self.embedder.embed_documents(texts))
+        embedding_batch_seconds.observe(time.perf_counter() - start)
+        # 统一经过 float16，命中缓存与新计算的结果完全一致
+        return vectors.astype(np.float16).astype(np.float32)
+
+    def _count(self, source: str, n: int):
+        if n:
+            with self._stats_lock:
+                self.chunks[source] += n
+            embedding_chunks.inc(n, source=source)
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        """返回与 texts 一一对应的归一化向量（float32）"""
+        start = time.perf_counter()
+        keys = [chunk_key(text) for text in texts]
+
+        # 同一请求内去重
+        unique: Dict[bytes, str] = {}
+        for key, text in zip(keys, texts):
+            unique.setdefault(key, text)
+        self._count("deduplicated", len(texts) - len(unique))
+
+        cache = self._get_cache()
+        results = cache.get_many(list(unique)) if cache else {}
+        self._count("cache", len(results))
+
+        # 与其它请求中正在计算的块合并，其余的由本请求计算
+        waiting: Dict[bytes, Future] = {}
+        owned: Dict[bytes, Future] = {}
+        with self._inflight_lock:
+            for key in unique:
+                if key in results:
+                    continue
+                future = self._inflight.get(key)
+                if future is not None:
+                    waiting[key] = future
+                else:
+                    owned[key] = self._inflight[key] = Future()
+        self._count("deduplicated", len(waiting))
+
+        try:
+            if owned:
+                owned_keys = list(owned)
+                batches = [owned_keys[i:i + self.batch_size] for i in range(0, len(owned_keys), self.batch_size)]
+                compute_start = time.perf_counter()
+                batch_vectors = list(self._executor.map(
+                    lambda batch: self._embed_batch([unique[key] for key in batch]), batches
+                ))
+                with self._stats_lock:
+                    self.compute_seconds += time.perf_counter() - compute_start
+                computed = {}
+                for batch, vectors in zip(batches, batch_vectors):
+                    computed.update(zip(batch, vectors))
+                for key, future in owned.items():
+                    future.set_result(computed[key])
+                results.update(computed)
+                self._count("computed", len(computed))
+
+                cache = cache or self._get_cache()
+                if cache:
+                    try:
+                        cache.put_many(computed)
+                    except Exception as e:
+                        print(f"写入嵌入缓存失败：{e!s}")
+        except BaseException as e:
+            for future in owned.values():
+                if not future.done():
+                    future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                for key in owned:
+                    self._inflight.pop(key, None)
+
+        for key, future in waiting.items():
+            results[key] = future.result()
+
+        elapsed = time.perf_counter() - start
+        if texts and elapsed > 0:
+            embedding_throughput.set(len(texts) / elapsed)
+        if not texts:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        return np.stack([results[key] for key in keys])
+
+    def embed_query(self, text: str) -> np.ndarray:
+        # 查询文本几乎不会重复，直接调用后端
+        return normalize_rows(self.embedder.embed_query(text))[0]
+
+    def stats(self) -> Dict:
+        total = sum(self.chunks.values())
+        return {
+            "embedder": self.name,
+            "batch_size": self.batch_size,
+            "concurrency": self.concurrency,
+            "cache_enabled": self.cache_enabled,
+            "cache_entries": self._cache.count if self._cache else 0,
+            "chunks": dict(self.chunks),
+            "reuse_rate": round((self.chunks["cache"] + self.chunks["deduplicated"]) / total, 4) if total else 0.0,
+            "compute_chunks_per_second": (
+                round(self.chunks["computed"] / self.compute_seconds, 2) if self.compute_seconds else 0.0
+            ),
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
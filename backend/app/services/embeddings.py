@@ -0,0 +1,136 @@
+"""
+文本嵌入后端
+与 LangChain Embeddings 接口一致（embed_documents / embed_query），但直接返回 float32 的 numpy 数组：
+- hashing：确定性的特征哈希，无需模型和网络，适合测试和离线环境
+- sentence-transformers：本地模型（需提前下载到本地缓存）
+- openai：OpenAI 嵌入接口
+"""
+
+import hashlib
+import os
+import re
+from typing import List, Optional
+
+import numpy as np
+
+# 嵌入配置
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "hashing")  # hashing, sentence-transformers, openai
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "")  # 留空时使用各后端的默认模型
+HASHING_EMBEDDING_DIM = int(os.getenv("HASHING_EMBEDDING_DIM", "512"))
+
+DEFAULT_EMBEDDING_MODELS = {
+    "sentence-transformers": "paraphrase-multilingual-MiniLM-L12-v2",
+    "openai": "text-embedding-3-small",
+}
+
+# 英文/数字按词切分，中文按单字和相邻双字切分
+_WORD_PATTERN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+_CJK_PATTERN = re.compile(r"[一-鿿]+")
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """按行 L2 归一化，使内积即余弦相似度"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class HashingEmbedder:
+    """特征哈希嵌入：相同文本在任何机器上都得到相同向量"""
+
+    def __init__(self, dim: int = HASHING_EMBEDDING_DIM):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text: str) -> List[str]:
+        text = text.lower()
+        features = _WORD_PATTERN.findall(text)
+        for run in _CJK_PATTERN.findall(text):
+            features.extend(run)
+            features.extend(run[i:i + 2] for i in range(len(run) - 1))
+        return features
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature in self._features(text):
+            h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[h % self.dim] += 1.0 if (h >> 63) & 1 else -1.0
+        # 对词频做次线性缩放，避免高频词主导
+        return np.sign(vector) * np.log1p(np.abs(vector))
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return normalize_rows(np.stack([self._embed(text) for text in texts]))
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self.embed_documents([text])[0]
+
+
+class SentenceTransformerEmbedder:
+    """本地 sentence-transformers 模型，首次使用时加载"""
+
+    def __init__(self, model_name: str, batch_size: int = 32):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.name = f"sentence-transformers:{model_name}"
+        self._model = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(self.model_name)
+        return self._model
+
+    @property
+    def dim(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        vectors = self.model.encode(
+            texts, batch_size=self.batch_size, normalize_embeddings=True, convert_to_numpy=True
+        )
+        return np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1)
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self.embed_documents([text])[0]
+
+
+class OpenAIEmbedder:
+    """OpenAI 嵌入接口（需要网络和 OPENAI_API_KEY）"""
+
+    def __init__(self, model_name: str, api_key: Optional[str] = None):
+        from langchain_openai import OpenAIEmbeddings
+
+        self.model_name = model_name
+        self.name = f"openai:{model_name}"
+        self.dim = None  # 首次调用后才知道维度
+        self._client = OpenAIEmbeddings(model=model_name, openai_api_key=api_key or os.getenv("OPENAI_API_KEY"))
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        vectors = normalize_rows(self._client.embed_documents(texts))
+        self.dim = vectors.shape[1]
+        return vectors
+
+    def embed_query(self, text: str) -> np.ndarray:
+        vector = normalize_rows(self._client.embed_query(text))[0]
+        self.dim = vector.shape[0]
+        return vector
+
+
+def create_embedder(backend: str = EMBEDDING_BACKEND, model_name: str = EMBEDDING_MODEL):
+    """根据配置创建嵌入后端"""
+    model_name = model_name or DEFAULT_EMBEDDING_MODELS.get(backend, "")
+    if backend == "hashing":
+        return HashingEmbedder()
+    if backend == "sentence-transformers":
+        return SentenceTransformerEmbedder(model_name)
+    if backend == "openai":
+        return OpenAIEmbedder(model_name)
+    raise ValueError(f"不支持的嵌入后端: {backend}")
@@ -0,0 +1,234 @@
+"""
+模型调用调度
+所有模型服务调用在发出前都要经过对应提供商的限流器：
+- 最大并发数：同时进行中的调用数
+- RPM/TPM 令牌桶：每分钟请求数和 token 数（输入 + 预估输出，调用结束后按实际输出修正）
+- 优先级：排队时交互式对话（chat/流式）优先于后台任务（报告分析、对话摘要）
+这样可以贴着提供商的限额运行，而不是在突发流量时收到 429 并把错误文本返回给用户。
+
+限额按提供商配置，例如 LLM_MAX_CONCURRENCY_DEEPSEEK=8、LLM_RPM_OPENAI=500、LLM_TPM_OPENAI=30000，
+未单独配置的提供商使用 LLM_MAX_CONCURRENCY / LLM_RPM / LLM_TPM，取值 0 表示不限制。
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from app.utils.metrics import registry
+
+# 调度配置（全局默认值，可按提供商覆盖）
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))  # 每个提供商同时进行的最大调用数
+LLM_RPM = int(os.getenv("LLM_RPM", "0"))  # 每个提供商每分钟最大请求数
+LLM_TPM = int(os.getenv("LLM_TPM", "0"))  # 每个提供商每分钟最大 token 数
+LLM_EXPECTED_OUTPUT_TOKENS = int(os.getenv("LLM_EXPECTED_OUTPUT_TOKENS", "512"))  # 调用前为输出预留的 token 数
+
+# 优先级，数值越小越先调度
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BACKGROUND: "background"}
+
+queue_wait_seconds = registry.histogram(
+    "llm_queue_wait_seconds", "Time LLM calls wait in the provider scheduler queue", ["provider", "priority"],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+)
+queue_depth = registry.gauge("llm_queue_depth", "LLM calls waiting in the provider scheduler queue", ["provider"])
+active_calls = registry.gauge("llm_active_calls", "LLM calls currently running per provider", ["provider"])
+
+# 当前调用的优先级，未设置时按调用类型决定（对话为交互式，报告分析为后台）
+_priority: ContextVar[Optional[int]] = ContextVar("llm_priority", default=None)
+
+
+@contextmanager
+def priority(level: int):
+    """在代码块内以指定优先级发出模型调用，例如后台生成对话摘要"""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority(default: int) -> int:
+    level = _priority.get()
+    return default if level is None else level
+
+
+def _provider_limit(name: str, provider: str, default: int) -> int:
+    return int(os.getenv(f"{name}_{provider.upper()}", str(default)))
+
+
+class TokenBucket:
+    """每分钟补满的令牌桶"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """距离桶中有足够令牌还需等待的秒数（单次需求超过容量时按容量计算）"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        self._refill()
+        self.tokens -= amount
+
+    def give_back(self, amount: float):
+        """按实际用量修正预留量（可为负数，即补扣超出预留的部分）"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class ProviderLimiter:
+    """单个提供商的并发、RPM/TPM 限制和优先级队列"""
+
+    def __init__(self, provider: str, max_concurrency: int, rpm: int, tpm: int):
+        self.provider = provider
+        self.max_concurrency = max_concurrency
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.active = 0
+        # 队列元素：[优先级, 序号, 预留 token 数, Future]
+        self._queue: List[list] = []
+        self._seq = itertools.count()
+        self._timer = None
+        self.started = 0
+        self.queued = 0
+
+    def _wait_time(self, tokens: int) -> float:
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(1))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(tokens))
+        return wait
+
+    def _has_slot(self) -> bool:
+        return self.max_concurrency <= 0 or self.active < self.max_concurrency
+
+    def _start(self, tokens: int):
+        self.active += 1
+        self.started += 1
+        active_calls.set(self.active, provider=self.provider)
+        if self.requests is not None:
+            self.requests.take(1)
+        if self.tokens is not None:
+            self.tokens.take(tokens)
+
+    async def acquire(self, level: int, tokens: int):
+        """等待调度，返回后占用一个并发名额，调用结束必须 release"""
+        start = time.perf_counter()
+        if not self._queue and self._has_slot() and self._wait_time(tokens) == 0:
+            self._start(tokens)
+            queue_wait_seconds.observe(0.0, provider=self.provider, priority=PRIORITY_NAMES.get(level, str(level)))
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, [level, next(self._seq), tokens, future])
+        self.queued += 1
+        queue_depth.inc(provider=self.provider)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已被调度但调用方在恢复前被取消，归还名额和预留的 token
+                self.release(tokens, 0)
+            else:
+                future.cancel()
+                self._dispatch()
+            raise
+        finally:
+            queue_depth.dec(provider=self.provider)
+            queue_wait_seconds.observe(
+                time.perf_counter() - start, provider=self.provider, priority=PRIORITY_NAMES.get(level, str(level))
+            )
+
+    def release(self, reserved_tokens: int, used_tokens: Optional[int] = None):
+        self.active -= 1
+        active_calls.set(self.active, provider=self.provider)
+        if self.tokens is not None and used_tokens is not None:
+            self.tokens.give_back(reserved_tokens - used_tokens)
+        self._dispatch()
+
+    def _dispatch(self):
+        """按优先级放行排队的调用；令牌不足时在补足所需的时间后再次调度"""
+        while self._queue:
+            level, _, tokens, future = self._queue[0]
+            if future.done():
+                heapq.heappop(self._queue)
+                continue
+            if not self._has_slot():
+                return
+            wait = self._wait_time(tokens)
+            if wait > 0:
+                self._schedule_retry(wait)
+                return
+            heapq.heappop(self._queue)
+            self._start(tokens)
+            future.set_result(None)
+
+    def _schedule_retry(self, wait: float):
+        loop = asyncio.get_running_loop()
+        if self._timer is not None:
+            timer_loop, handle = self._timer
+            if timer_loop is loop and not handle.cancelled():
+                return
+        self._timer = (loop, loop.call_later(wait, self._on_timer))
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    def stats(self) -> Dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "rpm": int(self.requests.capacity) if self.requests else 0,
+            "tpm": int(self.tokens.capacity) if self.tokens else 0,
+            "active": self.active,
+            "queued_now": sum(1 for entry in self._queue if not entry[3].done()),
+            "started": self.started,
+            "queued_total": self.queued,
+        }
+
+
+class LLMScheduler:
+    """按提供商创建限流器"""
+
+    def __init__(self):
+        self._limiters: Dict[str, ProviderLimiter] = {}
+
+    def limiter(self, provider: str) -> ProviderLimiter:
+        limiter = self._limiters.get(provider)
+        if limiter is None:
+            # 模拟服务默认不限制，需要时可通过 *_MOCK 单独配置
+            default_concurrency = 0 if provider == "mock" else LLM_MAX_CONCURRENCY
+            limiter = ProviderLimiter(
+                provider,
+                _provider_limit("LLM_MAX_CONCURRENCY", provider, default_concurrency),
+                _provider_limit("LLM_RPM", provider, LLM_RPM),
+                _provider_limit("LLM_TPM", provider, LLM_TPM),
+            )
+            self._limiters[provider] = limiter
+        return limiter
+
+    def stats(self) -> Dict:
+        return {provider: limiter.stats() for provider, limiter in self._limiters.items()}
+
+
+# 全局调度器
+llm_scheduler = LLMScheduler()
@@ -1,6 +1,9 @@
+import asyncio
 import os
+import random
+import time
 from abc import ABC, abstractmethod
-from typing import Dict, List, Optional
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
 from dotenv import load_dotenv
 from langchain.memory import ConversationBufferMemory
@@ -9,11 +12,95 @@ from langchain.memory import ConversationBufferMemory
 from langchain.schema import AIMessage, HumanMessage, SystemMessage
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import Docx2txtLoader, PyPDFLoader
-from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings
+
+from app.services.client_registry import client_registry
+from app.services.document_extractor import document_extractor
+from app.services.embedding_service import EmbeddingService
+from app.services.embeddings import EMBEDDING_BACKEND, create_embedder
+from app.services.llm_scheduler import (
+    LLM_EXPECTED_OUTPUT_TOKENS,
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    current_priority,
+    llm_scheduler,
+    priority,
+)
+from app.services.provider_health import LLM_HEDGE_ENABLED, provider_health
+from app.services.report_analysis import map_reduce_analyze, needs_map_reduce, report_analysis_seconds
+from app.services.report_retrieval import RAG_ENABLED, format_report_references, retrieve_report_chunks
+from app.services.request_coalescer import request_coalescer
+from app.services.response_cache import make_cache_key, response_cache
+from app.services.vector_store import VectorStoreManager
+from app.utils.metrics import registry
+from app.utils.tokens import estimate_message_tokens, estimate_tokens
+from app.utils.tracing import record_span, span
 
 load_dotenv()
 
+# 各服务在调用失败时返回的错误前缀
+ERROR_PREFIXES = (
+    "OpenAI 服务错误",
+    "DeepSeek 服务错误",
+    "Anthropic 服务错误",
+    "Kimi 服务错误",
+    "模型服务错误",
+    "报告分析失败",
+)
+
+# 模拟服务配置（离线开发和压测时模拟真实提供商的延迟与故障）
+MOCK_LATENCY = os.getenv("MOCK_LATENCY", "none")  # 调用延迟（流式为首个 token 前的延迟）分布，格式见 LatencyProfile
+MOCK_TOKEN_DELAY = float(os.getenv("MOCK_TOKEN_DELAY", "0.02"))  # 流式输出每个字符之间的延迟（秒）
+MOCK_ERROR_RATE = float(os.getenv("MOCK_ERROR_RATE", "0"))  # 返回错误信息的调用比例（0~1）
+
+# 按提供商统计的模型调用指标（由 ScheduledAIService 记录）
+llm_request_seconds = registry.histogram(
+    "llm_request_duration_seconds", "LLM provider call latency excluding scheduler queue wait",
+    ["provider", "method", "status"],
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+)
+llm_first_token_seconds = registry.histogram(
+    "llm_time_to_first_token_seconds", "Time to the first streamed token", ["provider"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+llm_errors = registry.counter("llm_errors_total", "LLM provider calls that returned an error", ["provider", "method"])
+llm_tokens = registry.counter("llm_tokens_total", "Estimated LLM tokens by direction", ["provider", "direction"])
+
+# 故障切换与对冲的调用统计
+llm_attempts = registry.counter(
+    "llm_attempts_total", "Provider calls made by the failover policy", ["provider", "reason"]
+)
+llm_attempt_wins = registry.counter(
+    "llm_attempt_wins_total", "Provider calls whose answer was used by the failover policy", ["provider"]
+)
+
+
+def is_error_response(text: Optional[str]) -> bool:
+    """判断模型返回内容是否为服务错误信息"""
+    return not text or text.startswith(ERROR_PREFIXES)
+
+
+# 各提供商默认使用的模型
+DEFAULT_MODELS = {
+    "openai": "gpt-4",
+    "deepseek": "deepseek-chat",
+    "anthropic": "claude-3-sonnet-20240229",
+    "kimi": "moonshot-v1-8k",
+    "mock": "mock",
+}
+
+
+def to_langchain_messages(messages: List[Dict[str, str]]) -> list:
+    """将 {"role", "content"} 字典列表转换为 LangChain 消息对象"""
+    langchain_messages = []
+    for msg in messages:
+        if msg["role"] == "system":
+            langchain_messages.append(SystemMessage(content=msg["content"]))
+        elif msg["role"] == "user":
+            langchain_messages.append(HumanMessage(content=msg["content"]))
+        elif msg["role"] == "assistant":
+            langchain_messages.append(AIMessage(content=msg["content"]))
+    return langchain_messages
+
 
 class BaseAIService(ABC):
     """AI 服务基类"""
@@ -23,6 +110,11 @@ class BaseAIService(ABC):
         """发送聊天消息"""
         pass
 
+    @abstractmethod
+    def astream(self, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        """流式发送聊天消息，逐个返回生成的文本片段"""
+        pass
+
     @abstractmethod
     async def analyze_report(self, content: str) -> str:
         """分析医疗报告"""
@@ -32,31 +124,35 @@ class BaseAIService(ABC):
 class OpenAIService(BaseAIService):
     """OpenAI 服务"""
 
-    def __init__(self, api_key=None, base_url=None):
+    provider = "openai"
+
+    def __init__(self, api_key=None, base_url=None, model=None, http_async_client=None):
         from langchain_openai import ChatOpenAI
+        self.model_name = model or DEFAULT_MODELS[self.provider]
+        self.temperature = 0.7
         self.llm = ChatOpenAI(
-            model="gpt-4",
-            temperature=0.7,
+            model=self.model_name,
+            temperature=self.temperature,
             openai_api_key=api_key or os.getenv("OPENAI_API_KEY"),
-            openai_api_base=base_url or os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+            openai_api_base=base_url or os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1"),
+            http_async_client=http_async_client
         )
 
     async def chat(self, messages: List[Dict[str, str]]) -> str:
         try:
-            langchain_messages = []
-            for msg in messages:
-                if msg["role"] == "system":
-                    langchain_messages.append(SystemMessage(content=msg["content"]))
-                elif msg["role"] == "user":
-                    langchain_messages.append(HumanMessage(content=msg["content"]))
-                elif msg["role"] == "assistant":
-                    langchain_messages.append(AIMessage(content=msg["content"]))
-
-            response = await self.llm.ainvoke(langchain_messages)
+            response = await self.llm.ainvoke(to_langchain_messages(messages))
             return response.content
         except Exception as e:
             return f"OpenAI 服务错误：{e!s}"
 
+    async def astream(self, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        try:
+            async for chunk in self.llm.astream(to_langchain_messages(messages)):
+                if chunk.content:
+                    yield chunk.content
+        except Exception as e:
+            yield f"OpenAI 服务错误：{e!s}"
+
     async def analyze_report(self, analysis_prompt: str) -> str:
         try:
             response = await self.llm.ainvoke([HumanMessage(content=analysis_prompt)])
@@ -68,31 +164,35 @@ class OpenAIService(BaseAIService):
 class DeepSeekService(BaseAIService):
     """DeepSeek 服务"""
 
-    def __init__(self, api_key=None, base_url=None):
+    provider = "deepseek"
+
+    def __init__(self, api_key=None, base_url=None, model=None, http_async_client=None):
         from langchain_openai import ChatOpenAI
+        self.model_name = model or DEFAULT_MODELS[self.provider]
+        self.temperature = 0.7
         self.llm = ChatOpenAI(
-            model="deepseek-chat",
-            temperature=0.7,
+            model=self.model_name,
+            temperature=self.temperature,
             openai_api_key=api_key or os.getenv("DEEPSEEK_API_KEY"),
-            openai_api_base=base_url or os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1")
+            openai_api_base=base_url or os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1"),
+            http_async_client=http_async_client
         )
 
     async def chat(self, messages: List[Dict[str, str]]) -> str:
         try:
-            langchain_messages = []
-            for msg in messages:
-                if msg["role"] == "system":
-                    langchain_messages.append(SystemMessage(content=msg["content"]))
-                elif msg["role"] == "user":
-                    langchain_messages.append(HumanMessage(content=msg["content"]))
-                elif msg["role"] == "assistant":
-                    langchain_messages.append(AIMessage(content=msg["content"]))
-
-            response = await self.llm.ainvoke(langchain_messages)
+            response = await self.llm.ainvoke(to_langchain_messages(messages))
             return response.content
         except Exception as e:
             return f"DeepSeek 服务错误：{e!s}"
 
+    async def astream(self, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        try:
+            async for chunk in self.llm.astream(to_langchain_messages(messages)):
+                if chunk.content:
+                    yield chunk.content
+        except Exception as e:
+            yield f"DeepSeek 服务错误：{e!s}"
+
     async def analyze_report(self, analysis_prompt: str) -> str:
         try:
             response = await self.llm.ainvoke([HumanMessage(content=analysis_prompt)])
@@ -104,30 +204,34 @@ class DeepSeekService(BaseAIService):
 class AnthropicService(BaseAIService):
     """Anthropic (Claude) 服务"""
 
-    def __init__(self, api_key=None):
+    provider = "anthropic"
+
+    def __init__(self, api_key=None, model=None):
         from langchain_anthropic import ChatAnthropic
+        self.model_name = model or DEFAULT_MODELS[self.provider]
+        self.temperature = 0.7
+        # ChatAnthropic 内部自带连接池，实例本身由注册表复用
         self.llm = ChatAnthropic(
-            model="claude-3-sonnet-20240229",
-            temperature=0.7,
+            model=self.model_name,
+            temperature=self.temperature,
             anthropic_api_key=api_key or os.getenv("ANTHROPIC_API_KEY")
         )
 
     async def chat(self, messages: List[Dict[str, str]]) -> str:
         try:
-            langchain_messages = []
-            for msg in messages:
-                if msg["role"] == "system":
-                    langchain_messages.append(SystemMessage(content=msg["content"]))
-                elif msg["role"] == "user":
-                    langchain_messages.append(HumanMessage(content=msg["content"]))
-                elif msg["role"] == "assistant":
-                    langchain_messages.append(AIMessage(content=msg["content"]))
-
-            response = await self.llm.ainvoke(langchain_messages)
+            response = await self.llm.ainvoke(to_langchain_messages(messages))
             return response.content
         except Exception as e:
             return f"Anthropic 服务错误：{e!s}"
 
+    async def astream(self, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        try:
+            async for chunk in self.llm.astream(to_langchain_messages(messages)):
+                if chunk.content:
+                    yield chunk.content
+        except Exception as e:
+            yield f"Anthropic 服务错误：{e!s}"
+
     async def analyze_report(self, analysis_prompt: str) -> str:
         try:
             response = await self.llm.ainvoke([HumanMessage(content=analysis_prompt)])
@@ -139,31 +243,35 @@ class AnthropicService(BaseAIService):
 class KimiService(BaseAIService):
     """Kimi 服务 (通过 Moonshot API)"""
 
-    def __init__(self, api_key=None, base_url=None):
+    provider = "kimi"
+
+    def __init__(self, api_key=None, base_url=None, model=None, http_async_client=None):
         from langchain_openai import ChatOpenAI
+        self.model_name = model or DEFAULT_MODELS[self.provider]
+        self.temperature = 0.7
         self.llm = ChatOpenAI(
-            model="moonshot-v1-8k",
-            temperature=0.7,
+            model=self.model_name,
+            temperature=self.temperature,
             openai_api_key=api_key or os.getenv("KIMI_API_KEY"),
-            openai_api_base=base_url or os.getenv("KIMI_BASE_URL", "https://api.moonshot.cn/v1")
+            openai_api_base=base_url or os.getenv("KIMI_BASE_URL", "https://api.moonshot.cn/v1"),
+            http_async_client=http_async_client
         )
 
     async def chat(self, messages: List[Dict[str, str]]) -> str:
         try:
-            langchain_messages = []
-            for msg in messages:
-                if msg["role"] == "system":
-                    langchain_messages.append(SystemMessage(content=msg["content"]))
-                elif msg["role"] == "user":
-                    langchain_messages.append(HumanMessage(content=msg["content"]))
-                elif msg["role"] == "assistant":
-                    langchain_messages.append(AIMessage(content=msg["content"]))
-
-            response = await self.llm.ainvoke(langchain_messages)
+            response = await self.llm.ainvoke(to_langchain_messages(messages))
             return response.content
         except Exception as e:
             return f"Kimi 服务错误：{e!s}"
 
+    async def astream(self, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        try:
+            async for chunk in self.llm.astream(to_langchain_messages(messages)):
+                if chunk.content:
+                    yield chunk.content
+        except Exception as e:
+            yield f"Kimi 服务错误：{e!s}"
+
     async def analyze_report(self, analysis_prompt: str) -> str:
         try:
             response = await self.llm.ainvoke([HumanMessage(content=analysis_prompt)])
@@ -172,10 +280,70 @@ class KimiService(BaseAIService):
             return f"报告分析失败：{e!s}"
 
 
-class MockAIService(BaseAIService):
-    """模拟 AI 服务（用于测试或离线模式）"""
+class LatencyProfile:
+    """模拟调用延迟的分布（秒）
+
+    格式：
+    - none：无延迟
+    - fixed:0.5：固定 0.5 秒
+    - uniform:0.2,1.5：0.2~1.5 秒均匀分布
+    - normal:0.8,0.2：均值 0.8、标准差 0.2（小于 0 时取 0）
+    - lognormal:0.8,0.6：中位数 0.8、对数标准差 0.6，长尾，接近真实提供商的延迟分布
+    - exponential:0.5：均值 0.5 的指数分布
+    """
+
+    DISTRIBUTIONS = {"none": 0, "fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2, "exponential": 1}
+
+    def __init__(self, spec: str = "none"):
+        name, _, params = spec.strip().partition(":")
+        name = name.lower() or "none"
+        if name not in self.DISTRIBUTIONS:
+            raise ValueError(f"未知的延迟分布：{spec}")
+        values = [float(value) for value in params.split(",") if value.strip()]
+        if len(values) != self.DISTRIBUTIONS[name]:
+            raise ValueError(f"延迟分布 {name} 需要 {self.DISTRIBUTIONS[name]} 个参数：{spec}")
+        self.spec = spec
+        self.name = name
+        self.params = values
+
+    def sample(self, rng: random.Random) -> float:
+        if self.name == "fixed":
+            return self.params[0]
+        if self.name == "uniform":
+            return rng.uniform(*self.params)
+        if self.name == "normal":
+            return max(rng.gauss(*self.params), 0.0)
+        if self.name == "lognormal":
+            median, sigma = self.params
+            return median * rng.lognormvariate(0, sigma) if median > 0 else 0.0
+        if self.name == "exponential":
+            return rng.expovariate(1 / self.params[0]) if self.params[0] > 0 else 0.0
+        return 0.0
 
-    def __init__(self):
+
+class MockAIService(BaseAIService):
+    """模拟 AI 服务（用于测试、离线模式和压测）
+
+    延迟、流式输出节奏和错误比例默认读取 MOCK_LATENCY / MOCK_TOKEN_DELAY / MOCK_ERROR_RATE，
+    注入的错误与真实提供商一样以错误信息文本返回。
+    """
+
+    provider = "mock"
+
+    def __init__(
+        self,
+        token_delay: Optional[float] = None,
+        latency: Optional[str] = None,
+        error_rate: Optional[float] = None,
+        seed: Optional[int] = None
+    ):
+        self.model_name = DEFAULT_MODELS[self.provider]
+        self.temperature = 0.0
+        # 流式输出时每个字符之间的模拟延迟（秒）
+        self.token_delay = MOCK_TOKEN_DELAY if token_delay is None else token_delay
+        self.latency = LatencyProfile(MOCK_LATENCY if latency is None else latency)
+        self.error_rate = MOCK_ERROR_RATE if error_rate is None else error_rate
+        self.random = random.Random(seed)
         self.medical_responses = [
             "根据您描述的症状，建议您咨询专业医生进行详细检查。",
             "这些症状可能与多种疾病相关，需要进一步的医学检查来确定具体原因。",
@@ -184,11 +352,29 @@ class MockAIService(BaseAIService):
             "建议您进行相关的医学检查，如血液检查、影像学检查等。"
         ]
 
+    async def _simulate_call(self) -> bool:
+        """等待一次采样的调用延迟，返回本次调用是否注入错误"""
+        delay = self.latency.sample(self.random)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return self.error_rate > 0 and self.random.random() < self.error_rate
+
     async def chat(self, messages: List[Dict[str, str]]) -> str:  # noqa: ARG002
-        import random
-        return random.choice(self.medical_responses)
+        if await self._simulate_call():
+            return "模型服务错误：模拟的服务错误"
+        return self.random.choice(self.medical_responses)
+
+    async def astream(self, messages: List[Dict[str, str]]) -> AsyncIterator[str]:  # noqa: ARG002
+        if await self._simulate_call():
+            yield "模型服务错误：模拟的服务错误"
+            return
+        for token in self.random.choice(self.medical_responses):
+            await asyncio.sleep(self.token_delay)
+            yield token
 
     async def analyze_report(self, analysis_prompt: str) -> str:
+        if await self._simulate_call():
+            return "报告分析失败：模拟的服务错误"
         return f"""
         模拟报告分析结果：
 
@@ -204,56 +390,334 @@ class MockAIService(BaseAIService):
         """
 
 
+class ScheduledAIService(BaseAIService):
+    """经过提供商调度器（并发、RPM/TPM、优先级）发出调用的服务包装
+
+    所有提供商的服务都经由它调用，因此按提供商统计调用耗时（不含排队时间）、错误数和 token 数也在这里完成；
+    token 数为估算值，与 TPM 限流使用的口径一致。
+    """
+
+    def __init__(self, service: BaseAIService):
+        self.service = service
+        self.provider = service.provider
+        self.model_name = service.model_name
+        self.temperature = service.temperature
+        self.limiter = llm_scheduler.limiter(self.provider)
+
+    async def _acquire(self, level: int, reserved: int):
+        start = time.perf_counter()
+        await self.limiter.acquire(level, reserved)
+        record_span("llm_queue", start, provider=self.provider)
+
+    def _record(self, method: str, start: float, prompt_tokens: int, output: Optional[str], cancelled: bool):
+        # 被取消的调用（对冲落败、客户端断开）单独统计，不计为错误
+        if cancelled:
+            status = "cancelled"
+        elif is_error_response(output):
+            status = "error"
+            llm_errors.inc(provider=self.provider, method=method)
+        else:
+            status = "ok"
+        llm_request_seconds.observe(time.perf_counter() - start, provider=self.provider, method=method, status=status)
+        record_span("llm", start, provider=self.provider, model=self.model_name, method=method, status=status)
+        llm_tokens.inc(prompt_tokens, provider=self.provider, direction="prompt")
+        llm_tokens.inc(estimate_tokens(output), provider=self.provider, direction="completion")
+
+    async def chat(self, messages: List[Dict[str, str]]) -> str:
+        prompt_tokens = sum(estimate_message_tokens(msg["content"]) for msg in messages)
+        reserved = prompt_tokens + LLM_EXPECTED_OUTPUT_TOKENS
+        await self._acquire(current_priority(PRIORITY_INTERACTIVE), reserved)
+        start = time.perf_counter()
+        response = None
+        cancelled = False
+        try:
+            response = await self.service.chat(messages)
+            return response
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            self.limiter.release(reserved, prompt_tokens + estimate_tokens(response))
+            self._record("chat", start, prompt_tokens, response, cancelled)
+
+    async def astream(self, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        prompt_tokens = sum(estimate_message_tokens(msg["content"]) for msg in messages)
+        reserved = prompt_tokens + LLM_EXPECTED_OUTPUT_TOKENS
+        await self._acquire(current_priority(PRIORITY_INTERACTIVE), reserved)
+        start = time.perf_counter()
+        tokens = []
+        cancelled = False
+        try:
+            async for token in self.service.astream(messages):
+                if not tokens:
+                    llm_first_token_seconds.observe(time.perf_counter() - start, provider=self.provider)
+                tokens.append(token)
+                yield token
+        except (asyncio.CancelledError, GeneratorExit):
+            cancelled = True
+            raise
+        finally:
+            response = "".join(tokens)
+            self.limiter.release(reserved, prompt_tokens + estimate_tokens(response))
+            self._record("astream", start, prompt_tokens, response, cancelled)
+
+    async def analyze_report(self, analysis_prompt: str) -> str:
+        prompt_tokens = estimate_message_tokens(analysis_prompt)
+        reserved = prompt_tokens + LLM_EXPECTED_OUTPUT_TOKENS
+        await self._acquire(current_priority(PRIORITY_BACKGROUND), reserved)
+        start = time.perf_counter()
+        analysis = None
+        cancelled = False
+        try:
+            analysis = await self.service.analyze_report(analysis_prompt)
+            return analysis
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            self.limiter.release(reserved, prompt_tokens + estimate_tokens(analysis))
+            self._record("analyze_report", start, prompt_tokens, analysis, cancelled)
+
+
+class FailoverAIService(BaseAIService):
+    """按顺序组合多个模型服务：对冲慢请求、失败时切换到下一个服务
+
+    当前服务超过其观测延迟分位数仍未返回时，向下一个服务发出对冲请求，采用先返回的成功结果并取消其它请求；
+    返回错误时立即切换到下一个服务。处于熔断状态的服务会被跳过（全部熔断时仍按顺序尝试）。
+    流式请求以首个片段到达为准，开始输出后不再切换。
+    """
+
+    provider = "failover"
+
+    def __init__(self, services: List[BaseAIService]):
+        self.services = services
+        self.model_name = ",".join(f"{service.provider}:{service.model_name}" for service in services)
+        self.temperature = services[0].temperature
+
+    def _candidates(self) -> Tuple[List[BaseAIService], bool]:
+        """返回候选服务及其是否经熔断器放行；放行即占用半开服务的试探名额，未发出的候选需归还"""
+        allowed = [service for service in self.services if provider_health.get(service).allow()]
+        if allowed:
+            return allowed, True
+        return list(self.services), False
+
+    async def _race(self, kind: str, call) -> str:
+        """依次/对冲地调用各服务，返回第一个成功的结果；全部失败时返回最后一个错误信息"""
+        candidates, admitted = self._candidates()
+        pending = {}
+        launched = 0
+        last_error = None
+
+        def launch(reason: str):
+            nonlocal launched
+            service = candidates[launched]
+            launched += 1
+            task = asyncio.ensure_future(call(service))
+            pending[task] = (service, time.perf_counter())
+            llm_attempts.inc(provider=service.provider, reason=reason)
+
+        launch("primary")
+        try:
+            while pending:
+                newest = list(pending.values())[-1][0]
+                can_hedge = LLM_HEDGE_ENABLED and launched < len(candidates)
+                timeout = provider_health.get(newest).hedge_delay(kind) if can_hedge else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    launch("hedge")
+                    continue
+                for task in done:
+                    service, started = pending.pop(task)
+                    health = provider_health.get(service)
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        result = f"模型服务错误（{service.provider}）：{e!s}"
+                    if is_error_response(result):
+                        health.record_failure()
+                        last_error = result
+                        continue
+                    health.record_success(kind, time.perf_counter() - started)
+                    llm_attempt_wins.inc(provider=service.provider)
+                    return result
+                if not pending and launched < len(candidates):
+                    launch("failover")
+            return last_error
+        finally:
+            for task, (service, _) in pending.items():
+                task.cancel()
+            if admitted:
+                for service in [service for service, _ in pending.values()] + candidates[launched:]:
+                    provider_health.get(service).release()
+
+    async def chat(self, messages: List[Dict[str, str]]) -> str:
+        return await self._race("chat", lambda service: service.chat(messages))
+
+    async def analyze_report(self, analysis_prompt: str) -> str:
+        return await self._race("analyze_report", lambda service: service.analyze_report(analysis_prompt))
+
+    async def astream(self, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        candidates, admitted = self._candidates()
+        pending = {}
+        launched = 0
+        last_error = None
+        winner = None
+
+        def launch(reason: str):
+            nonlocal launched
+            service = candidates[launched]
+            launched += 1
+            stream = service.astream(messages)
+            task = asyncio.ensure_future(stream.__anext__())
+            pending[task] = (service, stream, time.perf_counter())
+            llm_attempts.inc(provider=service.provider, reason=reason)
+
+        launch("primary")
+        try:
+            # 以首个片段（首字延迟）决定使用哪个服务
+            while pending and winner is None:
+                newest = list(pending.values())[-1][0]
+                can_hedge = LLM_HEDGE_ENABLED and launched < len(candidates)
+                timeout = provider_health.get(newest).hedge_delay("stream") if can_hedge else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    launch("hedge")
+                    continue
+                for task in done:
+                    service, stream, started = pending.pop(task)
+                    health = provider_health.get(service)
+                    try:
+                        first = task.result()
+                    except StopAsyncIteration:
+                        first = None
+                    except Exception as e:
+                        first = f"模型服务错误（{service.provider}）：{e!s}"
+                    if is_error_response(first):
+                        health.record_failure()
+                        last_error = first
+                        await stream.aclose()
+                        continue
+                    health.record_success("stream", time.perf_counter() - started)
+                    llm_attempt_wins.inc(provider=service.provider)
+                    winner = (first, stream)
+                    break
+                if winner is None and not pending and launched < len(candidates):
+                    launch("failover")
+        finally:
+            for task, (service, stream, _) in pending.items():
+                task.cancel()
+            if admitted:
+                for service in [service for service, _, _ in pending.values()] + candidates[launched:]:
+                    provider_health.get(service).release()
+            for task, (_, stream, _) in pending.items():
+                try:
+                    await task
+                except BaseException:
+                    pass
+                await stream.aclose()
+
+        if winner is None:
+            if last_error:
+                yield last_error
+            return
+        first, stream = winner
+        try:
+            yield first
+            async for token in stream:
+                yield token
+        finally:
+            await stream.aclose()
+
+
 class MultiAIService:
     """多模型 AI 服务管理器"""
 
     def __init__(self):
         self.model_type = "mock"
-        # 只有在非 mock 模式下才初始化 embeddings
-        if self.model_type != "mock":
-            try:
-                self.embeddings = OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY"))
-            except Exception as e:
-                print(f"Embeddings 初始化失败：{e!s}")
-                self.embeddings = None
-        else:
+        # 嵌入后端由 EMBEDDING_BACKEND 决定，默认的 hashing 后端无需模型和网络
+        try:
+            self.embeddings = create_embedder(EMBEDDING_BACKEND)
+        except Exception as e:
+            print(f"Embeddings 初始化失败：{e!s}")
             self.embeddings = None
+        # 批量、去重、带持久化缓存的嵌入服务，所有文本块嵌入都经过它
+        self.embedding_service = EmbeddingService(self.embeddings) if self.embeddings else None
         self.memories: Dict[int, ConversationBufferMemory] = {}
-        self.vector_store = None
-        self.ai_service = MockAIService()
+        # 按用户持久化的报告向量索引
+        self.vector_store = VectorStoreManager(self.embedding_service) if self.embedding_service else None
+        self.ai_service = ScheduledAIService(MockAIService())
 
-    def create_user_ai_service(self, user_settings: dict):
-        """根据用户设置创建AI服务实例"""
+    def create_user_ai_service(self, user_settings: dict) -> BaseAIService:
+        """根据用户设置获取AI服务实例
+
+        客户端从注册表中按 (provider, api_key, base_url, model) 复用，返回值只在
+        当前请求中使用，不会修改全局的 self.ai_service，避免并发用户互相串用模型。
+        用户配置了备用模型（fallback_models）时，返回按 首选模型 + 备用模型 顺序组合的故障切换服务。
+        """
         if not user_settings:
             return self.ai_service
 
         preferred_model = user_settings.get("preferred_model", "openai")
-        print(f"当前用户首选模型：{preferred_model}")
         api_keys = user_settings.get("api_keys", {})
         base_urls = user_settings.get("base_urls", {})
 
-        if preferred_model == "openai":
+        services = []
+        with span("llm_client", provider=preferred_model):
+            for provider in [preferred_model, *(user_settings.get("fallback_models") or [])]:
+                if any(service.provider == provider for service in services):
+                    continue
+                service = self._create_provider_service(provider, api_keys, base_urls)
+                if service is not None:
+                    services.append(service)
+
+        # 如果用户设置无效或没有API密钥，返回默认服务
+        if not services:
+            return self.ai_service
+        if len(services) == 1:
+            return services[0]
+        return FailoverAIService(services)
+
+    def _create_provider_service(
+        self,
+        provider: str,
+        api_keys: Dict[str, str],
+        base_urls: Dict[str, str]
+    ) -> Optional[BaseAIService]:
+        """获取单个提供商的服务实例，没有可用的 API Key 时返回 None"""
+        model = DEFAULT_MODELS.get(provider)
+
+        if provider == "openai":
             api_key = api_keys.get("openai") or os.getenv("OPENAI_API_KEY")
             base_url = base_urls.get("openai") or os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
             if api_key:
-                self.ai_service = OpenAIService(api_key, base_url)
-        elif preferred_model == "deepseek":
+                return client_registry.get_or_create(
+                    "openai", api_key, base_url, model,
+                    lambda: ScheduledAIService(OpenAIService(api_key, base_url, model, client_registry.http_client))
+                )
+        elif provider == "deepseek":
             api_key = api_keys.get("deepseek") or os.getenv("DEEPSEEK_API_KEY")
             base_url = base_urls.get("deepseek") or os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1")
             if api_key:
-                self.ai_service = DeepSeekService(api_key, base_url)
-        elif preferred_model == "anthropic":
+                return client_registry.get_or_create(
+                    "deepseek", api_key, base_url, model,
+                    lambda: ScheduledAIService(DeepSeekService(api_key, base_url, model, client_registry.http_client))
+                )
+        elif provider == "anthropic":
             api_key = api_keys.get("anthropic") or os.getenv("ANTHROPIC_API_KEY")
             if api_key:
-                self.ai_service = AnthropicService(api_key)
-        elif preferred_model == "kimi":
+                return client_registry.get_or_create(
+                    "anthropic", api_key, None, model,
+                    lambda: ScheduledAIService(AnthropicService(api_key, model))
+                )
+        elif provider == "kimi":
             api_key = api_keys.get("kimi") or os.getenv("KIMI_API_KEY")
             base_url = base_urls.get("kimi") or os.getenv("KIMI_BASE_URL", "https://api.moonshot.cn/v1")
             if api_key:
-                self.ai_service = KimiService(api_key, base_url)
-
-        # 如果用户设置无效或没有API密钥，返回默认服务
-        return self.ai_service
+                return client_registry.get_or_create(
+                    "kimi", api_key, base_url, model,
+                    lambda: ScheduledAIService(KimiService(api_key, base_url, model, client_registry.http_client))
+                )
+        return None
 
     def get_memory(self, user_id: int) -> ConversationBufferMemory:
         if user_id not in self.memories:
@@ -273,9 +737,24 @@ class MultiAIService:
 
         请记住：你的建议不能替代专业医疗诊断。"""
 
-    async def chat(self, message: str, context: Optional[List[Dict]] = None) -> str:
-        # 构建消息列表
-        messages = [{"role": "system", "content": self.create_medical_context()}]
+    def build_messages(
+        self,
+        message: str,
+        context: Optional[List[Dict]] = None,
+        summary: Optional[str] = None,
+        references: Optional[str] = None
+    ) -> List[Dict[str, str]]:
+        """构建发送给模型的消息列表"""
+        system_prompt = self.create_medical_context()
+        if summary:
+            # 早期对话摘要放在系统提示中（部分模型只允许一条开头的系统消息）
+            system_prompt += f"\n\n以下是此前对话的摘要，供参考：\n{summary}"
+        if references:
+            system_prompt += (
+                "\n\n以下是用户此前上传的报告中与当前问题相关的片段，回答时可以引用，"
+                f"与问题无关时请忽略：\n{references}"
+            )
+        messages = [{"role": "system", "content": system_prompt}]
 
         # 添加上下文信息
         if context:
@@ -284,11 +763,129 @@ class MultiAIService:
 
         # 添加当前消息
         messages.append({"role": "user", "content": message})
+        return messages
+
+    def coalesce_key(
+        self,
+        kind: str,
+        user_id: Optional[int],
+        service: BaseAIService,
+        messages: List[Dict[str, str]]
+    ) -> str:
+        """请求合并键：(用户, 模型, 消息列表哈希)"""
+        return f"{user_id}:{make_cache_key(service, messages, kind=kind)}"
+
+    async def retrieve_references(self, user_id: Optional[int], message: str) -> Optional[str]:
+        """从用户自己的报告中检索与问题相关的片段（未指定用户或未启用时返回 None）"""
+        if user_id is None or not RAG_ENABLED:
+            return None
+        with span("rag"):
+            chunks = await retrieve_report_chunks(self.vector_store, user_id, message)
+        return format_report_references(chunks)
+
+    async def chat(
+        self,
+        message: str,
+        context: Optional[List[Dict]] = None,
+        service: Optional[BaseAIService] = None,
+        summary: Optional[str] = None,
+        use_cache: bool = True,
+        user_id: Optional[int] = None
+    ) -> str:
+        # 调用对应的 AI 服务（未指定时使用默认服务）
+        service = service or self.ai_service
+        references = await self.retrieve_references(user_id, message)
+        messages = self.build_messages(message, context, summary, references)
+
+        # 完全相同的请求直接返回缓存的回复（重新生成等场景传入 use_cache=False）
+        cache_key = make_cache_key(service, messages) if use_cache else None
+        if cache_key:
+            cached = await response_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        async def call() -> str:
+            response = await service.chat(messages)
+            if cache_key and not is_error_response(response):
+                await response_cache.set(cache_key, response, service)
+            return response
+
+        # 重复提交的相同请求等待同一次模型调用
+        kind = "chat" if use_cache else "chat_fresh"
+        return await request_coalescer.run(kind, self.coalesce_key(kind, user_id, service, messages), call)
+
+    async def astream(
+        self,
+        message: str,
+        context: Optional[List[Dict]] = None,
+        service: Optional[BaseAIService] = None,
+        summary: Optional[str] = None,
+        use_cache: bool = True,
+        user_id: Optional[int] = None
+    ) -> AsyncIterator[str]:
+        """流式获取 AI 回复"""
+        service = service or self.ai_service
+        references = await self.retrieve_references(user_id, message)
+        messages = self.build_messages(message, context, summary, references)
+
+        # 命中缓存时一次性返回完整回复
+        cache_key = make_cache_key(service, messages) if use_cache else None
+        if cache_key:
+            cached = await response_cache.get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+
+        async def generate() -> AsyncIterator[str]:
+            tokens = []
+            async for token in service.astream(messages):
+                tokens.append(token)
+                yield token
+
+            response = "".join(tokens)
+            if cache_key and not is_error_response(response):
+                await response_cache.set(cache_key, response, service)
+
+        # 重复提交的相同请求共享同一个流，后到的请求先回放已生成的内容
+        kind = "stream" if use_cache else "stream_fresh"
+        async for token in request_coalescer.stream(kind, self.coalesce_key(kind, user_id, service, messages), generate):
+            yield token
+
+    async def summarize_conversation(
+        self,
+        previous_summary: Optional[str],
+        messages: List[Dict[str, str]],
+        service: Optional[BaseAIService] = None,
+        max_chars: int = 800
+    ) -> str:
+        """将新的对话内容合并进已有摘要，返回更新后的摘要"""
+        role_names = {"user": "用户", "assistant": "助手"}
+        dialogue = "\n".join(
+            f"{role_names.get(msg['role'], msg['role'])}：{msg['content']}" for msg in messages
+        )
+        prompt = f"""请将以下医疗咨询对话合并进已有摘要，输出更新后的完整摘要。
+        要求：保留用户的症状、病史、检查结果、用药和医生建议等关键信息，省略寒暄，不超过{max_chars}字。
 
-        # 调用对应的 AI 服务
-        return await self.ai_service.chat(messages)
+        已有摘要：
+        {previous_summary or "（无）"}
 
-    async def analyze_report(self, file_content: str) -> str:
+        新增对话：
+        {dialogue}
+        """
+        service = service or self.ai_service
+        # 摘要在后台生成，排队时让位于交互式对话
+        with priority(PRIORITY_BACKGROUND):
+            return await service.chat([
+                {"role": "system", "content": "你是一个医疗对话摘要助手，只输出摘要内容。"},
+                {"role": "user", "content": prompt}
+            ])
+
+    async def analyze_report(
+        self,
+        file_content: str,
+        service: Optional[BaseAIService] = None,
+        use_cache: bool = True
+    ) -> str:
         analysis_prompt = f"""
         请分析以下医疗报告内容，并提供专业的解读和建议：
 
@@ -304,7 +901,34 @@ class MultiAIService:
 
         注意：这只是初步分析，最终诊断需要专业医生确认。
         """
-        return await self.ai_service.analyze_report(analysis_prompt)
+        service = service or self.ai_service
+        # 超过阈值的长报告分段并发分析后汇总，小文档仍走单次调用
+        map_reduce = needs_map_reduce(file_content)
+        messages = [{"role": "user", "content": analysis_prompt}]
+
+        cache_key = None
+        if use_cache:
+            kind = "analyze_report_map_reduce" if map_reduce else "analyze_report"
+            cache_key = make_cache_key(service, messages, kind=kind)
+            cached = await response_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        async def call() -> str:
+            if map_reduce:
+                analysis = await map_reduce_analyze(service, file_content)
+            else:
+                start = time.perf_counter()
+                analysis = await service.analyze_report(analysis_prompt)
+                report_analysis_seconds.observe(time.perf_counter() - start, mode="single", stage="total")
+            if cache_key and not is_error_response(analysis):
+                await response_cache.set(cache_key, analysis, service)
+            return analysis
+
+        # 同一报告被重复上传时等待同一次分析
+        return await request_coalescer.run(
+            "analyze_report", self.coalesce_key("analyze_report", None, service, messages), call
+        )
 
     def process_document(self, file_path: str, file_type: str) -> str:
         """处理上传的文档"""
@@ -330,16 +954,23 @@ class MultiAIService:
         except Exception as e:
             return f"文档处理失败：{e!s}"
 
-    def update_vector_store(self, documents: List[str]):
-        """更新向量数据库"""
+    async def process_document_async(self, file_path: str, file_type: str) -> Dict:
+        """在文档提取进程池中处理上传的文档
+
+        返回 {"text", "chunks", "page_count"}，失败时抛出 DocumentExtractionError
+        """
+        return await document_extractor.extract(file_path, file_type)
+
+    async def index_report(self, user_id: int, report_id: int, filename: Optional[str], chunks: List[str]) -> int:
+        """将报告文本块增量加入用户的向量索引，返回入库的块数"""
+        if not self.vector_store:
+            print("Embeddings 未初始化，跳过向量数据库更新")
+            return 0
         try:
-            if documents and self.embeddings:
-                # 创建向量存储
-                self.vector_store = FAISS.from_texts(documents, self.embeddings)
-            elif documents and not self.embeddings:
-                print("Embeddings 未初始化，跳过向量数据库更新")
+            return await self.vector_store.add_report(user_id, report_id, filename, chunks)
         except Exception as e:
             print(f"向量数据库更新失败：{e!s}")
+            return 0
 
     def get_model_info(self) -> Dict[str, str]:
         """获取当前模型信息"""
@@ -0,0 +1,143 @@
+"""
+模型服务健康状态
+按服务实例（即 provider + API Key + base_url + model，实例由客户端注册表复用）记录最近的延迟和连续失败次数：
+- 延迟分位数用于决定对冲请求的触发时间
+- 熔断器在连续失败达到阈值后暂时跳过该服务，冷却期结束后放行一次试探请求，成功即恢复
+"""
+
+import math
+import os
+import threading
+import time
+import weakref
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from app.utils.metrics import registry
+
+# 对冲与熔断配置
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "true").lower() == "true"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))  # 超过该延迟分位数仍未返回时发出对冲请求
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "8"))  # 样本不足时的对冲等待时间（秒）
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "1"))  # 对冲等待时间下限（秒）
+LLM_HEDGE_MAX_DELAY = float(os.getenv("LLM_HEDGE_MAX_DELAY", "30"))  # 对冲等待时间上限（秒）
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))  # 使用观测分位数所需的最少样本数
+LLM_LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", "200"))  # 每类调用保留的最近延迟样本数
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))  # 连续失败多少次后熔断
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))  # 熔断持续时间（秒）
+
+circuit_opened = registry.counter(
+    "llm_circuit_opened_total", "Times a provider circuit breaker opened", ["provider"]
+)
+
+
+class ProviderHealth:
+    """单个模型服务的延迟统计和熔断器"""
+
+    def __init__(self, provider: str, model: str):
+        self.provider = provider
+        self.model = model
+        self._lock = threading.Lock()
+        self._latencies: Dict[str, Deque[float]] = {}
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self.successes = 0
+        self.failures = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < LLM_BREAKER_COOLDOWN:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        """是否允许发出请求；半开状态下只放行一次试探"""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def release(self):
+        """请求被取消（未得出成败）时归还试探名额"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self, kind: str, latency: float):
+        with self._lock:
+            window = self._latencies.setdefault(kind, deque(maxlen=LLM_LATENCY_WINDOW))
+            window.append(latency)
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+            self.successes += 1
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self.failures += 1
+            reopen = self.opened_at is not None and self._trial_in_flight
+            self._trial_in_flight = False
+            if reopen or (self.opened_at is None and self.consecutive_failures >= LLM_BREAKER_FAILURES):
+                self.opened_at = time.monotonic()
+                circuit_opened.inc(provider=self.provider)
+                print(f"模型服务 {self.provider}:{self.model} 连续失败 {self.consecutive_failures} 次，熔断 {LLM_BREAKER_COOLDOWN}s")
+
+    def latency_percentile(self, kind: str, pct: float = LLM_HEDGE_PERCENTILE) -> Optional[float]:
+        with self._lock:
+            window = self._latencies.get(kind)
+            if not window or len(window) < LLM_HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(window)
+        return ordered[max(math.ceil(pct / 100 * len(ordered)) - 1, 0)]
+
+    def hedge_delay(self, kind: str) -> float:
+        """发出对冲请求前的等待时间：观测到的延迟分位数，样本不足时使用默认值"""
+        observed = self.latency_percentile(kind)
+        if observed is None:
+            return LLM_HEDGE_DEFAULT_DELAY
+        return min(max(observed, LLM_HEDGE_MIN_DELAY), LLM_HEDGE_MAX_DELAY)
+
+    def stats(self) -> Dict:
+        return {
+            "provider": self.provider,
+            "model": self.model,
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "successes": self.successes,
+            "failures": self.failures,
+            "hedge_delay_seconds": {kind: round(self.hedge_delay(kind), 3) for kind in list(self._latencies)},
+        }
+
+
+class ProviderHealthRegistry:
+    """按服务实例保存健康状态，实例被注册表淘汰后一并释放"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._health: "weakref.WeakKeyDictionary[object, ProviderHealth]" = weakref.WeakKeyDictionary()
+
+    def get(self, service) -> ProviderHealth:
+        with self._lock:
+            health = self._health.get(service)
+            if health is None:
+                health = ProviderHealth(
+                    getattr(service, "provider", "unknown"), getattr(service, "model_name", "unknown")
+                )
+                self._health[service] = health
+            return health
+
+    def stats(self) -> List[Dict]:
+        with self._lock:
+            healths = list(self._health.values())
+        return [health.stats() for health in healths]
+
+
+# 全局健康状态注册表
+provider_health = ProviderHealthRegistry()
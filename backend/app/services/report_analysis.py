@@ -0,0 +1,148 @@
+"""
+大报告分段分析（map-reduce）
+出院小结等长文档整体放进一个提示会超出上下文窗口，或在一次串行调用中耗时数分钟。
+超过阈值的报告按 token 数切成若干段，各段以有限并发分别分析（map），再用一次调用汇总成最终报告（reduce）；
+小文档仍走单次调用。
+"""
+
+import asyncio
+import os
+import time
+from typing import List
+
+from app.utils.metrics import registry
+from app.utils.tokens import estimate_tokens
+
+# 分段分析配置
+REPORT_MAP_REDUCE_ENABLED = os.getenv("REPORT_MAP_REDUCE_ENABLED", "true").lower() == "true"
+REPORT_MAP_REDUCE_THRESHOLD_TOKENS = int(os.getenv("REPORT_MAP_REDUCE_THRESHOLD_TOKENS", "6000"))  # 超过该 token 数才分段
+REPORT_SECTION_TOKENS = int(os.getenv("REPORT_SECTION_TOKENS", "3000"))  # 每段的目标 token 数
+REPORT_MAP_CONCURRENCY = int(os.getenv("REPORT_MAP_CONCURRENCY", "4"))  # 单份报告同时进行的分段分析调用数
+REPORT_MAX_SECTIONS = int(os.getenv("REPORT_MAX_SECTIONS", "24"))  # 分段数上限，超过时自动加大每段长度
+
+SECTION_PROMPT = """
+        以下是一份医疗报告的第 {index}/{total} 部分，请提取这一部分中的关键信息：
+
+        报告片段：
+        {section}
+
+        请简要列出：
+        1. 报告类型、检查项目和主要指标
+        2. 异常值（注明数值和参考范围）
+        3. 诊断、用药和医嘱等重要信息
+
+        只描述本片段中出现的内容，不要推测其它部分。
+        """
+
+REDUCE_PROMPT = """
+        以下是对同一份医疗报告各部分的摘要（共 {total} 部分），请据此对整份报告进行分析，并提供专业的解读和建议：
+
+        各部分摘要：
+        {summaries}
+
+        请从以下方面进行分析：
+        1. 报告类型和主要指标
+        2. 异常值的识别
+        3. 可能的健康风险
+        4. 建议的后续检查
+        5. 生活方式建议
+
+        注意：这只是初步分析，最终诊断需要专业医生确认。
+        """
+
+report_analysis_seconds = registry.histogram(
+    "report_analysis_seconds", "Report analysis latency", ["mode", "stage"],
+    buckets=(0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+)
+report_analysis_sections = registry.histogram(
+    "report_analysis_sections", "Sections per map-reduce report analysis",
+    buckets=(2, 4, 8, 16, 32)
+)
+
+
+def needs_map_reduce(text: str, threshold: int = REPORT_MAP_REDUCE_THRESHOLD_TOKENS) -> bool:
+    return REPORT_MAP_REDUCE_ENABLED and estimate_tokens(text) > threshold
+
+
+def _split_long_line(line: str, section_tokens: int) -> List[str]:
+    """单行超过每段长度时按字符切开（按中文 1 字 1 token 保守估计）"""
+    return [line[i:i + section_tokens] for i in range(0, len(line), section_tokens)]
+
+
+def split_sections(
+    text: str,
+    section_tokens: int = REPORT_SECTION_TOKENS,
+    max_sections: int = REPORT_MAX_SECTIONS
+) -> List[str]:
+    """按行把全文贪心地合并成不超过 section_tokens 的段
+
+    直接切分全文而不是复用检索用的文本块，后者相互重叠，合并后会重复送入模型。
+    """
+    total = estimate_tokens(text)
+    # 段数超过上限时加大每段长度，限制单份报告的调用次数
+    section_tokens = max(section_tokens, -(-total // max(max_sections, 1)))
+
+    sections = []
+    current: List[str] = []
+    current_tokens = 0
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        pieces = [line] if estimate_tokens(line) <= section_tokens else _split_long_line(line, section_tokens)
+        for piece in pieces:
+            cost = estimate_tokens(piece) + 1
+            if current and current_tokens + cost > section_tokens:
+                sections.append("\n".join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += cost
+    if current:
+        sections.append("\n".join(current))
+    return sections
+
+
+async def map_reduce_analyze(
+    service,
+    text: str,
+    section_tokens: int = REPORT_SECTION_TOKENS,
+    concurrency: int = REPORT_MAP_CONCURRENCY
+) -> str:
+    """分段并发分析后汇总
+
+    个别分段失败时在汇总中注明缺失部分；全部失败时返回第一个错误信息，由调用方按失败处理。
+    """
+    # 延迟导入，避免与 multi_ai_service 循环引用
+    from app.services.multi_ai_service import is_error_response
+
+    sections = split_sections(text, section_tokens)
+    total = len(sections)
+    report_analysis_sections.observe(total)
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+    async def analyze_section(index: int, section: str) -> str:
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                return await service.analyze_report(SECTION_PROMPT.format(index=index, total=total, section=section))
+            except Exception as e:
+                return f"报告分析失败：{e!s}"
+            finally:
+                report_analysis_seconds.observe(time.perf_counter() - start, mode="map_reduce", stage="map")
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(analyze_section(i, section) for i, section in enumerate(sections, 1)))
+    failed = [i for i, result in enumerate(results, 1) if is_error_response(result)]
+    if len(failed) == total:
+        return results[0]
+    if failed:
+        print(f"报告分段分析有 {len(failed)}/{total} 段失败：{failed}")
+
+    summaries = "\n\n".join(
+        f"【第 {i} 部分】\n" + ("（该部分分析失败，内容缺失）" if i in failed else result.strip())
+        for i, result in enumerate(results, 1)
+    )
+    reduce_start = time.perf_counter()
+    analysis = await service.analyze_report(REDUCE_PROMPT.format(total=total, summaries=summaries))
+    report_analysis_seconds.observe(time.perf_counter() - reduce_start, mode="map_reduce", stage="reduce")
+    report_analysis_seconds.observe(time.perf_counter() - start, mode="map_reduce", stage="total")
+    return analysis
@@ -0,0 +1,131 @@
+"""
+报告表回填
+为 reports 表出现之前上传的报告（只存在于 chat_messages 中的 report_upload/report_analysis 消息）
+补建报告记录。可重复执行，已有记录或仍有未完成分析任务的上传消息会被跳过。
+
+用法（在 backend 目录下）：
+    python -m app.services.report_backfill
+"""
+
+import asyncio
+import hashlib
+import os
+from typing import Optional
+
+from sqlalchemy import exists, select
+from sqlalchemy.exc import IntegrityError
+
+from app.database import AsyncSessionLocal
+from app.models.chat import ChatMessage, ChatSession
+from app.models.report import Report, ReportContent, ReportJob
+from app.services.multi_ai_service import ai_service
+from app.services.report_jobs import FINISHED_STATUSES
+
+REPORT_BACKFILL_BATCH_SIZE = int(os.getenv("REPORT_BACKFILL_BATCH_SIZE", "500"))  # 每批处理的上传消息数
+REPORT_BACKFILL_ON_STARTUP = os.getenv("REPORT_BACKFILL_ON_STARTUP", "false").lower() == "true"  # 启动时自动回填
+
+# 上传接口在提取失败时写入分析消息的提示文字
+EXTRACTION_FAILED_MARKER = "文档内容提取失败"
+
+
+def _file_digest(file_path: Optional[str]) -> Optional[str]:
+    if not file_path or not os.path.exists(file_path):
+        return None
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def backfill_reports(batch_size: int = REPORT_BACKFILL_BATCH_SIZE) -> int:
+    """按上传消息ID顺序分批回填，返回新建的报告数
+
+    旧的上传文件按 "用户ID_文件名" 保存，同名文件会被后一次上传覆盖，
+    因此摘要和页数只是尽力而为，文件不存在时留空。
+    """
+    created = 0
+    last_id = 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(ChatMessage, ChatSession.user_id)
+                .join(ChatSession, ChatMessage.session_id == ChatSession.id)
+                .where(
+                    ChatMessage.message_type == "report_upload",
+                    ChatMessage.id > last_id,
+                    ~exists().where(Report.upload_message_id == ChatMessage.id),
+                    # 仍在排队或执行的上传由分析任务写入报告记录
+                    ~exists().where(
+                        ReportJob.upload_message_id == ChatMessage.id, ReportJob.status.notin_(FINISHED_STATUSES)
+                    )
+                )
+                .order_by(ChatMessage.id)
+                .limit(batch_size)
+            )
+            uploads = result.all()
+            if not uploads:
+                break
+
+            to_index = []
+            for upload, user_id in uploads:
+                # 上传接口总是紧接着写入对应的分析消息
+                result = await db.execute(
+                    select(ChatMessage).where(
+                        ChatMessage.session_id == upload.session_id,
+                        ChatMessage.message_type == "report_analysis",
+                        ChatMessage.file_path == upload.file_path,
+                        ChatMessage.id > upload.id
+                    ).order_by(ChatMessage.id).limit(1)
+                )
+                analysis = result.scalars().first()
+
+                digest = await asyncio.to_thread(_file_digest, upload.file_path)
+                content = await db.get(ReportContent, digest) if digest else None
+
+                if analysis is None:
+                    extraction_status = "unknown"
+                elif EXTRACTION_FAILED_MARKER in (analysis.content or ""):
+                    extraction_status = "failed"
+                else:
+                    extraction_status = "success"
+
+                report = Report(
+                    user_id=user_id,
+                    session_id=upload.session_id,
+                    upload_message_id=upload.id,
+                    analysis_message_id=analysis.id if analysis else None,
+                    filename=upload.filename,
+                    file_path=upload.file_path,
+                    digest=digest,
+                    page_count=content.page_count if content else None,
+                    extraction_status=extraction_status,
+                    created_at=upload.created_at
+                )
+                db.add(report)
+                if content is not None and content.chunks:
+                    to_index.append((report, content.chunks))
+
+            last_id = uploads[-1][0].id
+            try:
+                await db.commit()
+                created += len(uploads)
+            except IntegrityError:
+                # 与新上传并发时唯一键冲突，跳过本批，重新执行回填即可补上
+                await db.rollback()
+                print(f"报告回填批次冲突，已跳过（截至消息 {last_id}）")
+                continue
+
+        # 提取结果仍在缓存中的报告同时加入向量索引
+        for report, chunks in to_index:
+            await ai_service.index_report(report.user_id, report.id, report.filename, chunks)
+
+    return created
+
+
+if __name__ == "__main__":
+    from app.database import Base, engine
+
+    Base.metadata.create_all(bind=engine)
+    count = asyncio.run(backfill_reports())
+    print(f"报告回填完成，新建 {count} 条报告记录")
@@ -0,0 +1,70 @@
+"""
+报告内容寻址缓存
+以文件内容的 SHA-256 为键缓存提取的文本，以 (SHA-256, 模型) 为键缓存分析结果，
+同一份报告重复上传时直接返回，不再重新解析，也不再调用模型
+"""
+
+from typing import Dict, Optional
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from app.database import AsyncSessionLocal
+from app.models.report import ReportAnalysisCache, ReportContent
+from app.utils.metrics import registry
+
+report_cache_requests = registry.counter(
+    "report_cache_requests_total", "Report content/analysis cache lookups", ["kind", "result"]
+)
+
+
+def analysis_model_key(service) -> str:
+    """分析结果缓存使用的模型标识"""
+    return f"{getattr(service, 'provider', 'unknown')}:{getattr(service, 'model_name', 'unknown')}"
+
+
+async def get_cached_content(digest: str) -> Optional[Dict]:
+    """获取缓存的提取结果，返回与文档提取器相同结构的字典"""
+    async with AsyncSessionLocal() as db:
+        content = await db.get(ReportContent, digest)
+    report_cache_requests.inc(kind="content", result="hit" if content else "miss")
+    if content is None:
+        return None
+    return {"text": content.text, "chunks": content.chunks or [], "page_count": content.page_count}
+
+
+async def save_cached_content(digest: str, document: Dict):
+    """保存提取结果（并发上传同一文件时忽略唯一键冲突）"""
+    async with AsyncSessionLocal() as db:
+        db.add(ReportContent(
+            digest=digest,
+            text=document["text"],
+            chunks=document.get("chunks"),
+            page_count=document.get("page_count")
+        ))
+        try:
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+
+
+async def get_cached_analysis(digest: str, model: str) -> Optional[str]:
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(ReportAnalysisCache.analysis).where(
+                ReportAnalysisCache.digest == digest,
+                ReportAnalysisCache.model == model
+            )
+        )
+        analysis = result.scalar()
+    report_cache_requests.inc(kind="analysis", result="hit" if analysis else "miss")
+    return analysis
+
+
+async def save_cached_analysis(digest: str, model: str, analysis: str):
+    async with AsyncSessionLocal() as db:
+        db.add(ReportAnalysisCache(digest=digest, model=model, analysis=analysis))
+        try:
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
@@ -0,0 +1,413 @@
+"""
+报告分析任务队列
+上传接口保存文件后只写入一条 report_jobs 记录并返回 202，文档提取和模型分析由工作协程在请求之外完成，
+不会再因为大报告的分析时间过长被反向代理断开。
+
+- 队列保存在数据库中：领取任务是带条件的 UPDATE（只有一个工作者能把任务改为 running），
+  SQLite 和 PostgreSQL 都适用，也可以另起多个独立的工作进程
+- 执行中的任务持有租约（locked_until），工作者定期续期；进程崩溃或重启后租约过期，任务会被重新领取
+- 模型分析失败、文档提取超时或提取进程异常退出时按指数退避重试，超过最大次数后写入失败的回复并标记为失败；
+  无法解析的文档不重试，也不调用模型
+
+应用内默认启动 REPORT_JOB_WORKERS 个工作协程，设为 0 时可改用独立进程（在 backend 目录下）：
+    python -m app.services.report_jobs
+"""
+
+import asyncio
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import and_, or_, select, update
+
+from app.database import AsyncSessionLocal
+from app.models.chat import ChatMessage, ChatSession
+from app.models.report import Report, ReportJob
+from app.models.user import User
+from app.services.document_extractor import DocumentExtractionError
+from app.services.multi_ai_service import ai_service, is_error_response
+from app.services.report_cache import (
+    analysis_model_key,
+    get_cached_analysis,
+    get_cached_content,
+    save_cached_analysis,
+    save_cached_content,
+)
+from app.utils.metrics import registry
+
+# 任务队列配置
+REPORT_JOB_WORKERS = int(os.getenv("REPORT_JOB_WORKERS", "2"))  # 应用内工作协程数，0 表示由独立进程处理
+REPORT_JOB_MAX_ATTEMPTS = int(os.getenv("REPORT_JOB_MAX_ATTEMPTS", "3"))  # 最大执行次数（含首次）
+REPORT_JOB_RETRY_BASE = float(os.getenv("REPORT_JOB_RETRY_BASE", "5"))  # 首次重试的等待时间（秒），之后每次翻倍
+REPORT_JOB_RETRY_MAX = float(os.getenv("REPORT_JOB_RETRY_MAX", "300"))  # 重试等待时间上限（秒）
+REPORT_JOB_LEASE = float(os.getenv("REPORT_JOB_LEASE", "60"))  # 租约时长（秒），每 1/3 租约续期一次
+REPORT_JOB_POLL_INTERVAL = float(os.getenv("REPORT_JOB_POLL_INTERVAL", "2"))  # 空闲时查询新任务的间隔（秒）
+REPORT_JOB_SHUTDOWN_GRACE = float(os.getenv("REPORT_JOB_SHUTDOWN_GRACE", "10"))  # 关闭时等待执行中任务完成的时间（秒）
+
+# 上传接口和工作者对用户显示的提示
+EXTRACTION_FAILED_TEXT = "文档内容提取失败，请检查文件格式是否正确。"
+ANALYSIS_UNAVAILABLE_TEXT = "抱歉，AI分析服务暂时不可用，请稍后重试。"
+
+# 任务状态
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+FINISHED_STATUSES = (STATUS_COMPLETED, STATUS_FAILED)
+
+report_jobs_finished = registry.counter(
+    "report_jobs_total", "Report analysis jobs by outcome (completed, failed, retried)", ["outcome"]
+)
+report_job_seconds = registry.histogram(
+    "report_job_duration_seconds", "Processing time of the final attempt of a report analysis job", ["status"],
+    buckets=(0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+)
+
+
+class RetryableJobError(Exception):
+    """可以重试的任务失败（例如模型服务暂时不可用）"""
+    pass
+
+
+def retry_delay(attempts: int) -> float:
+    """第 attempts 次执行失败后的退避时间"""
+    return min(REPORT_JOB_RETRY_BASE * 2 ** max(attempts - 1, 0), REPORT_JOB_RETRY_MAX)
+
+
+def _claimable(now: datetime):
+    """可领取的任务：到期的排队任务，或租约已过期的执行中任务（原工作者已退出）"""
+    return or_(
+        and_(ReportJob.status == STATUS_QUEUED, ReportJob.next_run_at <= now),
+        and_(ReportJob.status == STATUS_RUNNING, ReportJob.locked_until < now),
+    )
+
+
+class ReportJobWorker:
+    """从 report_jobs 表领取并执行报告分析任务"""
+
+    def __init__(self, concurrency: int = REPORT_JOB_WORKERS):
+        self.concurrency = concurrency
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+        self._running_jobs: Dict[int, float] = {}
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.recovered = 0
+
+    def start(self, concurrency: Optional[int] = None):
+        """在当前事件循环中启动工作协程"""
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        count = self.concurrency if concurrency is None else concurrency
+        self._tasks = [asyncio.create_task(self._loop()) for _ in range(count)]
+
+    async def stop(self, grace: float = REPORT_JOB_SHUTDOWN_GRACE):
+        """停止工作协程：不再领取新任务，等待执行中的任务完成，超时后取消并放回队列（不计入执行次数）
+
+        直接取消可能打断进行中的数据库操作并遗留未关闭的连接，因此只在宽限时间之后才取消。
+        """
+        if not self._tasks:
+            return
+        self._stopping = True
+        self.notify()
+        _, pending = await asyncio.wait(self._tasks, timeout=grace)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._stopping = False
+
+    def notify(self):
+        """有新任务入队时唤醒空闲的工作协程"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _loop(self):
+        while not self._stopping:
+            try:
+                job = await self._claim()
+            except Exception as e:
+                print(f"领取报告任务失败：{e!s}")
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=REPORT_JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._run(job)
+            except Exception as e:
+                print(f"报告任务 {job.id} 状态更新失败：{e!s}")
+
+    async def join(self):
+        """等待工作协程结束（独立工作进程使用）"""
+        await asyncio.gather(*self._tasks)
+
+    async def _claim(self) -> Optional[ReportJob]:
+        now = datetime.now()
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(ReportJob.id, ReportJob.status).where(_claimable(now))
+                .order_by(ReportJob.next_run_at, ReportJob.id).limit(self.concurrency + 1)
+            )
+            for job_id, status in result.all():
+                # 条件更新保证同一任务只会被一个工作者领取；每次领取使用不同的租约标识，
+                # 租约过期被重新领取后，原执行者的后续更新都会失效
+                claimed = await db.execute(
+                    update(ReportJob).where(ReportJob.id == job_id, _claimable(now)).values(
+                        status=STATUS_RUNNING,
+                        worker_id=f"{self.worker_id}:{uuid.uuid4().hex[:8]}",
+                        locked_until=now + timedelta(seconds=REPORT_JOB_LEASE),
+                        attempts=ReportJob.attempts + 1,
+                    )
+                )
+                await db.commit()
+                if claimed.rowcount == 1:
+                    if status == STATUS_RUNNING:
+                        self.recovered += 1
+                        print(f"报告任务 {job_id} 的租约已过期，重新执行")
+                    return await db.get(ReportJob, job_id)
+        return None
+
+    async def _update(self, job: ReportJob, **values) -> bool:
+        """更新自己持有的任务，任务已被其它工作者接管时返回 False"""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(ReportJob).where(ReportJob.id == job.id, ReportJob.worker_id == job.worker_id).values(**values)
+            )
+            await db.commit()
+            return result.rowcount == 1
+
+    async def _heartbeat(self, job: ReportJob):
+        while True:
+            await asyncio.sleep(REPORT_JOB_LEASE / 3)
+            try:
+                await self._update(job, locked_until=datetime.now() + timedelta(seconds=REPORT_JOB_LEASE))
+            except Exception as e:
+                print(f"报告任务 {job.id} 续期失败：{e!s}")
+
+    async def _run(self, job: ReportJob):
+        self._running_jobs[job.id] = time.monotonic()
+        heartbeat = asyncio.create_task(self._heartbeat(job))
+        try:
+            await self._process(job)
+        except asyncio.CancelledError:
+            # 应用关闭且超过宽限时间：放回队列，下次启动后立即重新执行
+            await asyncio.shield(self._update(
+                job, status=STATUS_QUEUED, stage=STATUS_QUEUED, progress=0, worker_id=None, locked_until=None,
+                attempts=ReportJob.attempts - 1, next_run_at=datetime.now()
+            ))
+            raise
+        except Exception as e:
+            await self._handle_failure(job, e)
+        finally:
+            heartbeat.cancel()
+            self._running_jobs.pop(job.id, None)
+
+    async def _handle_failure(self, job: ReportJob, error: Exception):
+        print(f"报告任务 {job.id} 第 {job.attempts} 次执行失败：{error!s}")
+        if job.attempts < job.max_attempts:
+            delay = retry_delay(job.attempts)
+            self.retried += 1
+            report_jobs_finished.inc(outcome="retried")
+            await self._update(
+                job, status=STATUS_QUEUED, stage=STATUS_QUEUED, worker_id=None, locked_until=None,
+                error=str(error), next_run_at=datetime.now() + timedelta(seconds=delay)
+            )
+            return
+        self._finished(job, STATUS_FAILED)
+        await self._update(
+            job, status=STATUS_FAILED, worker_id=None, locked_until=None, error=str(error),
+            finished_at=datetime.now()
+        )
+
+    def _finished(self, job: ReportJob, status: str):
+        if status == STATUS_COMPLETED:
+            self.completed += 1
+        else:
+            self.failed += 1
+        report_jobs_finished.inc(outcome=status)
+        start = self._running_jobs.get(job.id)
+        if start is not None:
+            report_job_seconds.observe(time.monotonic() - start, status=status)
+
+    async def _process(self, job: ReportJob):
+        """提取文档、分析并写入分析消息和报告记录
+
+        写入结果之前的步骤都没有副作用（只读写内容和分析缓存），因此可以安全地重试；
+        结果与任务完成状态在同一个事务中提交。
+        """
+        async with AsyncSessionLocal() as db:
+            settings = (await db.execute(select(User.settings).where(User.id == job.user_id))).scalar()
+        user_ai_service = ai_service.create_user_ai_service(settings)
+
+        # 1. 提取文档内容（相同内容的报告直接使用缓存的提取结果）
+        await self._update(job, stage="extracting", progress=10)
+        extracted = False
+        page_count = None
+        chunks = []
+        status = STATUS_COMPLETED
+        error = None
+        analysis = None
+        try:
+            document = await get_cached_content(job.digest) if job.digest else None
+            if document is None:
+                document = await ai_service.process_document_async(job.file_path, job.file_type)
+                if document["text"] and job.digest:
+                    await save_cached_content(job.digest, document)
+            document_content = document["text"]
+            page_count = document.get("page_count")
+            chunks = document.get("chunks") or []
+            if not document_content:
+                raise DocumentExtractionError("文档中没有可提取的文本")
+            extracted = True
+        except DocumentExtractionError as e:
+            # 超时或工作进程异常退出与文档本身无关，可以重试；最后一次仍失败时与无法解析的文档一样处理
+            if e.retryable and job.attempts < job.max_attempts:
+                raise RetryableJobError(f"文档处理失败：{e!s}") from e
+            # 文件本身无法解析，重试也不会成功，不再调用模型，直接写入提取失败的回复
+            print(f"文档处理错误: {e}")
+            document_content = EXTRACTION_FAILED_TEXT
+            analysis = f"未能分析该报告：{e!s}"
+            status = STATUS_FAILED
+            error = str(e)
+
+        # 2. 分析报告（同一内容、同一模型的分析结果直接复用）
+        model_key = analysis_model_key(user_ai_service)
+        if extracted:
+            await self._update(job, stage="analyzing", progress=40)
+            if job.digest:
+                analysis = await get_cached_analysis(job.digest, model_key)
+        if analysis is None:
+            try:
+                analysis = await ai_service.analyze_report(document_content, service=user_ai_service)
+                if is_error_response(analysis):
+                    raise RetryableJobError(f"AI分析失败：{analysis[:200]}")
+            except Exception as e:
+                if job.attempts < job.max_attempts:
+                    raise
+                print(f"AI分析错误: {e}")
+                analysis = ANALYSIS_UNAVAILABLE_TEXT
+                status = STATUS_FAILED
+                error = str(e)
+            else:
+                if extracted and job.digest:
+                    await save_cached_analysis(job.digest, model_key, analysis)
+
+        # 3. 写入分析消息、报告记录，并在同一事务中完成任务
+        await self._update(job, stage="saving", progress=90)
+        async with AsyncSessionLocal() as db:
+            session_exists = await db.scalar(select(ChatSession.id).where(ChatSession.id == job.session_id))
+            if session_exists is None:
+                # 会话已被删除（任务记录通常也随之删除），不再写入分析结果
+                print(f"报告任务 {job.id} 所属的会话已删除，放弃本次结果")
+                return
+
+            content_summary = document_content[:300] + "..." if len(document_content) > 300 else document_content
+            ai_message = ChatMessage(
+                session_id=job.session_id,
+                role="assistant",
+                content=f"📋 **报告分析完成**\n\n📄 **报告内容摘要：**\n{content_summary}\n\n🤖 **AI 分析结果：**\n{analysis}",
+                message_type="report_analysis",
+                filename=job.filename,
+                file_path=job.file_path
+            )
+            db.add(ai_message)
+            await db.flush()
+
+            # 报告回填可能已为这条上传消息建好记录（upload_message_id 唯一），此时更新原记录
+            report = None
+            if job.upload_message_id is not None:
+                report = await db.scalar(select(Report).where(Report.upload_message_id == job.upload_message_id))
+            if report is None:
+                report = Report(
+                    user_id=job.user_id,
+                    session_id=job.session_id,
+                    upload_message_id=job.upload_message_id
+                )
+                db.add(report)
+            report.analysis_message_id = ai_message.id
+            report.filename = job.filename
+            report.file_path = job.file_path
+            report.digest = job.digest
+            report.page_count = page_count
+            report.extraction_status = "success" if extracted else "failed"
+            report.model_used = model_key if extracted else None
+            await db.flush()
+
+            await db.execute(
+                update(ChatSession).where(ChatSession.id == job.session_id).values(updated_at=datetime.now())
+            )
+            result = await db.execute(
+                update(ReportJob).where(ReportJob.id == job.id, ReportJob.worker_id == job.worker_id).values(
+                    status=status, stage="done", progress=100, error=error, worker_id=None, locked_until=None,
+                    analysis_message_id=ai_message.id, report_id=report.id, finished_at=datetime.now()
+                )
+            )
+            if result.rowcount != 1:
+                # 租约已过期且被其它工作者接管，或会话连同任务已被删除，放弃本次结果
+                await db.rollback()
+                print(f"报告任务 {job.id} 已被其它工作者接管或已删除，放弃本次结果")
+                return
+            await db.commit()
+            report_id = report.id
+        self._finished(job, status)
+
+        # 4. 把文本块加入用户的向量索引，供后续对话检索
+        if extracted and chunks:
+            await ai_service.index_report(job.user_id, report_id, job.filename, chunks)
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        return {
+            "worker_id": self.worker_id,
+            "concurrency": len(self._tasks),
+            "running": {job_id: round(now - start, 1) for job_id, start in self._running_jobs.items()},
+            "completed": self.completed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "recovered": self.recovered,
+        }
+
+
+async def enqueue_report_job(db, **values) -> ReportJob:
+    """在调用方的事务中写入任务（由调用方提交），提交后调用 report_job_worker.notify() 唤醒工作协程"""
+    job = ReportJob(
+        status=STATUS_QUEUED,
+        stage=STATUS_QUEUED,
+        progress=0,
+        attempts=0,
+        max_attempts=REPORT_JOB_MAX_ATTEMPTS,
+        next_run_at=datetime.now(),
+        **values
+    )
+    db.add(job)
+    await db.flush()
+    return job
+
+
+# 应用内的全局工作者
+report_job_worker = ReportJobWorker()
+
+
+async def run_worker(concurrency: int):
+    worker = ReportJobWorker(concurrency)
+    worker.start()
+    print(f"报告任务工作进程 {worker.worker_id} 已启动，并发 {concurrency}")
+    try:
+        await worker.join()
+    finally:
+        await worker.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(run_worker(max(REPORT_JOB_WORKERS, 1)))
@@ -0,0 +1,73 @@
+"""
+报告检索（RAG）
+对话时从用户自己的报告向量索引中检索与当前问题最相关的文本块，按 token 预算注入系统提示，
+避免重新上传或把整份报告再次发给模型。检索有延迟上限，超时或出错时直接跳过，不影响对话。
+"""
+
+import asyncio
+import os
+import time
+from typing import Dict, List, Optional
+
+from app.utils.metrics import registry
+from app.utils.tokens import estimate_tokens
+
+# 检索配置
+RAG_ENABLED = os.getenv("RAG_ENABLED", "true").lower() == "true"
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "4"))  # 最多检索的文本块数
+RAG_MIN_SCORE = float(os.getenv("RAG_MIN_SCORE", "0.2"))  # 余弦相似度阈值，取值与嵌入后端有关
+RAG_TOKEN_BUDGET = int(os.getenv("RAG_TOKEN_BUDGET", "800"))  # 注入的报告片段最多占用的 token 数
+RAG_TIMEOUT = float(os.getenv("RAG_TIMEOUT", "0.5"))  # 单次检索的延迟上限（秒）
+
+rag_retrieval_seconds = registry.histogram(
+    "rag_retrieval_seconds", "Report retrieval latency", ["status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+)
+rag_chunks_injected = registry.counter("rag_chunks_injected_total", "Report chunks injected into chat prompts")
+
+
+async def retrieve_report_chunks(
+    vector_store,
+    user_id: int,
+    query: str,
+    top_k: int = RAG_TOP_K,
+    min_score: float = RAG_MIN_SCORE,
+    token_budget: int = RAG_TOKEN_BUDGET,
+    timeout: float = RAG_TIMEOUT
+) -> List[Dict]:
+    """检索相关文本块，按相关度从高到低取用，直到用完 token 预算"""
+    if vector_store is None or not query or not query.strip():
+        return []
+
+    start = time.perf_counter()
+    try:
+        results = await asyncio.wait_for(vector_store.search(user_id, query, k=top_k, min_score=min_score), timeout)
+    except asyncio.TimeoutError:
+        rag_retrieval_seconds.observe(time.perf_counter() - start, status="timeout")
+        print(f"报告检索超过 {timeout}s，已跳过")
+        return []
+    except Exception as e:
+        rag_retrieval_seconds.observe(time.perf_counter() - start, status="error")
+        print(f"报告检索失败: {e}")
+        return []
+
+    selected = []
+    remaining = token_budget
+    for chunk in results:
+        cost = estimate_tokens(chunk["text"])
+        if cost > remaining:
+            continue
+        selected.append(chunk)
+        remaining -= cost
+
+    rag_retrieval_seconds.observe(time.perf_counter() - start, status="hit" if selected else "empty")
+    rag_chunks_injected.inc(len(selected))
+    return selected
+
+
+def format_report_references(chunks: List[Dict]) -> Optional[str]:
+    """将检索到的文本块格式化为系统提示的一部分"""
+    if not chunks:
+        return None
+    parts = [f"[{i}] 来自报告《{chunk.get('filename') or '未命名'}》：\n{chunk['text']}" for i, chunk in enumerate(chunks, 1)]
+    return "\n\n".join(parts)
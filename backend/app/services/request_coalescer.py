@@ -0,0 +1,143 @@
+"""
+模型请求合并（single-flight）
+客户端重复提交、或代理超时后重试时，相同的请求会在第一次调用仍在进行时再次发往模型。
+按 (用户, 模型, 消息列表哈希) 合并正在进行中的相同请求：只有第一个请求真正调用模型，
+其余请求等待同一次调用的结果；流式请求会先回放已生成的片段，再跟随后续输出。
+所有等待者都放弃（如客户端断开）时取消底层调用。
+"""
+
+import asyncio
+import os
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from app.utils.metrics import registry
+
+LLM_COALESCE_ENABLED = os.getenv("LLM_COALESCE_ENABLED", "true").lower() == "true"
+
+coalesced_requests = registry.counter(
+    "llm_coalesced_requests_total", "LLM requests served by an identical in-flight call", ["kind"]
+)
+coalesce_leader_requests = registry.counter(
+    "llm_coalesce_leader_requests_total", "LLM requests that made the underlying provider call", ["kind"]
+)
+
+
+class _Flight:
+    """一次进行中的调用及其等待者"""
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.waiters = 0
+        # 流式调用已生成的片段，后加入的等待者从头回放
+        self.tokens: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.changed = asyncio.Condition()
+
+
+class RequestCoalescer:
+    """合并进行中的相同请求"""
+
+    def __init__(self, enabled: bool = LLM_COALESCE_ENABLED):
+        self.enabled = enabled
+        self._flights: Dict[str, _Flight] = {}
+        self.leaders: Dict[str, int] = {}
+        self.coalesced: Dict[str, int] = {}
+
+    def _join(self, kind: str, key: str):
+        """返回 (flight, 是否为发起者)"""
+        flight = self._flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = self._flights[key] = _Flight()
+            self.leaders[kind] = self.leaders.get(kind, 0) + 1
+            coalesce_leader_requests.inc(kind=kind)
+        else:
+            self.coalesced[kind] = self.coalesced.get(kind, 0) + 1
+            coalesced_requests.inc(kind=kind)
+        flight.waiters += 1
+        return flight, leader
+
+    def _start(self, key: str, flight: _Flight, coro: Awaitable):
+        flight.task = asyncio.ensure_future(coro)
+        flight.task.add_done_callback(lambda _: self._finish(key, flight))
+
+    def _finish(self, key: str, flight: _Flight):
+        # 调用结束即移出，之后的相同请求由回复缓存处理
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def _leave(self, key: str, flight: _Flight):
+        flight.waiters -= 1
+        if flight.waiters == 0 and flight.task and not flight.task.done():
+            flight.task.cancel()
+            # 立即移出，之后到达的相同请求重新发起调用，而不是加入一个已取消的调用
+            self._finish(key, flight)
+
+    async def run(self, kind: str, key: str, factory: Callable[[], Awaitable]):
+        """合并非流式调用，factory 只在没有相同请求进行中时调用"""
+        if not self.enabled:
+            return await factory()
+        flight, leader = self._join(kind, key)
+        if leader:
+            self._start(key, flight, factory())
+        try:
+            # shield：单个等待者被取消时不影响其它等待者，最后一个离开时再取消底层调用
+            return await asyncio.shield(flight.task)
+        finally:
+            self._leave(key, flight)
+
+    async def stream(self, kind: str, key: str, factory: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """合并流式调用，每个等待者都能收到完整的片段序列"""
+        if not self.enabled:
+            async for token in factory():
+                yield token
+            return
+        flight, leader = self._join(kind, key)
+        if leader:
+            self._start(key, flight, self._pump(flight, factory))
+        try:
+            index = 0
+            while True:
+                async with flight.changed:
+                    await flight.changed.wait_for(lambda: flight.done or len(flight.tokens) > index)
+                    tokens = flight.tokens[index:]
+                    finished = flight.done
+                index += len(tokens)
+                for token in tokens:
+                    yield token
+                if finished and index >= len(flight.tokens):
+                    break
+            # 底层调用出错时向所有等待者抛出同一个异常
+            if flight.error is not None:
+                raise flight.error
+        finally:
+            self._leave(key, flight)
+
+    async def _pump(self, flight: _Flight, factory: Callable[[], AsyncIterator[str]]):
+        try:
+            async for token in factory():
+                async with flight.changed:
+                    flight.tokens.append(token)
+                    flight.changed.notify_all()
+        except Exception as e:
+            flight.error = e
+        finally:
+            async with flight.changed:
+                flight.done = True
+                flight.changed.notify_all()
+
+    def stats(self) -> Dict:
+        leaders = sum(self.leaders.values())
+        coalesced = sum(self.coalesced.values())
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._flights),
+            "leaders": dict(self.leaders),
+            "coalesced": dict(self.coalesced),
+            "coalesced_rate": round(coalesced / (leaders + coalesced), 4) if leaders + coalesced else 0.0,
+        }
+
+
+# 全局请求合并器
+request_coalescer = RequestCoalescer()
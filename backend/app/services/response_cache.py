@@ -0,0 +1,217 @@
+"""
+模型回复缓存
+以 (provider, model, temperature, 完整消息列表) 的规范化哈希为键精确匹配，
+内存 LRU 为第一层，可选的数据库表为第二层（多进程/重启后共享）
+"""
+
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.exc import IntegrityError
+
+from app.database import AsyncSessionLocal
+from app.models.cache import LLMResponseCache
+from app.utils.metrics import registry
+
+# 缓存配置
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000"))  # 内存层最多缓存条数
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "3600"))  # 缓存有效期（秒）
+LLM_CACHE_PERSIST = os.getenv("LLM_CACHE_PERSIST", "false").lower() == "true"  # 是否启用数据库层
+LLM_CACHE_PERSIST_MAX_ENTRIES = int(os.getenv("LLM_CACHE_PERSIST_MAX_ENTRIES", "10000"))  # 数据库层最多保留条数
+LLM_CACHE_PURGE_INTERVAL = int(os.getenv("LLM_CACHE_PURGE_INTERVAL", "300"))  # 数据库层清理间隔（秒）
+
+llm_cache_requests = registry.counter(
+    "llm_response_cache_requests_total", "LLM response cache lookups", ["tier", "result"]
+)
+
+
+def normalize_messages(messages: List[Dict[str, str]]) -> List[List[str]]:
+    """去掉首尾空白，避免无意义差异导致缓存未命中"""
+    return [[msg["role"], (msg.get("content") or "").strip()] for msg in messages]
+
+
+def make_cache_key(service, messages: List[Dict[str, str]], kind: str = "chat") -> str:
+    """计算缓存键：请求类型 + 模型参数 + 规范化后的消息列表"""
+    payload = json.dumps(
+        [
+            kind,
+            getattr(service, "provider", "unknown"),
+            getattr(service, "model_name", "unknown"),
+            getattr(service, "temperature", None),
+            normalize_messages(messages),
+        ],
+        ensure_ascii=False,
+        separators=(",", ":")
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """两级模型回复缓存"""
+
+    def __init__(
+        self,
+        enabled: bool = LLM_CACHE_ENABLED,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+        ttl: int = LLM_CACHE_TTL,
+        persist: bool = LLM_CACHE_PERSIST,
+        persist_max_entries: int = LLM_CACHE_PERSIST_MAX_ENTRIES,
+        purge_interval: int = LLM_CACHE_PURGE_INTERVAL
+    ):
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.persist = persist
+        self.persist_max_entries = persist_max_entries
+        self.purge_interval = purge_interval
+        self._last_purge: Optional[float] = None
+        self._purging = False
+        self.purged = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _get_memory(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _set_memory(self, key: str, value: str):
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _get_persistent(self, key: str) -> Optional[str]:
+        async with AsyncSessionLocal() as db:
+            row = await db.get(LLMResponseCache, key)
+        if row is None:
+            return None
+        created_at = row.created_at
+        if created_at is not None:
+            if created_at.tzinfo is None:
+                # SQLite 的 CURRENT_TIMESTAMP 为不带时区的 UTC 时间
+                created_at = created_at.replace(tzinfo=timezone.utc)
+            if (datetime.now(timezone.utc) - created_at).total_seconds() > self.ttl:
+                return None
+        return row.response
+
+    async def _set_persistent(self, key: str, value: str, service):
+        async with AsyncSessionLocal() as db:
+            await db.merge(LLMResponseCache(
+                key=key,
+                provider=getattr(service, "provider", None),
+                model=getattr(service, "model_name", None),
+                response=value,
+                created_at=datetime.now(timezone.utc)
+            ))
+            try:
+                await db.commit()
+            except IntegrityError:
+                await db.rollback()
+
+    async def purge_persistent(self) -> int:
+        """删除数据库层中过期的条目，并按写入时间淘汰超出上限的最旧条目，返回删除的条数"""
+        cutoff = datetime.fromtimestamp(time.time() - self.ttl, timezone.utc)
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(delete(LLMResponseCache).where(LLMResponseCache.created_at < cutoff))
+            removed = result.rowcount or 0
+
+            count = (await db.execute(select(func.count()).select_from(LLMResponseCache))).scalar() or 0
+            excess = count - self.persist_max_entries
+            if excess > 0:
+                oldest = (
+                    select(LLMResponseCache.key)
+                    .order_by(LLMResponseCache.created_at)
+                    .limit(excess)
+                    .scalar_subquery()
+                )
+                result = await db.execute(delete(LLMResponseCache).where(LLMResponseCache.key.in_(oldest)))
+                removed += result.rowcount or 0
+            await db.commit()
+        self.purged += removed
+        return removed
+
+    async def _maybe_purge(self):
+        """写入时按间隔清理数据库层，同一时刻只有一个清理在执行"""
+        now = time.monotonic()
+        if self._purging or (self._last_purge is not None and now - self._last_purge < self.purge_interval):
+            return
+        self._purging = True
+        self._last_purge = now
+        try:
+            await self.purge_persistent()
+        except Exception as e:
+            print(f"清理持久化回复缓存失败: {e}")
+        finally:
+            self._purging = False
+
+    async def get(self, key: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+
+        value = self._get_memory(key)
+        if value is not None:
+            self.hits += 1
+            llm_cache_requests.inc(tier="memory", result="hit")
+            return value
+
+        if self.persist:
+            try:
+                value = await self._get_persistent(key)
+            except Exception as e:
+                print(f"读取持久化回复缓存失败: {e}")
+                value = None
+            if value is not None:
+                self.hits += 1
+                llm_cache_requests.inc(tier="persistent", result="hit")
+                self._set_memory(key, value)
+                return value
+
+        self.misses += 1
+        llm_cache_requests.inc(tier="all", result="miss")
+        return None
+
+    async def set(self, key: str, value: str, service=None):
+        if not self.enabled:
+            return
+        self._set_memory(key, value)
+        if self.persist:
+            try:
+                await self._set_persistent(key, value, service)
+            except Exception as e:
+                print(f"写入持久化回复缓存失败: {e}")
+            await self._maybe_purge()
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "persist": self.persist,
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "persistent_purged": self.purged,
+        }
+
+
+# 全局回复缓存
+response_cache = ResponseCache()
@@ -0,0 +1,255 @@
+"""
+按用户持久化的报告向量索引
+每个用户一个目录，向量以 float32 追加写入 vectors.f32 并按需内存映射，文本块元数据追加写入 meta.jsonl，
+index.json 记录已提交的条数（最后写入，作为提交点）。检索为归一化向量的暴力内积（flat index），
+单个用户的报告规模下比近似索引更简单且结果精确。索引首次使用时才加载，内存中按 LRU 保留最近使用的用户。
+"""
+
+import asyncio
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from app.services.embeddings import normalize_rows
+from app.utils.metrics import registry
+
+try:
+    import fcntl
+except ImportError:  # Windows 上没有 fcntl，只在进程内加锁
+    fcntl = None
+
+# 向量索引配置
+VECTOR_STORE_DIR = os.getenv("VECTOR_STORE_DIR", "vector_store")
+VECTOR_STORE_MAX_LOADED = int(os.getenv("VECTOR_STORE_MAX_LOADED", "64"))  # 内存中最多保留的用户索引数
+
+vector_store_loads = registry.counter("vector_store_loads_total", "User vector indexes loaded from disk")
+vector_store_chunks = registry.counter("vector_store_chunks_added_total", "Report chunks added to vector indexes")
+
+
+class UserVectorIndex:
+    """单个用户的向量索引"""
+
+    def __init__(self, path: str, embedder_name: str):
+        self.path = path
+        self.embedder_name = embedder_name
+        self.vectors_file = os.path.join(path, "vectors.f32")
+        self.meta_file = os.path.join(path, "meta.jsonl")
+        self.info_file = os.path.join(path, "index.json")
+        self.lock_file = os.path.join(path, ".lock")
+        self._lock = threading.Lock()
+        self._clear()
+        self._load()
+
+    def _clear(self):
+        self.dim: Optional[int] = None
+        self.count = 0
+        self.meta_size = 0
+        self.deleted = set()
+        self.metadata: List[Dict] = []
+        self.report_ids = np.zeros(0, dtype=np.int64)
+        self.vectors: Optional[np.ndarray] = None
+        self._info_stat = None
+
+    def _stat_info(self):
+        try:
+            stat = os.stat(self.info_file)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _load(self):
+        self._info_stat = self._stat_info()
+        if self._info_stat is None:
+            return
+        with open(self.info_file, encoding="utf-8") as f:
+            info = json.load(f)
+        if info.get("embedder") != self.embedder_name:
+            # 嵌入模型变化后旧向量不可比较，需要重新入库
+            print(f"向量索引 {self.path} 的嵌入模型 {info.get('embedder')} 与当前配置不一致，已忽略")
+            info_stat = self._info_stat
+            self._clear()
+            self._info_stat = info_stat
+            return
+
+        self.dim = info["dim"]
+        self.count = info["count"]
+        self.meta_size = info["meta_size"]
+        self.deleted = set(info.get("deleted", []))
+        if self.count:
+            self.vectors = np.memmap(self.vectors_file, dtype=np.float32, mode="r", shape=(self.count, self.dim))
+            with open(self.meta_file, "rb") as f:
+                data = f.read(self.meta_size)
+            self.metadata = [json.loads(line) for line in data.splitlines()]
+        self.report_ids = np.array([m.get("report_id") or 0 for m in self.metadata], dtype=np.int64)
+        vector_store_loads.inc()
+
+    def _refresh_if_stale(self):
+        """其它进程提交了新数据时重新加载"""
+        if self._stat_info() != self._info_stat:
+            self._clear()
+            self._load()
+
+    def refresh(self):
+        """同步其它进程已提交的数据（开销为一次 stat）"""
+        with self._lock:
+            self._refresh_if_stale()
+
+    def _write_info(self):
+        info = {
+            "embedder": self.embedder_name,
+            "dim": self.dim,
+            "count": self.count,
+            "meta_size": self.meta_size,
+            "deleted": sorted(self.deleted),
+        }
+        tmp_file = f"{self.info_file}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(info, f)
+        os.replace(tmp_file, self.info_file)
+        self._info_stat = self._stat_info()
+
+    @contextmanager
+    def _write_lock(self):
+        """进程内线程锁 + 跨进程文件锁，拿到锁后先同步其它进程已提交的数据"""
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            with open(self.lock_file, "a") as lock_fd:
+                if fcntl is not None:
+                    fcntl.flock(lock_fd, fcntl.LOCK_EX)
+                self._refresh_if_stale()
+                yield
+
+    def add(self, vectors: np.ndarray, metadatas: List[Dict]):
+        vectors = normalize_rows(vectors)
+        if len(vectors) != len(metadatas):
+            raise ValueError("向量数量与元数据数量不一致")
+        if not len(vectors):
+            return
+
+        with self._write_lock():
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"向量维度 {vectors.shape[1]} 与索引维度 {self.dim} 不一致")
+
+            # 先截掉上次写入失败时残留的未提交数据，再追加
+            with open(self.vectors_file, "ab") as f:
+                f.truncate(self.count * self.dim * 4)
+                f.write(vectors.tobytes())
+            lines = b"".join(json.dumps(m, ensure_ascii=False).encode("utf-8") + b"\n" for m in metadatas)
+            with open(self.meta_file, "ab") as f:
+                f.truncate(self.meta_size)
+                f.write(lines)
+
+            self.count += len(vectors)
+            self.meta_size += len(lines)
+            self._write_info()
+
+            self.metadata.extend(metadatas)
+            self.report_ids = np.concatenate([
+                self.report_ids, np.array([m.get("report_id") or 0 for m in metadatas], dtype=np.int64)
+            ])
+            self.vectors = np.memmap(self.vectors_file, dtype=np.float32, mode="r", shape=(self.count, self.dim))
+        vector_store_chunks.inc(len(vectors))
+
+    def delete_reports(self, report_ids: Iterable[int]):
+        """标记删除（检索时跳过），向量文件保持只追加"""
+        with self._write_lock():
+            self.deleted.update(int(report_id) for report_id in report_ids)
+            if self.dim is not None:
+                self._write_info()
+
+    def search(self, query: np.ndarray, k: int, min_score: Optional[float] = None) -> List[Dict]:
+        with self._lock:
+            self._refresh_if_stale()
+            vectors, metadata, report_ids, deleted = self.vectors, self.metadata, self.report_ids, self.deleted
+        if vectors is None or not len(vectors) or k <= 0:
+            return []
+
+        query = normalize_rows(query)[0]
+        if query.shape[0] != vectors.shape[1]:
+            return []
+        scores = np.asarray(vectors @ query, dtype=np.float32)
+        if deleted:
+            scores[np.isin(report_ids, list(deleted))] = -np.inf
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        results = []
+        for i in top:
+            score = float(scores[i])
+            if score == -np.inf or (min_score is not None and score < min_score):
+                continue
+            results.append({**metadata[i], "score": score})
+        return results
+
+
+class VectorStoreManager:
+    """管理所有用户的向量索引：懒加载 + LRU 淘汰"""
+
+    def __init__(self, embedder, base_dir: str = VECTOR_STORE_DIR, max_loaded: int = VECTOR_STORE_MAX_LOADED):
+        self.embedder = embedder
+        self.base_dir = base_dir
+        self.max_loaded = max_loaded
+        self._indexes: "OrderedDict[int, UserVectorIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_index(self, user_id: int) -> UserVectorIndex:
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is None:
+                index = UserVectorIndex(os.path.join(self.base_dir, str(user_id)), self.embedder.name)
+                self._indexes[user_id] = index
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.max_loaded:
+                # 淘汰后内存映射随对象释放；正在使用的请求仍持有引用，不受影响
+                self._indexes.popitem(last=False)
+            return index
+
+    def _add_report(self, user_id: int, report_id: int, filename: Optional[str], chunks: List[str]) -> int:
+        texts = [chunk for chunk in chunks if chunk and chunk.strip()]
+        if not texts:
+            return 0
+        vectors = self.embedder.embed_documents(texts)
+        metadatas = [
+            {"report_id": report_id, "chunk_index": i, "filename": filename, "text": text}
+            for i, text in enumerate(texts)
+        ]
+        self.get_index(user_id).add(vectors, metadatas)
+        return len(texts)
+
+    async def add_report(self, user_id: int, report_id: int, filename: Optional[str], chunks: List[str]) -> int:
+        """将报告的文本块加入用户索引（嵌入和文件写入在线程池中执行），返回入库的块数"""
+        return await asyncio.to_thread(self._add_report, user_id, report_id, filename, chunks)
+
+    async def delete_reports(self, user_id: int, report_ids: List[int]):
+        if report_ids:
+            await asyncio.to_thread(self.get_index(user_id).delete_reports, report_ids)
+
+    def _search(self, user_id: int, query: str, k: int, min_score: Optional[float]) -> List[Dict]:
+        index = self.get_index(user_id)
+        # 先同步其它进程（独立的报告任务进程、其它 uvicorn worker）写入的数据，再判断是否为空
+        index.refresh()
+        if not index.count:
+            return []
+        return index.search(self.embedder.embed_query(query), k, min_score)
+
+    async def search(self, user_id: int, query: str, k: int = 4, min_score: Optional[float] = None) -> List[Dict]:
+        """检索用户报告中与 query 最相关的 k 个文本块，返回带 score 的元数据"""
+        return await asyncio.to_thread(self._search, user_id, query, k, min_score)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            loaded = len(self._indexes)
+        return {
+            "embedder": self.embedder.name,
+            "base_dir": self.base_dir,
+            "loaded_users": loaded,
+            "max_loaded": self.max_loaded,
+        }
@@ -0,0 +1,112 @@
+"""
+数据库连接池指标
+通过 SQLAlchemy 连接池事件记录已借出连接数、溢出连接数和新建连接数，
+并统计从连接池获取连接的等待时间（连接池耗尽时的排队时间，以及新建连接的耗时）。
+同时为采样到的请求记录追踪片段：每条 SQL 的执行（db）、事务提交（db_commit）和获取连接的等待（db_pool）。
+"""
+
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.orm import Session
+
+from app.utils.metrics import registry
+from app.utils.tracing import current_trace, record_span
+
+pool_checked_out = registry.gauge("db_pool_checked_out", "Connections currently checked out of the pool", ["pool"])
+pool_overflow = registry.gauge("db_pool_overflow", "Overflow connections currently open beyond pool_size", ["pool"])
+pool_size = registry.gauge("db_pool_size", "Configured pool size", ["pool"])
+pool_connections_created = registry.counter("db_pool_connections_created_total", "New DBAPI connections", ["pool"])
+pool_checkout_seconds = registry.histogram(
+    "db_pool_checkout_wait_seconds", "Time spent acquiring a connection from the pool", ["pool"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+pool_checkout_timeouts = registry.counter(
+    "db_pool_checkout_timeouts_total", "Connection checkouts that timed out waiting for the pool", ["pool"]
+)
+
+
+def _update_overflow(pool, name: str):
+    # SingletonThreadPool、NullPool 等没有溢出概念的连接池不统计
+    if hasattr(pool, "overflow"):
+        pool_overflow.set(max(pool.overflow(), 0), pool=name)
+
+
+def _instrument_checkout_wait(pool, name: str):
+    """统计 _do_get（从队列取连接或新建连接）的耗时
+
+    SQLAlchemy 没有“开始等待连接”的事件，因此包装连接池实例的 _do_get；
+    QueuePool 和 AsyncAdaptedQueuePool 都通过它获取连接。
+    """
+    do_get = getattr(pool, "_do_get", None)
+    if do_get is None or getattr(do_get, "_instrumented", False):
+        return
+
+    def timed_do_get():
+        start = time.perf_counter()
+        try:
+            return do_get()
+        except exc.TimeoutError:
+            pool_checkout_timeouts.inc(pool=name)
+            raise
+        finally:
+            pool_checkout_seconds.observe(time.perf_counter() - start, pool=name)
+            record_span("db_pool", start, pool=name)
+
+    timed_do_get._instrumented = True
+    pool._do_get = timed_do_get
+
+
+def instrument_engine(engine, name: str):
+    """为引擎的连接池注册指标（异步引擎传入 async_engine.sync_engine）"""
+    pool = engine.pool
+    if hasattr(pool, "size"):
+        pool_size.set(pool.size(), pool=name)
+    _instrument_checkout_wait(pool, name)
+
+    @event.listens_for(pool, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        pool_connections_created.inc(pool=name)
+
+    # checkin 事件在连接放回队列之前触发，此时 pool.checkedout() 还未减少，因此借出数按事件自行增减；
+    # engine.dispose() 会重建连接池（事件监听随之迁移），溢出数每次都从 engine.pool 读取
+    @event.listens_for(pool, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        pool_checked_out.inc(pool=name)
+        _update_overflow(engine.pool, name)
+
+    @event.listens_for(pool, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        pool_checked_out.dec(pool=name)
+        _update_overflow(engine.pool, name)
+
+    # 异步引擎的同步事件在 greenlet 中执行，仍能读到请求的追踪上下文
+    @event.listens_for(engine, "before_cursor_execute")
+    def on_before_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None and current_trace() is not None:
+            context._trace_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def on_after_execute(conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, "_trace_start", None)
+        if start is not None:
+            # 只记录语句类型，避免把参数或完整 SQL 写入追踪
+            record_span("db", start, statement=statement.lstrip().split(None, 1)[0].upper() if statement else "")
+
+
+@event.listens_for(Session, "before_commit")
+def _on_before_commit(session):
+    if current_trace() is not None:
+        session.info["_trace_commit_start"] = time.perf_counter()
+
+
+@event.listens_for(Session, "after_commit")
+def _on_after_commit(session):
+    start = session.info.pop("_trace_commit_start", None)
+    if start is not None:
+        record_span("db_commit", start)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _on_rollback(session, previous_transaction):
+    session.info.pop("_trace_commit_start", None)
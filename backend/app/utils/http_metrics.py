@@ -0,0 +1,69 @@
+"""
+HTTP 请求指标
+纯 ASGI 中间件，按路由模板（而不是实际路径，避免标签基数失控）统计每个请求的耗时和状态码。
+耗时统计到响应体发送完毕为止，流式接口（SSE）也按完整的响应时间计算。
+"""
+
+import time
+
+from app.utils.metrics import registry
+
+http_request_seconds = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency until the response body is fully sent",
+    ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+)
+http_requests_in_progress = registry.gauge(
+    "http_requests_in_progress", "HTTP requests currently being handled", ["method"]
+)
+
+
+def route_template(scope) -> str:
+    """匹配到的路由模板，例如 /api/chat/sessions/{session_id}；未匹配的路径统一记为 unmatched
+
+    新版 FastAPI 不再把 include_router 的前缀拼进路由对象的 path，
+    因此在实际路径中找出路由自身匹配的部分，其前面的部分即为（静态的）路由前缀。
+    """
+    route = scope.get("route")
+    template = getattr(route, "path", None)
+    regex = getattr(route, "path_regex", None)
+    if not template:
+        return "unmatched"
+    path = scope.get("path", "")
+    if regex is None or regex.match(path):
+        return template
+    for i, char in enumerate(path):
+        if char == "/" and regex.match(path[i:]):
+            return path[:i] + template
+    return template
+
+
+class HTTPMetricsMiddleware:
+    """记录每个请求的耗时、状态码和进行中的请求数"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        start = time.perf_counter()
+        status_code = 500
+        http_requests_in_progress.inc(method=method)
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_requests_in_progress.dec(method=method)
+            http_request_seconds.observe(
+                time.perf_counter() - start, method=method, route=route_template(scope), status=str(status_code)
+            )
@@ -0,0 +1,86 @@
+"""
+密码哈希执行器
+bcrypt 每次计算需要数百毫秒 CPU，放在独立的有界线程池中执行，
+不占用 FastAPI 处理同步路由的默认线程池；排队过多时直接返回 503
+"""
+
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Tuple
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+from app.utils.metrics import registry
+
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))  # 哈希线程数
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))  # 最多排队+执行中的任务数
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))  # bcrypt 计算成本，修改后旧哈希会在登录时自动升级
+
+# deprecated="auto" 时，成本与当前配置不同的哈希会被 needs_update 标记为需要重新计算
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+hash_pending = registry.gauge("password_hash_pending", "Password hash tasks queued or running")
+hash_seconds = registry.histogram(
+    "password_hash_seconds", "Password hash/verify time including queue wait", ["operation"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+hash_rejected = registry.counter("password_hash_rejected_total", "Password hash tasks rejected because of overload")
+
+
+class PasswordHasher:
+    """有界的密码哈希执行器"""
+
+    def __init__(self, max_workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="password-hash")
+
+    async def _run(self, operation: str, func: Callable, *args):
+        # pending 只在事件循环线程中修改，无需加锁
+        if self.pending >= self.max_pending:
+            hash_rejected.inc()
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="服务繁忙，请稍后重试",
+                headers={"Retry-After": "1"},
+            )
+        self.pending += 1
+        hash_pending.set(self.pending)
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        future = self._executor.submit(func, *args)
+        # 调用方被取消时哈希仍会在线程中算完，pending 要等线程中的任务真正结束（或未开始就被取消）才减少
+        future.add_done_callback(lambda _: self._notify_done(loop))
+        try:
+            return await asyncio.wrap_future(future)
+        finally:
+            hash_seconds.observe(time.perf_counter() - start, operation=operation)
+
+    def _notify_done(self, loop: asyncio.AbstractEventLoop):
+        try:
+            loop.call_soon_threadsafe(self._task_done)
+        except RuntimeError:
+            # 事件循环已关闭（进程退出时）
+            pass
+
+    def _task_done(self):
+        self.pending -= 1
+        hash_pending.set(self.pending)
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", pwd_context.hash, password)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """校验密码；若存储的哈希参数已过时，同时返回按当前配置重新计算的哈希"""
+        return await self._run("verify", pwd_context.verify_and_update, password, hashed_password)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# 全局密码哈希执行器
+password_hasher = PasswordHasher()
@@ -0,0 +1,21 @@
+"""
+token 数估算
+不依赖具体模型的分词器，用于上下文预算等只需要大致数量的场景
+"""
+
+from typing import Optional
+
+# 每条消息的固定开销（角色、分隔符等）
+MESSAGE_TOKEN_OVERHEAD = 4
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """粗略估算 token 数：中日韩字符约 1 token/字，其余字符约 4 字符/token"""
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if "⺀" <= ch <= "鿿" or "豈" <= ch <= "﫿")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def estimate_message_tokens(content: Optional[str]) -> int:
+    return estimate_tokens(content) + MESSAGE_TOKEN_OVERHEAD
@@ -0,0 +1,228 @@
+"""
+进程内请求追踪
+对采样到的请求记录一组耗时片段（span）：数据库查询与提交、文档提取、上下文组装、报告检索、模型客户端获取、
+模型调用排队与执行等。响应头 Server-Timing 按名称汇总各片段的耗时（浏览器开发者工具可直接查看），
+配置 TRACE_EXPORT_PATH 后，每个请求的完整片段列表以 JSON Lines 追加写入该文件（由后台线程写入，不阻塞事件循环）。
+
+未被采样的请求不创建追踪对象，span() 只做一次 ContextVar 读取，开销可以忽略，适合在生产环境常开。
+开启 TRACE_ALLOW_FORCE_HEADER 后，请求头 X-Trace-Sample: 1 可强制追踪单个请求，便于排查慢请求；
+默认关闭，避免客户端随意绕过采样率放大追踪开销。
+"""
+
+import atexit
+import json
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+# 追踪配置
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))  # 采样比例（0~1）
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "")  # JSON Lines 导出文件，留空不导出
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "500"))  # 单个请求最多记录的片段数
+TRACE_ALLOW_FORCE_HEADER = os.getenv("TRACE_ALLOW_FORCE_HEADER", "false").lower() == "true"  # 是否接受 X-Trace-Sample 请求头
+TRACE_EXPORT_QUEUE_SIZE = int(os.getenv("TRACE_EXPORT_QUEUE_SIZE", "1000"))  # 等待写入的追踪记录上限，写满时丢弃
+
+FORCE_SAMPLE_HEADER = b"x-trace-sample"
+
+
+class Trace:
+    """一个请求的追踪记录"""
+
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.started_at = datetime.now(timezone.utc)
+        self.start = time.perf_counter()
+        self.spans: List[Dict] = []
+        self.dropped = 0
+
+    def add(self, name: str, start: float, end: float, parent: Optional[int], attrs: Dict) -> Optional[int]:
+        if len(self.spans) >= TRACE_MAX_SPANS:
+            self.dropped += 1
+            return None
+        self.spans.append({
+            "id": len(self.spans),
+            "name": name,
+            "parent": parent,
+            "start_ms": round((start - self.start) * 1000, 3),
+            "duration_ms": round((end - start) * 1000, 3),
+            **({"attrs": attrs} if attrs else {}),
+        })
+        return len(self.spans) - 1
+
+    def server_timing(self) -> str:
+        """按名称汇总为 Server-Timing 头，例如 db;dur=12.5;desc="4 calls", llm;dur=1800.2"""
+        totals: Dict[str, List[float]] = {}
+        for item in self.spans:
+            total = totals.setdefault(item["name"], [0.0, 0])
+            total[0] += item["duration_ms"]
+            total[1] += 1
+        parts = [
+            f'{name};dur={duration:.1f}' + (f';desc="{count} calls"' if count > 1 else "")
+            for name, (duration, count) in totals.items()
+        ]
+        parts.append(f"total;dur={(time.perf_counter() - self.start) * 1000:.1f}")
+        parts.append(f'trace;desc="{self.trace_id}"')
+        return ", ".join(parts)
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional[int]] = ContextVar("current_span", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """记录代码块的耗时；块内产生的片段以它为父片段"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    parent = _current_span.get()
+    # 先占位，子片段才能引用到它的编号
+    span_id = trace.add(name, time.perf_counter(), time.perf_counter(), parent, attrs)
+    token = _current_span.set(span_id)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _current_span.reset(token)
+        if span_id is not None:
+            trace.spans[span_id]["start_ms"] = round((start - trace.start) * 1000, 3)
+            trace.spans[span_id]["duration_ms"] = round((time.perf_counter() - start) * 1000, 3)
+
+
+def record_span(name: str, start: float, end: Optional[float] = None, **attrs):
+    """记录一个已知起止时间的片段（用于事件回调和异步生成器等无法包裹代码块的场景）"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, start, time.perf_counter() if end is None else end, _current_span.get(), attrs)
+
+
+class TraceExporter:
+    """以 JSON Lines 追加写入追踪记录
+
+    export() 只把记录放入队列，序列化和文件写入由后台线程批量完成；磁盘变慢时队列写满，多出的记录直接丢弃。
+    """
+
+    def __init__(self, path: str, queue_size: int = TRACE_EXPORT_QUEUE_SIZE):
+        self.path = path
+        self.dropped = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._queue: "queue.Queue[Optional[Dict]]" = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._writer, name="trace-exporter", daemon=True)
+        self._thread.start()
+        # 进程退出前写完队列中剩余的记录
+        atexit.register(self.close)
+
+    def export(self, trace: Trace, **fields):
+        record = {
+            "trace_id": trace.trace_id,
+            "timestamp": trace.started_at.isoformat(),
+            **fields,
+            "duration_ms": round((time.perf_counter() - trace.start) * 1000, 3),
+            "spans": trace.spans,
+            **({"dropped_spans": trace.dropped} if trace.dropped else {}),
+        }
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _writer(self):
+        while True:
+            records = [self._queue.get()]
+            # 一次取出队列中已有的全部记录，合并为一次写入
+            while True:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in records
+            lines = [
+                json.dumps(record, ensure_ascii=False, default=str) + "\n" for record in records if record is not None
+            ]
+            if lines:
+                try:
+                    with open(self.path, "a", encoding="utf-8") as f:
+                        f.writelines(lines)
+                except OSError as e:
+                    print(f"写入追踪记录失败：{e!s}")
+            if stop:
+                return
+
+    def close(self, timeout: float = 5):
+        """写完已排队的记录后停止后台线程"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+
+class TracingMiddleware:
+    """为采样到的请求创建追踪，写入 Server-Timing 响应头，并在响应结束后导出"""
+
+    def __init__(
+        self,
+        app,
+        enabled: bool = TRACING_ENABLED,
+        sample_rate: float = TRACE_SAMPLE_RATE,
+        export_path: str = TRACE_EXPORT_PATH,
+        allow_force_header: bool = TRACE_ALLOW_FORCE_HEADER
+    ):
+        self.app = app
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.allow_force_header = allow_force_header
+        self.exporter = TraceExporter(export_path) if export_path else None
+
+    def _sampled(self, scope) -> bool:
+        if not self.enabled:
+            return False
+        if self.allow_force_header:
+            for key, value in scope.get("headers", []):
+                if key == FORCE_SAMPLE_HEADER:
+                    return value not in (b"0", b"false")
+        return random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._sampled(scope):
+            await self.app(scope, receive, send)
+            return
+
+        # 延迟导入，避免 utils 与路由指标模块之间的导入顺序问题
+        from app.utils.http_metrics import route_template
+
+        trace = Trace()
+        token = _current_trace.set(trace)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", trace.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_trace.reset(token)
+            if self.exporter is not None:
+                self.exporter.export(
+                    trace, method=scope["method"], route=route_template(scope), path=scope.get("path"),
+                    status=status_code
+                )
@@ -0,0 +1,70 @@
+"""
+上传文件保存
+按固定大小分块写入磁盘，边写边计算 SHA-256，超过大小上限时立即中止；
+先写入同目录的临时文件，完成后原子重命名，避免留下不完整的文件
+"""
+
+import hashlib
+import os
+import uuid
+from typing import Dict
+
+import aiofiles
+import aiofiles.os
+from fastapi import HTTPException, UploadFile
+
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))  # 每次读写 1MB
+REPORT_MAX_UPLOAD_SIZE = int(os.getenv("REPORT_MAX_UPLOAD_SIZE", str(20 * 1024 * 1024)))  # 报告最大 20MB
+AVATAR_MAX_UPLOAD_SIZE = int(os.getenv("AVATAR_MAX_UPLOAD_SIZE", str(5 * 1024 * 1024)))  # 头像最大 5MB
+
+
+def format_size(size: int) -> str:
+    if size >= 1024 * 1024:
+        return f"{size / (1024 * 1024):.0f}MB"
+    return f"{max(size // 1024, 1)}KB"
+
+
+async def save_upload_file(
+    upload: UploadFile,
+    dest_path: str,
+    max_size: int,
+    chunk_size: int = UPLOAD_CHUNK_SIZE
+) -> Dict:
+    """流式保存上传文件，返回 {"path", "size", "sha256"}
+
+    内存占用只与 chunk_size 有关，与文件大小无关；超过 max_size 时返回 413。
+    """
+    too_large = HTTPException(status_code=413, detail=f"文件大小不能超过{format_size(max_size)}")
+
+    # 已知大小时直接拒绝，不再读取内容
+    if upload.size is not None and upload.size > max_size:
+        raise too_large
+
+    dest_dir = os.path.dirname(dest_path)
+    if dest_dir:
+        os.makedirs(dest_dir, exist_ok=True)
+    tmp_path = f"{dest_path}.{uuid.uuid4().hex}.part"
+
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(tmp_path, "wb") as f:
+            while True:
+                chunk = await upload.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size:
+                    raise too_large
+                digest.update(chunk)
+                await f.write(chunk)
+        await aiofiles.os.replace(tmp_path, dest_path)
+    except BaseException:
+        # 中途失败（超限、客户端断开等）时清理临时文件
+        try:
+            await aiofiles.os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+    return {"path": dest_path, "size": size, "sha256": digest.hexdigest()}
@@ -0,0 +1,84 @@
+"""
+已认证用户缓存
+按 token 的 sub（用户名）缓存用户记录，短时间内的重复请求不再查询数据库。
+缓存的是已脱离会话的 User 对象，只读使用；需要修改用户时先用 attach_user 合并到当前会话。
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.user import User
+from app.utils.metrics import registry
+
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "30"))  # 缓存有效期（秒），多进程部署时即最长不一致时间
+USER_CACHE_MAX_SIZE = int(os.getenv("USER_CACHE_MAX_SIZE", "1024"))  # 最多缓存的用户数
+
+user_cache_requests = registry.counter("user_cache_requests_total", "Authenticated user cache lookups", ["result"])
+
+
+class UserCache:
+    """带 TTL 的有界 LRU 用户缓存"""
+
+    def __init__(self, ttl: float = USER_CACHE_TTL, max_size: int = USER_CACHE_MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, username: str) -> Optional[User]:
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is not None:
+                user, expires_at = entry
+                if time.monotonic() < expires_at:
+                    self._entries.move_to_end(username)
+                    user_cache_requests.inc(result="hit")
+                    return user
+                del self._entries[username]
+        user_cache_requests.inc(result="miss")
+        return None
+
+    def set(self, username: str, user: User):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[username] = (user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, username: Optional[str]):
+        with self._lock:
+            self._entries.pop(username, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        return {"size": len(self._entries), "max_size": self.max_size, "ttl": self.ttl}
+
+
+# 全局用户缓存
+user_cache = UserCache()
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_cached_user(mapper, connection, target):  # noqa: ARG001
+    """任何通过 ORM 修改用户（设置、头像、停用等）的操作都会使缓存失效"""
+    user_cache.invalidate(target.username)
+
+
+async def attach_user(db: AsyncSession, user: User) -> User:
+    """将（可能来自缓存的）用户对象合并到当前会话，以便修改后提交
+
+    load=False 不会重新查询数据库，缓存中的对象本身也不会被修改。
+    """
+    return await db.merge(user, load=False)
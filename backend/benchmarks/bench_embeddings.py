@@ -0,0 +1,123 @@
+"""
+嵌入吞吐基准
+模拟一批报告（每份报告包含相同的化验单表头、免责声明等重复文本块和少量独有内容），
+比较逐块调用后端、批量调用（无缓存）、批量 + 冷缓存、批量 + 热缓存四种方式的 chunks/sec。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_embeddings --reports 200
+模拟远程嵌入接口的调用延迟（每次调用固定开销 + 每个文本块的开销）：
+    python -m benchmarks.bench_embeddings --call-latency 0.05 --per-chunk-latency 0.001
+使用本地模型：
+    python -m benchmarks.bench_embeddings --backend sentence-transformers
+"""
+
+import argparse
+import shutil
+import tempfile
+import time
+
+from benchmarks.common import setup_environment
+
+BOILERPLATE = [
+    "检验科 检验报告单 标本类型：血清 送检医生：",
+    "本报告仅对所检测标本负责，如有疑问请在三日内与检验科联系。",
+    "参考区间依据本实验室建立的正常人群数据，仅供临床参考。",
+    "免责声明：本报告不能替代医生诊断，请结合临床症状综合判断。",
+]
+
+
+def make_reports(count: int, unique_chunks: int):
+    reports = []
+    for i in range(count):
+        unique = [
+            f"报告 {i} 项目 {j}：ALT {20 + (i * 7 + j) % 80} U/L，AST {15 + (i + j * 3) % 60} U/L"
+            for j in range(unique_chunks)
+        ]
+        reports.append(BOILERPLATE + unique)
+    return reports
+
+
+class SlowEmbedder:
+    """给嵌入后端加上固定的调用延迟，模拟远程接口"""
+
+    def __init__(self, embedder, call_latency: float, per_chunk_latency: float):
+        self.embedder = embedder
+        self.call_latency = call_latency
+        self.per_chunk_latency = per_chunk_latency
+
+    @property
+    def name(self):
+        return self.embedder.name
+
+    @property
+    def dim(self):
+        return self.embedder.dim
+
+    def embed_documents(self, texts):
+        time.sleep(self.call_latency + self.per_chunk_latency * len(texts))
+        return self.embedder.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def run_case(name: str, reports, embed_report):
+    chunks = sum(len(report) for report in reports)
+    start = time.perf_counter()
+    for report in reports:
+        embed_report(report)
+    elapsed = time.perf_counter() - start
+    return {"name": name, "chunks": chunks, "seconds": round(elapsed, 3), "chunks_per_sec": round(chunks / elapsed, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="嵌入吞吐基准")
+    parser.add_argument("--backend", default="hashing", help="hashing / sentence-transformers / openai")
+    parser.add_argument("--reports", type=int, default=200)
+    parser.add_argument("--unique-chunks", type=int, default=8, help="每份报告独有的文本块数")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument("--call-latency", type=float, default=0.0, help="每次后端调用的额外延迟（秒）")
+    parser.add_argument("--per-chunk-latency", type=float, default=0.0, help="每个文本块的额外延迟（秒）")
+    args = parser.parse_args()
+
+    setup_environment()
+    from app.services.embedding_service import EmbeddingService
+    from app.services.embeddings import create_embedder
+
+    embedder = SlowEmbedder(create_embedder(args.backend), args.call_latency, args.per_chunk_latency)
+    reports = make_reports(args.reports, args.unique_chunks)
+    cache_dir = tempfile.mkdtemp(prefix="medical_ai_embed_cache_")
+
+    def service(cache_enabled: bool) -> EmbeddingService:
+        return EmbeddingService(
+            embedder, batch_size=args.batch_size, concurrency=args.concurrency,
+            cache_enabled=cache_enabled, cache_dir=cache_dir
+        )
+
+    results = [run_case("per_chunk", reports, lambda report: [embedder.embed_documents([text]) for text in report])]
+
+    uncached = service(cache_enabled=False)
+    results.append(run_case("batched", reports, uncached.embed_documents))
+    uncached.shutdown()
+
+    cold = service(cache_enabled=True)
+    results.append(run_case("batched_cache_cold", reports, cold.embed_documents))
+    print("cold cache stats:", cold.stats())
+    cold.shutdown()
+
+    # 新实例从磁盘加载缓存，模拟重启后的重复入库
+    warm = service(cache_enabled=True)
+    results.append(run_case("batched_cache_warm", reports, warm.embed_documents))
+    print("warm cache stats:", warm.stats())
+    warm.shutdown()
+
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+    print(" | ".join(f"{h:>20}" for h in ["name", "chunks", "seconds", "chunks_per_sec"]))
+    for row in results:
+        print(" | ".join(f"{row[h]:>20}" for h in ["name", "chunks", "seconds", "chunks_per_sec"]))
+
+
+if __name__ == "__main__":
+    main()
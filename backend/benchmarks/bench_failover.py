@@ -0,0 +1,197 @@
+"""
+故障切换与对冲场景
+用注入了延迟和错误的 MockAIService 组合出 FailoverAIService，逐个验证：
+- 首选服务正常时只调用首选服务
+- 首选服务变慢时，超过对冲等待时间后向备用服务发出对冲请求，采用先返回的结果并取消慢请求
+- 首选服务返回错误时立即切换
+- 连续失败后熔断，跳过该服务；冷却期结束后放行一次试探请求，未发出的试探不占用名额
+- 流式请求按首个片段对冲
+并输出对冲前后的延迟分布。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_failover
+    python -m benchmarks.bench_failover --requests 300 --slow-rate 0.02
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import time
+
+from benchmarks.common import percentile, setup_environment
+
+
+def make_service_class():
+    from app.services.multi_ai_service import MockAIService
+
+    class DelayedMockService(MockAIService):
+        """按配置注入延迟和错误的模拟服务，记录调用、完成和取消次数"""
+
+        def __init__(self, name: str, delay: float = 0.01, slow_delay: float = 0.0, slow_rate: float = 0.0,
+                     fail: bool = False):
+            super().__init__(token_delay=0.001)
+            self.provider = name
+            self.model_name = name
+            self.delay = delay
+            self.slow_delay = slow_delay
+            self.slow_rate = slow_rate
+            self.fail = fail
+            self.calls = 0
+            self.completed = 0
+            self.cancelled = 0
+
+        def _latency(self) -> float:
+            return self.slow_delay if random.random() < self.slow_rate else self.delay
+
+        async def chat(self, messages):
+            self.calls += 1
+            try:
+                await asyncio.sleep(self._latency())
+            except asyncio.CancelledError:
+                self.cancelled += 1
+                raise
+            self.completed += 1
+            if self.fail:
+                return "模型服务错误：模拟故障"
+            return f"{self.provider} 的回复"
+
+        async def astream(self, messages):
+            self.calls += 1
+            try:
+                await asyncio.sleep(self._latency())
+            except asyncio.CancelledError:
+                self.cancelled += 1
+                raise
+            if self.fail:
+                yield "模型服务错误：模拟故障"
+                return
+            for token in f"{self.provider} 的流式回复":
+                yield token
+            self.completed += 1
+
+    return DelayedMockService
+
+
+def check(name: str, condition: bool, detail: str = ""):
+    print(f"[{'PASS' if condition else 'FAIL'}] {name} {detail}")
+    if not condition:
+        raise SystemExit(1)
+
+
+async def scenarios():
+    from app.services.multi_ai_service import FailoverAIService
+    from app.services.provider_health import LLM_BREAKER_FAILURES, provider_health
+
+    Service = make_service_class()
+    messages = [{"role": "user", "content": "头疼怎么办"}]
+
+    primary, backup = Service("primary"), Service("backup")
+    result = await FailoverAIService([primary, backup]).chat(messages)
+    check("healthy primary", result == "primary 的回复" and backup.calls == 0, f"backup calls={backup.calls}")
+
+    primary, backup = Service("primary", delay=2.0), Service("backup", delay=0.05)
+    start = time.perf_counter()
+    result = await FailoverAIService([primary, backup]).chat(messages)
+    elapsed = time.perf_counter() - start
+    await asyncio.sleep(0)
+    check(
+        "hedge on slow primary", result == "backup 的回复" and primary.cancelled == 1 and elapsed < 1.0,
+        f"elapsed={elapsed:.2f}s primary cancelled={primary.cancelled}"
+    )
+
+    primary, backup = Service("primary", fail=True), Service("backup")
+    start = time.perf_counter()
+    result = await FailoverAIService([primary, backup]).chat(messages)
+    check(
+        "failover on error", result == "backup 的回复" and time.perf_counter() - start < 0.2,
+        f"elapsed={time.perf_counter() - start:.2f}s"
+    )
+
+    primary, backup = Service("primary", fail=True), Service("backup", fail=True)
+    result = await FailoverAIService([primary, backup]).chat(messages)
+    check("all providers failing returns error", result.startswith("模型服务错误"))
+
+    primary, backup = Service("primary", fail=True), Service("backup")
+    service = FailoverAIService([primary, backup])
+    for _ in range(LLM_BREAKER_FAILURES + 3):
+        await service.chat(messages)
+    check(
+        "circuit breaker skips failing provider", primary.calls == LLM_BREAKER_FAILURES,
+        f"primary calls={primary.calls} state={provider_health.get(primary).state}"
+    )
+    provider_health.get(primary).opened_at -= 3600  # 模拟冷却期结束
+    primary.fail = False
+    await service.chat(messages)
+    check("half-open trial closes breaker", provider_health.get(primary).state == "closed")
+
+    # 半开的备用服务在首选服务胜出（未发出备用请求）后应归还试探名额，之后仍能被试探并恢复
+    primary, backup = Service("primary"), Service("backup")
+    service = FailoverAIService([primary, backup])
+    provider_health.get(backup).opened_at = time.monotonic() - 3600
+    await service.chat(messages)
+    primary.fail = True
+    result = await service.chat(messages)
+    check(
+        "half-open fallback recovers after primary win",
+        result == "backup 的回复" and provider_health.get(backup).state == "closed",
+        f"backup calls={backup.calls} state={provider_health.get(backup).state}"
+    )
+
+    primary, backup = Service("primary", delay=2.0), Service("backup", delay=0.05)
+    start = time.perf_counter()
+    text = "".join([token async for token in FailoverAIService([primary, backup]).astream(messages)])
+    check(
+        "stream hedged on first token", text == "backup 的流式回复" and time.perf_counter() - start < 1.0,
+        f"elapsed={time.perf_counter() - start:.2f}s"
+    )
+
+
+async def latency_run(args):
+    from app.services.multi_ai_service import FailoverAIService
+
+    Service = make_service_class()
+    messages = [{"role": "user", "content": "头疼怎么办"}]
+    rows = []
+    for hedge in (False, True):
+        primary = Service("primary", delay=args.delay, slow_delay=args.slow_delay, slow_rate=args.slow_rate)
+        backup = Service("backup", delay=args.delay, slow_delay=args.slow_delay, slow_rate=args.slow_rate)
+        service = FailoverAIService([primary, backup]) if hedge else primary
+        latencies = []
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            await service.chat(messages)
+            latencies.append(time.perf_counter() - start)
+        rows.append({
+            "mode": "hedged" if hedge else "single",
+            "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+            "provider_calls": primary.calls + backup.calls,
+        })
+    headers = ["mode", "p50_ms", "p95_ms", "p99_ms", "provider_calls"]
+    print(" | ".join(f"{h:>14}" for h in headers))
+    for row in rows:
+        print(" | ".join(f"{row[h]:>14}" for h in headers))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="故障切换与对冲场景")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--delay", type=float, default=0.02, help="正常调用延迟（秒）")
+    parser.add_argument("--slow-delay", type=float, default=1.0, help="慢调用延迟（秒）")
+    parser.add_argument("--slow-rate", type=float, default=0.03, help="慢调用比例")
+    args = parser.parse_args()
+
+    # 缩短对冲等待时间，使场景在几秒内完成
+    os.environ.setdefault("LLM_HEDGE_DEFAULT_DELAY", "0.2")
+    os.environ.setdefault("LLM_HEDGE_MIN_DELAY", "0.05")
+    os.environ.setdefault("LLM_HEDGE_MIN_SAMPLES", "10")
+    setup_environment()
+    random.seed(0)
+    asyncio.run(scenarios())
+    asyncio.run(latency_run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+模型调用调度基准
+向一个模拟提供商同时发出一批交互式对话和后台报告分析，检查：
+- 同时进行的调用数从不超过最大并发
+- 任意 60 秒窗口内的请求数不超过 RPM（按 --rpm 换算到本次运行的时长）
+- 交互式调用的排队时间明显短于后台调用
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_llm_scheduler
+    python -m benchmarks.bench_llm_scheduler --concurrency 4 --rpm 600 --chat 100 --reports 50
+"""
+
+import argparse
+import asyncio
+import time
+
+from benchmarks.common import percentile, setup_environment
+
+
+async def run(args):
+    from app.services.llm_scheduler import ProviderLimiter
+    from app.services.multi_ai_service import MockAIService, ScheduledAIService
+
+    class DelayedMockService(MockAIService):
+        """固定延迟的模拟服务，记录并发峰值和每次调用的开始时间"""
+
+        def __init__(self, delay: float):
+            super().__init__()
+            self.delay = delay
+            self.active = 0
+            self.max_active = 0
+            self.started = []
+
+        async def _call(self, result: str) -> str:
+            self.started.append(time.perf_counter())
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            try:
+                await asyncio.sleep(self.delay)
+                return result
+            finally:
+                self.active -= 1
+
+        async def chat(self, messages):
+            return await self._call("对话回复")
+
+        async def analyze_report(self, analysis_prompt):
+            return await self._call("报告分析")
+
+    backend = DelayedMockService(args.delay)
+    service = ScheduledAIService(backend)
+    service.limiter = ProviderLimiter("bench", args.concurrency, args.rpm, args.tpm)
+    messages = [{"role": "user", "content": "头疼怎么办"}]
+
+    waits = {"chat": [], "analyze_report": []}
+
+    async def timed(kind, coro):
+        start = time.perf_counter()
+        await coro
+        # 总耗时减去调用本身的耗时即为排队时间
+        waits[kind].append(time.perf_counter() - start - args.delay)
+
+    # 后台任务先到达，交互式请求随后涌入，仍应先被调度
+    tasks = [timed("analyze_report", service.analyze_report("报告内容")) for _ in range(args.reports)]
+    tasks += [timed("chat", service.chat(messages)) for _ in range(args.chat)]
+    start = time.perf_counter()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+
+    print(f"total {args.chat + args.reports} calls in {elapsed:.2f}s, max concurrent {backend.max_active}")
+    for kind, values in waits.items():
+        print(
+            f"{kind:>16}: queue wait p50 {percentile(values, 50) * 1000:8.1f} ms, "
+            f"p95 {percentile(values, 95) * 1000:8.1f} ms"
+        )
+
+    ok = backend.max_active <= args.concurrency
+    if args.rpm:
+        # 令牌桶允许一次突发 rpm 个请求，之后按 rpm/60 每秒补充
+        allowed = args.rpm + args.rpm / 60 * elapsed
+        ok = ok and len(backend.started) <= allowed
+        print(f"requests {len(backend.started)}, allowed by rpm bucket {allowed:.0f}")
+    ok = ok and percentile(waits["chat"], 95) < percentile(waits["analyze_report"], 50)
+    print("PASS" if ok else "FAIL")
+    if not ok:
+        raise SystemExit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模型调用调度基准")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rpm", type=int, default=0)
+    parser.add_argument("--tpm", type=int, default=0)
+    parser.add_argument("--chat", type=int, default=40)
+    parser.add_argument("--reports", type=int, default=40)
+    parser.add_argument("--delay", type=float, default=0.05, help="每次调用的模拟耗时（秒）")
+    args = parser.parse_args()
+
+    setup_environment()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+登录吞吐与其它接口延迟基准
+测量持续登录压力下的登录吞吐量，以及同时访问其它同步接口（/api/system/health）的延迟变化。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_login --concurrency 64 --duration 10
+对比旧实现（bcrypt 在 FastAPI 默认线程池中执行）：
+    python -m benchmarks.bench_login --default-threadpool
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+from benchmarks.common import print_table, setup_environment, summarize
+
+
+async def probe(client, stop: asyncio.Event, latencies: list):
+    """持续请求轻量同步接口，记录延迟"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.get("/api/system/health")
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(0.01)
+
+
+async def login_worker(client, username: str, stop: asyncio.Event, latencies: list, status_counts: dict):
+    while not stop.is_set():
+        start = time.perf_counter()
+        response = await client.post("/api/auth/login", json={"username": username, "password": "benchmark-password"})
+        status_counts[response.status_code] = status_counts.get(response.status_code, 0) + 1
+        if response.status_code == 200:
+            latencies.append(time.perf_counter() - start)
+        elif response.status_code == 503:
+            # 按 Retry-After 的思路稍后重试，模拟真实客户端
+            await asyncio.sleep(0.1)
+
+
+async def run(args):
+    import httpx
+
+    import main
+    from app.utils import password_hashing
+
+    if args.default_threadpool:
+        # 模拟旧实现：哈希与同步路由共用 FastAPI 默认线程池，且不限制排队
+        from fastapi.concurrency import run_in_threadpool
+
+        async def run_in_default_pool(self, operation, func, *func_args):  # noqa: ARG001
+            return await run_in_threadpool(func, *func_args)
+        password_hashing.PasswordHasher._run = run_in_default_pool
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        usernames = [f"bench_user_{i}" for i in range(args.users)]
+        for username in usernames:
+            await client.post("/api/auth/register", json={
+                "username": username,
+                "email": f"{username}@example.com",
+                "password": "benchmark-password",
+                "full_name": username,
+            })
+
+        # 1. 空闲时的接口延迟
+        idle_latencies = []
+        stop = asyncio.Event()
+        task = asyncio.create_task(probe(client, stop, idle_latencies))
+        await asyncio.sleep(args.duration / 2)
+        stop.set()
+        await task
+
+        # 2. 登录压力下的接口延迟和登录吞吐
+        busy_latencies, login_latencies, status_counts = [], [], {}
+        stop = asyncio.Event()
+        start = time.perf_counter()
+        tasks = [asyncio.create_task(probe(client, stop, busy_latencies))]
+        tasks += [
+            asyncio.create_task(login_worker(client, usernames[i % len(usernames)], stop, login_latencies, status_counts))
+            for i in range(args.concurrency)
+        ]
+        await asyncio.sleep(args.duration)
+        stop.set()
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+    mode = "default threadpool" if args.default_threadpool else f"hash executor ({password_hashing.PASSWORD_HASH_WORKERS} workers)"
+    print(f"模式: {mode}, bcrypt rounds: {password_hashing.BCRYPT_ROUNDS}, 并发登录: {args.concurrency}")
+    print(f"登录响应状态分布: {status_counts}")
+    print_table({
+        "health idle": summarize(idle_latencies, args.duration / 2),
+        "health busy": summarize(busy_latencies, elapsed),
+        "login": summarize(login_latencies, elapsed),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="登录吞吐与接口延迟基准")
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--rounds", type=int, default=None, help="bcrypt 计算成本（默认读取 BCRYPT_ROUNDS）")
+    parser.add_argument("--default-threadpool", action="store_true", help="使用 FastAPI 默认线程池执行哈希（旧实现）")
+    args = parser.parse_args()
+
+    if args.rounds is not None:
+        os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+    setup_environment()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+长报告分析基准
+模拟模型调用耗时随提示长度线性增长（固定开销 + 每 token 开销），
+比较单次调用与不同并发下的分段分析（map-reduce）的总耗时和调用次数。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_report_analysis --pages 40
+    python -m benchmarks.bench_report_analysis --call-latency 0.5 --per-token-latency 0.0005 --concurrency 1 4 8
+"""
+
+import argparse
+import asyncio
+import time
+
+from benchmarks.common import setup_environment
+
+
+def make_report(pages: int, lines_per_page: int) -> str:
+    lines = []
+    for page in range(pages):
+        lines.append(f"第 {page + 1} 页 出院小结 住院号 2024{page:04d}")
+        for i in range(lines_per_page):
+            lines.append(
+                f"项目 {i}：白细胞 {4 + (page + i) % 7}.{i % 10} ×10^9/L，"
+                f"血红蛋白 {110 + (page * 3 + i) % 50} g/L，医嘱：复查血常规，继续口服药物治疗。"
+            )
+    return "\n".join(lines)
+
+
+class SlowAIService:
+    """按提示长度模拟模型耗时的分析服务，记录调用次数和最大并发"""
+
+    provider = "mock"
+    model_name = "bench"
+    temperature = 0.0
+
+    def __init__(self, call_latency: float, per_token_latency: float):
+        from app.utils.tokens import estimate_tokens
+
+        self.estimate_tokens = estimate_tokens
+        self.call_latency = call_latency
+        self.per_token_latency = per_token_latency
+        self.calls = 0
+        self.active = 0
+        self.max_active = 0
+
+    async def analyze_report(self, analysis_prompt: str) -> str:
+        self.calls += 1
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.call_latency + self.per_token_latency * self.estimate_tokens(analysis_prompt))
+            return f"分析结果（{len(analysis_prompt)} 字）"
+        finally:
+            self.active -= 1
+
+
+async def run_case(name: str, analyze, service) -> dict:
+    start = time.perf_counter()
+    await analyze(service)
+    return {
+        "name": name,
+        "calls": service.calls,
+        "max_active": service.max_active,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+async def run(args):
+    from app.services.report_analysis import map_reduce_analyze, split_sections
+    from app.utils.tokens import estimate_tokens
+
+    text = make_report(args.pages, args.lines_per_page)
+    sections = split_sections(text, args.section_tokens)
+    print(f"report tokens: {estimate_tokens(text)}, sections: {len(sections)}")
+
+    def service():
+        return SlowAIService(args.call_latency, args.per_token_latency)
+
+    # 单次调用：直接把全文放进一个提示
+    single = service()
+    results = [await run_case("single", lambda s: s.analyze_report(text), single)]
+    for concurrency in args.concurrency:
+        results.append(await run_case(
+            f"map_reduce_c{concurrency}",
+            lambda s, c=concurrency: map_reduce_analyze(s, text, section_tokens=args.section_tokens, concurrency=c),
+            service()
+        ))
+
+    headers = ["name", "calls", "max_active", "seconds"]
+    print(" | ".join(f"{h:>16}" for h in headers))
+    for row in results:
+        print(" | ".join(f"{row[h]:>16}" for h in headers))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="长报告分析基准")
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--lines-per-page", type=int, default=30)
+    parser.add_argument("--section-tokens", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--call-latency", type=float, default=0.2, help="每次调用的固定延迟（秒）")
+    parser.add_argument("--per-token-latency", type=float, default=0.0002, help="每个提示 token 的延迟（秒）")
+    args = parser.parse_args()
+
+    setup_environment()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+基准测试公共工具
+在导入 app 之前配置好临时数据库等环境变量，并提供延迟统计函数
+"""
+
+import math
+import os
+import sys
+import tempfile
+from typing import Dict, List
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_environment(database_url: str = None) -> str:
+    """设置基准测试使用的环境变量（必须在导入 app 之前调用），返回数据库 URL"""
+    if database_url is None:
+        workdir = tempfile.mkdtemp(prefix="medical_ai_bench_")
+        database_url = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        os.chdir(workdir)  # 上传文件、头像等写入临时目录
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.setdefault("SECRET_KEY", "benchmark-secret-key")
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    return database_url
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """最近秩法计算百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)) - 1, 0)
+    return ordered[rank]
+
+
+def summarize(latencies: List[float], elapsed: float) -> Dict:
+    """汇总延迟（秒）为毫秒级统计"""
+    return {
+        "count": len(latencies),
+        "throughput": round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(max(latencies) * 1000, 2) if latencies else 0.0,
+    }
+
+
+def print_table(rows: Dict[str, Dict]):
+    """以表格形式输出多组统计结果"""
+    headers = ["name", "count", "throughput", "p50_ms", "p95_ms", "p99_ms", "max_ms"]
+    print(" | ".join(f"{h:>14}" for h in headers))
+    for name, stats in rows.items():
+        print(" | ".join([f"{name:>14}"] + [f"{stats.get(h, ''):>14}" for h in headers[1:]]))
@@ -1,16 +1,47 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.api import auth, chat, reports, users, system
-from app.database import engine
+from app.api import auth, chat, chat_ws, reports, users, system
+from app.database import engine, upgrade_schema
 from app.models import Base
+from app.services.client_registry import client_registry
+from app.services.document_extractor import document_extractor
+from app.services.multi_ai_service import ai_service
+from app.services.report_backfill import REPORT_BACKFILL_ON_STARTUP, backfill_reports
+from app.services.report_jobs import REPORT_JOB_WORKERS, report_job_worker
+from app.utils.http_metrics import HTTPMetricsMiddleware
+from app.utils.password_hashing import password_hasher
+from app.utils.tracing import TracingMiddleware
 
-# 创建数据库表
+# 创建数据库表，并为旧版本创建的表补齐新增的列和索引
 Base.metadata.create_all(bind=engine)
+upgrade_schema(engine)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if REPORT_BACKFILL_ON_STARTUP:
+        count = await backfill_reports()
+        print(f"报告回填完成，新建 {count} 条报告记录")
+    # 报告分析任务工作者（未完成的任务会在启动后被重新领取）
+    if REPORT_JOB_WORKERS > 0:
+        report_job_worker.start()
+    yield
+    await report_job_worker.stop()
+    # 关闭共享的 AI 客户端连接池、文档提取进程池、密码哈希线程池和嵌入线程池
+    await client_registry.aclose()
+    document_extractor.shutdown()
+    password_hasher.shutdown()
+    if ai_service.embedding_service:
+        ai_service.embedding_service.shutdown()
+
 
 app = FastAPI(
     title="医疗AI助手 API",
     description="基于 LangChain 的智能医疗问答系统，支持多种 AI 模型",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS 配置
@@ -20,12 +51,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Server-Timing"],
 )
+# 请求追踪（Server-Timing 响应头，可选导出到 TRACE_EXPORT_PATH）
+app.add_middleware(TracingMiddleware)
+# 请求耗时指标（最后添加，位于最外层，统计包含其它中间件在内的完整耗时）
+app.add_middleware(HTTPMetricsMiddleware)
 
 # 注册路由
 app.include_router(auth.router, prefix="/api/auth", tags=["认证"])
 app.include_router(users.router, prefix="/api/users", tags=["用户"])
 app.include_router(chat.router, prefix="/api/chat", tags=["聊天"])
+app.include_router(chat_ws.router, prefix="/api/chat", tags=["聊天"])
 app.include_router(reports.router, prefix="/api/reports", tags=["报告"])
 app.include_router(system.router, prefix="/api/system", tags=["系统"])
 
@@ -1,6 +1,7 @@
 import React, { useState, useEffect, useRef, useCallback } from 'react';
 import { PaperAirplaneIcon, DocumentArrowUpIcon, ClipboardDocumentIcon, ArrowPathIcon } from '@heroicons/react/24/outline';
 import { chatAPI, reportAPI } from '../services/api';
+import { ChatSocket } from '../services/chatSocket';
 import { ChatSession, ChatMessage } from '../types';
 import Layout from '../components/Layout';
 import ReactMarkdown from 'react-markdown';
@@ -13,6 +14,7 @@ const Chat: React.FC = () => {
   const [messages, setMessages] = useState<ChatMessage[]>([]);
   const [inputMessage, setInputMessage] = useState('');
   const [loading, setLoading] = useState(false);
+  const [streaming, setStreaming] = useState(false);
   const [creatingSession, setCreatingSession] = useState(false);
   const [showDeleteModal, setShowDeleteModal] = useState(false);
   const [sessionToDelete, setSessionToDelete] = useState<ChatSession | null>(null);
@@ -25,10 +27,20 @@ const Chat: React.FC = () => {
   const [updatingSession, setUpdatingSession] = useState(false);
   const [showCopySuccess, setShowCopySuccess] = useState(false);
   const [regeneratingMessageId, setRegeneratingMessageId] = useState<number | null>(null);
+  // 分页游标：为 null 表示已加载全部
+  const [sessionsCursor, setSessionsCursor] = useState<number | null>(null);
+  const [messagesCursor, setMessagesCursor] = useState<number | null>(null);
+  const [loadingMoreSessions, setLoadingMoreSessions] = useState(false);
+  const [loadingOlderMessages, setLoadingOlderMessages] = useState(false);
   const messagesEndRef = useRef<HTMLDivElement>(null);
+  const messagesContainerRef = useRef<HTMLDivElement>(null);
+  // 加载更早消息前的内容高度，用于保持滚动位置
+  const restoreScrollHeightRef = useRef<number | null>(null);
+  const activeSessionIdRef = useRef<number | null>(null);
   const fileInputRef = useRef<HTMLInputElement>(null);
   const isLoadingSessionsRef = useRef(false);
   const isLoadingMessagesRef = useRef(false);
+  const chatSocketRef = useRef<ChatSocket | null>(null);
   const { user } = useUser();
 
   // 从localStorage加载侧边栏状态
@@ -55,8 +67,9 @@ const Chat: React.FC = () => {
 
     isLoadingMessagesRef.current = true;
     try {
-      const data = await chatAPI.getMessages(sessionId);
-      setMessages(data);
+      const page = await chatAPI.getMessages(sessionId);
+      setMessages(page.items);
+      setMessagesCursor(page.nextCursor);
     } catch (error) {
       console.error('加载消息失败:', error);
     } finally {
@@ -69,8 +82,10 @@ const Chat: React.FC = () => {
 
     isLoadingSessionsRef.current = true;
     try {
-      const data = await chatAPI.getSessions();
+      const page = await chatAPI.getSessions();
+      const data = page.items;
       setSessions(data);
+      setSessionsCursor(page.nextCursor);
       // 只在没有当前会话且有会话数据时设置第一个会话
       if (data.length > 0 && !currentSession) {
         setCurrentSession(data[0]);
@@ -83,12 +98,51 @@ const Chat: React.FC = () => {
     // eslint-disable-next-line react-hooks/exhaustive-deps
   }, []); // 空依赖数组
 
+  // 加载下一页会话，追加到列表末尾
+  const loadMoreSessions = async () => {
+    if (sessionsCursor === null || loadingMoreSessions) return;
+
+    setLoadingMoreSessions(true);
+    try {
+      const page = await chatAPI.getSessions(sessionsCursor);
+      // 会话更新后会移到列表顶部，翻页结果可能与已加载的会话重复
+      setSessions(prev => [...prev, ...page.items.filter(item => !prev.some(s => s.id === item.id))]);
+      setSessionsCursor(page.nextCursor);
+    } catch (error) {
+      console.error('加载更多会话失败:', error);
+    } finally {
+      setLoadingMoreSessions(false);
+    }
+  };
+
+  // 加载当前会话更早的消息，插入到列表开头
+  const loadOlderMessages = async () => {
+    if (!currentSession || messagesCursor === null || loadingOlderMessages) return;
+
+    const sessionId = currentSession.id;
+    setLoadingOlderMessages(true);
+    try {
+      const page = await chatAPI.getMessages(sessionId, messagesCursor);
+      // 等待期间切换了会话则丢弃结果
+      if (activeSessionIdRef.current !== sessionId) return;
+      restoreScrollHeightRef.current = messagesContainerRef.current?.scrollHeight ?? null;
+      setMessages(prev => [...page.items, ...prev]);
+      setMessagesCursor(page.nextCursor);
+    } catch (error) {
+      console.error('加载更早的消息失败:', error);
+    } finally {
+      setLoadingOlderMessages(false);
+    }
+  };
+
   useEffect(() => {
     loadSessions();
     // eslint-disable-next-line react-hooks/exhaustive-deps
   }, []); // 只在组件挂载时执行一次
 
   useEffect(() => {
+    activeSessionIdRef.current = currentSession?.id ?? null;
+    setMessagesCursor(null);
     if (currentSession) {
       loadMessages(currentSession.id);
     }
@@ -96,9 +150,34 @@ const Chat: React.FC = () => {
   }, [currentSession?.id]); // 只依赖 session ID
 
   useEffect(() => {
+    // 加载更早的消息后保持当前可见位置，其余情况滚动到底部
+    const container = messagesContainerRef.current;
+    if (restoreScrollHeightRef.current !== null && container) {
+      container.scrollTop += container.scrollHeight - restoreScrollHeightRef.current;
+      restoreScrollHeightRef.current = null;
+      return;
+    }
     scrollToBottom();
   }, [messages]);
 
+  // 聊天 WebSocket：连接可用时发送消息和重新生成都走流式通道，并实时更新会话列表
+  useEffect(() => {
+    const socket = new ChatSocket();
+    chatSocketRef.current = socket;
+    socket.connect();
+    const unsubscribe = socket.onSessionUpdated(updated => {
+      setSessions(prev => [
+        { ...prev.find(s => s.id === updated.id), ...updated },
+        ...prev.filter(s => s.id !== updated.id),
+      ]);
+    });
+    return () => {
+      unsubscribe();
+      socket.close();
+      chatSocketRef.current = null;
+    };
+  }, []);
+
   const createNewSession = async () => {
     setCreatingSession(true);
     try {
@@ -221,8 +300,28 @@ const Chat: React.FC = () => {
     setLoading(true);
 
     try {
-      const response = await chatAPI.sendMessage(inputMessage, currentSession.id);
-      setMessages(prev => [...prev, response]);
+      const socket = chatSocketRef.current;
+      if (socket?.isReady) {
+        // 流式接收回复：首个片段到达时插入占位消息，之后逐段追加
+        const placeholderId = Date.now() + 1;
+        const response = await socket.sendMessage(inputMessage, currentSession.id, {
+          onUserMessage: saved => {
+            setMessages(prev => prev.map(msg => msg.id === userMessage.id ? saved : msg));
+          },
+          onToken: content => {
+            setStreaming(true);
+            setMessages(prev => prev.some(msg => msg.id === placeholderId)
+              ? prev.map(msg => msg.id === placeholderId ? { ...msg, content: msg.content + content } : msg)
+              : [...prev, { ...userMessage, id: placeholderId, role: 'assistant', content }]);
+          },
+        });
+        setMessages(prev => response
+          ? [...prev.filter(msg => msg.id !== placeholderId), response]
+          : prev.filter(msg => msg.id !== placeholderId));
+      } else {
+        const response = await chatAPI.sendMessage(inputMessage, currentSession.id);
+        setMessages(prev => [...prev, response]);
+      }
     } catch (error) {
       console.error('发送消息失败:', error);
       const errorMessage: ChatMessage = {
@@ -236,6 +335,7 @@ const Chat: React.FC = () => {
       setMessages(prev => [...prev, errorMessage]);
     } finally {
       setLoading(false);
+      setStreaming(false);
     }
   };
 
@@ -269,16 +369,18 @@ const Chat: React.FC = () => {
         createdNewSession = true;
       }
 
-      // 上传报告到指定的会话
-      const newReport = await reportAPI.uploadReport(file, targetSessionId);
+      // 上传报告到指定的会话，服务端保存文件后立即返回分析任务
+      const job = await reportAPI.uploadReport(file, targetSessionId);
 
-      // 重新加载消息以获取完整的对话
-      if (newReport.session_id) {
-        await loadMessages(newReport.session_id);
+      if (job.session_id) {
+        // 先显示上传消息，分析完成后再加载分析结果
+        await loadMessages(job.session_id);
         // 如果创建了新会话，重新加载会话列表
         if (createdNewSession) {
           await loadSessions();
         }
+        await reportAPI.waitForReportJob(job.id);
+        await loadMessages(job.session_id);
       }
 
     } catch (error) {
@@ -333,12 +435,28 @@ const Chat: React.FC = () => {
   const regenerateMessage = async (messageId: number) => {
     setRegeneratingMessageId(messageId);
     try {
-      const regeneratedMessage = await chatAPI.regenerateMessage(messageId);
+      const socket = chatSocketRef.current;
+      let regeneratedMessage;
+      if (socket?.isReady) {
+        // 流式重新生成：清空原内容后逐段显示新回复
+        let started = false;
+        regeneratedMessage = await socket.regenerateMessage(messageId, content => {
+          const first = !started;
+          started = true;
+          setMessages(prev => prev.map(msg =>
+            msg.id === messageId ? { ...msg, content: first ? content : msg.content + content } : msg
+          ));
+        });
+      } else {
+        regeneratedMessage = await chatAPI.regenerateMessage(messageId);
+      }
 
       // 更新消息列表中的对应消息
-      setMessages(prev => prev.map(msg =>
-        msg.id === messageId ? regeneratedMessage : msg
-      ));
+      if (regeneratedMessage) {
+        setMessages(prev => prev.map(msg =>
+          msg.id === messageId ? regeneratedMessage! : msg
+        ));
+      }
     } catch (error) {
       console.error('重新生成消息失败:', error);
       alert('重新生成消息失败，请重试');
@@ -484,6 +602,15 @@ const Chat: React.FC = () => {
                 )}
               </div>
             ))}
+            {sessionsCursor !== null && !sidebarCollapsed && (
+              <button
+                onClick={loadMoreSessions}
+                disabled={loadingMoreSessions}
+                className="w-full p-3 text-sm text-blue-600 dark:text-blue-400 hover:bg-gray-50 dark:hover:bg-gray-700 disabled:opacity-50 transition-colors duration-200"
+              >
+                {loadingMoreSessions ? '加载中...' : '加载更多会话'}
+              </button>
+            )}
           </div>
 
           {/* 侧边栏底部收起/展开按钮 */}
@@ -633,14 +760,34 @@ const Chat: React.FC = () => {
                   </div>
                 </div>
               ))}
+              {sessionsCursor !== null && (
+                <button
+                  onClick={loadMoreSessions}
+                  disabled={loadingMoreSessions}
+                  className="w-full p-3 text-sm text-blue-600 dark:text-blue-400 hover:bg-gray-50 disabled:opacity-50 transition-colors duration-200"
+                >
+                  {loadingMoreSessions ? '加载中...' : '加载更多会话'}
+                </button>
+              )}
             </div>
           )}
 
           {currentSession ? (
             <>
               {/* 消息列表 */}
-              <div className="flex-1 overflow-y-auto p-6">
+              <div ref={messagesContainerRef} className="flex-1 overflow-y-auto p-6">
                 <div className="w-full space-y-4">
+                {messagesCursor !== null && (
+                  <div className="flex justify-center">
+                    <button
+                      onClick={loadOlderMessages}
+                      disabled={loadingOlderMessages}
+                      className="px-3 py-1 text-sm text-blue-600 dark:text-blue-400 hover:underline disabled:opacity-50"
+                    >
+                      {loadingOlderMessages ? '加载中...' : '加载更早的消息'}
+                    </button>
+                  </div>
+                )}
                                                 {messages.map((message) => (
                   <div
                     key={message.id}
@@ -784,7 +931,7 @@ const Chat: React.FC = () => {
                     )}
                   </div>
                 ))}
-                {loading && (
+                {loading && !streaming && (
                   <div className="flex justify-start">
                     <div className="bg-white dark:bg-gray-800 text-gray-900 dark:text-white px-4 py-3 rounded-2xl border border-gray-200 dark:border-gray-700 shadow-sm">
                       <div className="flex space-x-1">
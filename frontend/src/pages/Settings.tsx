@@ -131,7 +131,11 @@ const Settings: React.FC = () => {
     if (!settings) return;
 
     if (key === 'preferred_model') {
-      setSettings({ ...settings, preferred_model: value });
+      setSettings({
+        ...settings,
+        preferred_model: value,
+        fallback_models: (settings.fallback_models || []).filter((id) => id !== value)
+      });
     } else if (key.startsWith('api_keys.')) {
       const apiKey = key.split('.')[1];
       setSettings({
@@ -147,6 +151,18 @@ const Settings: React.FC = () => {
     }
   };
 
+  const toggleFallbackModel = (modelId: string) => {
+    if (!settings) return;
+
+    const current = settings.fallback_models || [];
+    setSettings({
+      ...settings,
+      fallback_models: current.includes(modelId)
+        ? current.filter((id) => id !== modelId)
+        : [...current, modelId]
+    });
+  };
+
   const maskApiKey = (key: string) => {
     if (!key) return '';
     if (key.length <= 8) return '*'.repeat(key.length);
@@ -283,6 +299,41 @@ const Settings: React.FC = () => {
                   </div>
                 </div>
 
+                {/* 备用模型（故障切换） */}
+                <div>
+                  <h4 className="text-lg font-semibold text-gray-900 dark:text-white mb-2">
+                    备用模型
+                  </h4>
+                  <p className="text-sm text-gray-500 dark:text-gray-400 mb-4">
+                    首选模型出错或响应过慢时，按勾选顺序自动切换到备用模型（需要已配置API密钥）
+                  </p>
+                  <div className="flex flex-wrap gap-3">
+                    {availableModels
+                      .filter((model) => model.id !== settings.preferred_model)
+                      .map((model) => {
+                        const fallbackModels = settings.fallback_models || [];
+                        const order = fallbackModels.indexOf(model.id);
+                        const isSelected = order !== -1;
+
+                        return (
+                          <button
+                            key={model.id}
+                            type="button"
+                            onClick={() => toggleFallbackModel(model.id)}
+                            className={`px-3 py-2 rounded-lg border-2 text-sm transition-colors duration-200 ${
+                              isSelected
+                                ? 'border-blue-500 bg-blue-50 dark:bg-blue-900/30 text-blue-700 dark:text-blue-300'
+                                : 'border-gray-200 dark:border-gray-600 text-gray-600 dark:text-gray-400 hover:border-gray-300 dark:hover:border-gray-500'
+                            }`}
+                          >
+                            {isSelected && `${order + 1}. `}
+                            {model.name}
+                          </button>
+                        );
+                      })}
+                  </div>
+                </div>
+
                 {/* API密钥配置 */}
                 <div>
                   <h4 className="text-lg font-semibold text-gray-900 dark:text-white mb-4">
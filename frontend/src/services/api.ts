@@ -1,5 +1,5 @@
 import axios from 'axios';
-import { User, ChatSession, ChatMessage, LoginForm, RegisterForm, AuthResponse, UserSettings } from '../types';
+import { User, ChatSession, ChatMessage, CursorPage, LoginForm, RegisterForm, AuthResponse, UserSettings, Report, ReportDetail, ReportJob } from '../types';
 
 const API_BASE_URL = 'http://localhost:8000/api';
 
@@ -32,6 +32,12 @@ api.interceptors.response.use(
   }
 );
 
+// 读取分页响应头 X-Next-Cursor
+const toCursorPage = <T>(res: { data: T[]; headers: Record<string, any> }): CursorPage<T> => {
+  const cursor = res.headers['x-next-cursor'];
+  return { items: res.data, nextCursor: cursor ? Number(cursor) : null };
+};
+
 // 认证相关 API
 export const authAPI = {
   login: (data: LoginForm): Promise<AuthResponse> =>
@@ -71,8 +77,9 @@ export const chatAPI = {
   createSession: (title: string): Promise<ChatSession> =>
     api.post('/chat/sessions', { title }).then(res => res.data),
 
-  getSessions: (): Promise<ChatSession[]> =>
-    api.get('/chat/sessions').then(res => res.data),
+  // 按更新时间倒序分页，before 传上一页返回的 nextCursor
+  getSessions: (before?: number, limit = 50): Promise<CursorPage<ChatSession>> =>
+    api.get('/chat/sessions', { params: { limit, before } }).then(toCursorPage),
 
   getSession: (sessionId: number): Promise<ChatSession> =>
     api.get(`/chat/sessions/${sessionId}`).then(res => res.data),
@@ -86,8 +93,9 @@ export const chatAPI = {
   sendMessage: (content: string, sessionId?: number): Promise<ChatMessage> =>
     api.post('/chat/messages', { content, session_id: sessionId }).then(res => res.data),
 
-  getMessages: (sessionId: number): Promise<ChatMessage[]> =>
-    api.get(`/chat/sessions/${sessionId}/messages`).then(res => res.data),
+  // 默认返回最新的一页（按时间正序），beforeId 传上一页返回的 nextCursor 获取更早的消息
+  getMessages: (sessionId: number, beforeId?: number, limit = 100): Promise<CursorPage<ChatMessage>> =>
+    api.get(`/chat/sessions/${sessionId}/messages`, { params: { limit, before_id: beforeId } }).then(toCursorPage),
 
   regenerateMessage: (messageId: number): Promise<ChatMessage> =>
     api.post(`/chat/messages/${messageId}/regenerate`).then(res => res.data),
@@ -95,7 +103,8 @@ export const chatAPI = {
 
 // 报告相关 API
 export const reportAPI = {
-  uploadReport: (file: File, sessionId?: number): Promise<ChatMessage> => {
+  // 上传后立即返回分析任务（202），分析结果由后台任务写入会话
+  uploadReport: (file: File, sessionId?: number): Promise<ReportJob> => {
     const formData = new FormData();
     formData.append('file', file);
 
@@ -112,9 +121,28 @@ export const reportAPI = {
     }).then(res => res.data);
   },
 
-  getReports: (): Promise<ChatMessage[]> =>
-    api.get('/reports').then(res => res.data),
-
-  getReport: (messageId: number): Promise<ChatMessage> =>
-    api.get(`/reports/${messageId}`).then(res => res.data),
+  getReports: (limit = 50, before?: number): Promise<Report[]> =>
+    api.get('/reports', { params: { limit, before } }).then(res => res.data),
+
+  getReport: (reportId: number): Promise<ReportDetail> =>
+    api.get(`/reports/${reportId}`).then(res => res.data),
+
+  getReportJob: (jobId: number): Promise<ReportJob> =>
+    api.get(`/reports/jobs/${jobId}`).then(res => res.data),
+
+  // 轮询任务状态直到完成或失败
+  waitForReportJob: async (
+    jobId: number,
+    onProgress?: (job: ReportJob) => void,
+    intervalMs = 1500
+  ): Promise<ReportJob> => {
+    for (;;) {
+      const job: ReportJob = await api.get(`/reports/jobs/${jobId}`).then(res => res.data);
+      onProgress?.(job);
+      if (job.status === 'completed' || job.status === 'failed') {
+        return job;
+      }
+      await new Promise(resolve => setTimeout(resolve, intervalMs));
+    }
+  },
 };
@@ -0,0 +1,190 @@
+import { ChatMessage, ChatSession } from '../types';
+
+const WS_URL = 'ws://localhost:8000/api/chat/ws';
+
+// 服务端关闭码
+const CLOSE_UNAUTHORIZED = 4401;
+
+// 断线重连间隔（毫秒），逐次翻倍
+const RECONNECT_BASE_MS = 1000;
+const RECONNECT_MAX_MS = 30000;
+
+interface PendingRequest {
+  onUserMessage?: (message: ChatMessage) => void;
+  onToken?: (content: string) => void;
+  resolve: (message: ChatMessage | null) => void;
+  reject: (error: Error) => void;
+}
+
+export interface SendHandlers {
+  onUserMessage?: (message: ChatMessage) => void;
+  onToken?: (content: string) => void;
+}
+
+/**
+ * 聊天 WebSocket 客户端
+ * 连接建立后先发送认证帧，收到 ready 后复用同一连接收发消息；
+ * 回复服务端心跳，长时间收不到任何帧时主动断开，并按退避间隔自动重连。
+ */
+export class ChatSocket {
+  private ws: WebSocket | null = null;
+  private ready = false;
+  private closedByUser = false;
+  private reconnectDelay = RECONNECT_BASE_MS;
+  private reconnectTimer: ReturnType<typeof setTimeout> | null = null;
+  private idleTimer: ReturnType<typeof setTimeout> | null = null;
+  private idleTimeoutMs = 60000;
+  private nextRequestId = 1;
+  private pending = new Map<string, PendingRequest>();
+  private sessionListeners = new Set<(session: ChatSession) => void>();
+
+  get isReady(): boolean {
+    return this.ready;
+  }
+
+  connect() {
+    const token = localStorage.getItem('token');
+    if (!token || this.ws) return;
+
+    this.closedByUser = false;
+    const ws = new WebSocket(WS_URL);
+    this.ws = ws;
+
+    ws.onopen = () => {
+      ws.send(JSON.stringify({ type: 'auth', token }));
+    };
+
+    ws.onmessage = (event) => {
+      this.resetIdleTimer();
+      let frame: any;
+      try {
+        frame = JSON.parse(event.data);
+      } catch {
+        return;
+      }
+      this.handleFrame(frame);
+    };
+
+    ws.onclose = (event) => {
+      this.ws = null;
+      this.ready = false;
+      this.clearIdleTimer();
+      this.failPending(new Error('WebSocket 连接已断开'));
+
+      if (event.code === CLOSE_UNAUTHORIZED) {
+        // 与 HTTP 接口的 401 处理一致
+        localStorage.removeItem('token');
+        window.location.href = '/login';
+        return;
+      }
+      if (!this.closedByUser) {
+        this.scheduleReconnect();
+      }
+    };
+  }
+
+  close() {
+    this.closedByUser = true;
+    if (this.reconnectTimer) {
+      clearTimeout(this.reconnectTimer);
+      this.reconnectTimer = null;
+    }
+    this.ws?.close();
+  }
+
+  onSessionUpdated(listener: (session: ChatSession) => void): () => void {
+    this.sessionListeners.add(listener);
+    return () => {
+      this.sessionListeners.delete(listener);
+    };
+  }
+
+  // 发送消息，逐个回调生成的文本片段，完成后返回保存的AI回复（未生成任何内容时为 null）
+  sendMessage(content: string, sessionId: number, handlers: SendHandlers = {}): Promise<ChatMessage | null> {
+    return this.request({ type: 'send', session_id: sessionId, content }, handlers);
+  }
+
+  // 重新生成AI回复，完成后返回更新后的消息
+  regenerateMessage(messageId: number, onToken?: (content: string) => void): Promise<ChatMessage | null> {
+    return this.request({ type: 'regenerate', message_id: messageId }, { onToken });
+  }
+
+  private request(frame: Record<string, unknown>, handlers: SendHandlers): Promise<ChatMessage | null> {
+    if (!this.ws || !this.ready) {
+      return Promise.reject(new Error('WebSocket 未连接'));
+    }
+    const requestId = String(this.nextRequestId++);
+    return new Promise((resolve, reject) => {
+      this.pending.set(requestId, { ...handlers, resolve, reject });
+      this.ws!.send(JSON.stringify({ ...frame, request_id: requestId }));
+    });
+  }
+
+  private handleFrame(frame: any) {
+    switch (frame.type) {
+      case 'ready':
+        this.ready = true;
+        this.reconnectDelay = RECONNECT_BASE_MS;
+        if (frame.heartbeat_interval) {
+          // 连续错过三次心跳视为连接已失效
+          this.idleTimeoutMs = frame.heartbeat_interval * 3000;
+          this.resetIdleTimer();
+        }
+        break;
+      case 'ping':
+        this.ws?.send(JSON.stringify({ type: 'pong' }));
+        break;
+      case 'user_message':
+        this.pending.get(frame.request_id)?.onUserMessage?.(frame.message);
+        break;
+      case 'token':
+        this.pending.get(frame.request_id)?.onToken?.(frame.content);
+        break;
+      case 'done': {
+        const request = this.pending.get(frame.request_id);
+        this.pending.delete(frame.request_id);
+        request?.resolve(frame.message);
+        break;
+      }
+      case 'error': {
+        const request = frame.request_id ? this.pending.get(frame.request_id) : undefined;
+        if (request) {
+          this.pending.delete(frame.request_id);
+          request.reject(new Error(frame.detail));
+        } else {
+          console.error('WebSocket 错误:', frame.detail);
+        }
+        break;
+      }
+      case 'session_updated':
+        this.sessionListeners.forEach(listener => listener(frame.session));
+        break;
+    }
+  }
+
+  private failPending(error: Error) {
+    this.pending.forEach(request => request.reject(error));
+    this.pending.clear();
+  }
+
+  private scheduleReconnect() {
+    this.reconnectTimer = setTimeout(() => {
+      this.reconnectTimer = null;
+      this.connect();
+    }, this.reconnectDelay);
+    this.reconnectDelay = Math.min(this.reconnectDelay * 2, RECONNECT_MAX_MS);
+  }
+
+  private resetIdleTimer() {
+    this.clearIdleTimer();
+    if (!this.ready) return;
+    this.idleTimer = setTimeout(() => this.ws?.close(), this.idleTimeoutMs);
+  }
+
+  private clearIdleTimer() {
+    if (this.idleTimer) {
+      clearTimeout(this.idleTimer);
+      this.idleTimer = null;
+    }
+  }
+}
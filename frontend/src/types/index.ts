@@ -22,6 +22,7 @@ export interface UserSettings {
     anthropic: string;
     kimi: string;
   };
+  fallback_models?: string[];
 }
 
 export interface ChatSession {
@@ -29,7 +30,15 @@ export interface ChatSession {
   title: string;
   created_at: string;
   updated_at: string;
-  messages: ChatMessage[];
+  messages?: ChatMessage[];
+  message_count?: number;
+  last_message_preview?: string | null;
+}
+
+// 游标分页结果：nextCursor 来自 X-Next-Cursor 响应头，没有更多数据时为 null
+export interface CursorPage<T> {
+  items: T[];
+  nextCursor: number | null;
 }
 
 export interface ChatMessage {
@@ -43,6 +52,43 @@ export interface ChatMessage {
   created_at: string;
 }
 
+export interface Report {
+  id: number;
+  session_id?: number | null;
+  upload_message_id?: number | null;
+  analysis_message_id?: number | null;
+  filename?: string | null;
+  file_path?: string | null;
+  digest?: string | null;
+  page_count?: number | null;
+  extraction_status?: string | null;
+  model_used?: string | null;
+  created_at: string;
+}
+
+export interface ReportDetail extends Report {
+  analysis?: string | null;
+}
+
+export interface ReportJob {
+  id: number;
+  status: 'queued' | 'running' | 'completed' | 'failed';
+  stage?: string | null;
+  progress: number;
+  attempts: number;
+  max_attempts: number;
+  error?: string | null;
+  session_id?: number | null;
+  upload_message_id?: number | null;
+  analysis_message_id?: number | null;
+  report_id?: number | null;
+  filename?: string | null;
+  next_run_at?: string | null;
+  created_at?: string | null;
+  updated_at?: string | null;
+  finished_at?: string | null;
+}
+
 export interface LoginForm {
   username: string;
   password: string;
@@ -22,9 +22,15 @@ CREATE TABLE IF NOT EXISTS chat_sessions (
     user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
     title VARCHAR(255) NOT NULL,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    summary TEXT,
+    summary_message_id INTEGER
 );
 
+-- 已有数据库补充会话摘要字段
+ALTER TABLE chat_sessions ADD COLUMN IF NOT EXISTS summary TEXT;
+ALTER TABLE chat_sessions ADD COLUMN IF NOT EXISTS summary_message_id INTEGER;
+
 -- 创建聊天消息表（包含报告功能）
 CREATE TABLE IF NOT EXISTS chat_messages (
     id SERIAL PRIMARY KEY,
@@ -37,10 +43,91 @@ CREATE TABLE IF NOT EXISTS chat_messages (
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 
+-- 报告内容缓存（按文件内容 SHA-256）
+CREATE TABLE IF NOT EXISTS report_contents (
+    digest VARCHAR(64) PRIMARY KEY,
+    text TEXT,
+    chunks JSON,
+    page_count INTEGER,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 报告分析缓存（按文件内容 SHA-256 和模型）
+CREATE TABLE IF NOT EXISTS report_analysis_cache (
+    id SERIAL PRIMARY KEY,
+    digest VARCHAR(64) NOT NULL,
+    model VARCHAR NOT NULL,
+    analysis TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT uq_report_analysis_cache_digest_model UNIQUE (digest, model)
+);
+
+-- 报告记录（元数据及关联的上传/分析消息）
+CREATE TABLE IF NOT EXISTS reports (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    session_id INTEGER REFERENCES chat_sessions(id) ON DELETE CASCADE,
+    upload_message_id INTEGER UNIQUE REFERENCES chat_messages(id) ON DELETE SET NULL,
+    analysis_message_id INTEGER REFERENCES chat_messages(id) ON DELETE SET NULL,
+    filename VARCHAR,
+    file_path VARCHAR,
+    digest VARCHAR(64),
+    page_count INTEGER,
+    extraction_status VARCHAR DEFAULT 'success',
+    model_used VARCHAR,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 报告提取与分析任务（数据库队列）
+CREATE TABLE IF NOT EXISTS report_jobs (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    session_id INTEGER REFERENCES chat_sessions(id) ON DELETE CASCADE,
+    upload_message_id INTEGER REFERENCES chat_messages(id) ON DELETE SET NULL,
+    analysis_message_id INTEGER REFERENCES chat_messages(id) ON DELETE SET NULL,
+    report_id INTEGER REFERENCES reports(id) ON DELETE SET NULL,
+    filename VARCHAR,
+    file_path VARCHAR,
+    file_type VARCHAR,
+    digest VARCHAR(64),
+    status VARCHAR DEFAULT 'queued',
+    stage VARCHAR DEFAULT 'queued',
+    progress INTEGER DEFAULT 0,
+    attempts INTEGER DEFAULT 0,
+    max_attempts INTEGER DEFAULT 3,
+    error TEXT,
+    next_run_at TIMESTAMP,
+    worker_id VARCHAR,
+    locked_until TIMESTAMP,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP WITH TIME ZONE
+);
+
+-- 模型回复缓存（按请求内容哈希）
+CREATE TABLE IF NOT EXISTS llm_response_cache (
+    key VARCHAR(64) PRIMARY KEY,
+    provider VARCHAR,
+    model VARCHAR,
+    response TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
 -- 创建索引
-CREATE INDEX IF NOT EXISTS idx_chat_sessions_user_id ON chat_sessions(user_id);
-CREATE INDEX IF NOT EXISTS idx_chat_messages_session_id ON chat_messages(session_id);
 CREATE INDEX IF NOT EXISTS idx_chat_messages_type ON chat_messages(message_type);
+-- 复合索引：会话列表按 (user_id, updated_at)，消息分页按 (session_id, id)
+-- 原单列索引是复合索引的前缀，已无用处，删除以减少写入开销
+DROP INDEX IF EXISTS idx_chat_sessions_user_id;
+DROP INDEX IF EXISTS idx_chat_messages_session_id;
+CREATE INDEX IF NOT EXISTS ix_chat_sessions_user_updated ON chat_sessions(user_id, updated_at);
+CREATE INDEX IF NOT EXISTS ix_chat_messages_session_id_id ON chat_messages(session_id, id);
+-- 报告列表改为查询 reports 表，不再需要按消息类型查找报告消息
+DROP INDEX IF EXISTS ix_chat_messages_session_type_created;
+CREATE INDEX IF NOT EXISTS ix_reports_user_created ON reports(user_id, created_at);
+CREATE INDEX IF NOT EXISTS ix_reports_session_id ON reports(session_id);
+CREATE INDEX IF NOT EXISTS ix_report_jobs_status_next_run ON report_jobs(status, next_run_at);
+CREATE INDEX IF NOT EXISTS ix_report_jobs_session_id ON report_jobs(session_id);
+CREATE INDEX IF NOT EXISTS ix_llm_response_cache_created_at ON llm_response_cache(created_at);
 
 -- 创建更新时间触发器函数
 CREATE OR REPLACE FUNCTION update_updated_at_column()